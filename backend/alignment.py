@@ -0,0 +1,230 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# As-of alignment of the Cortex streams (com, fac, pow, ...) on a common timeline
+#   1. Every sample is kept in columns (numpy arrays, one per field) with its Cortex 'time'
+#   2. A join finds for every time of a timeline the sample of each stream at or before it (backward), at or after it
+#      (forward) or closest to it (nearest) - vectorised with searchsorted. Samples further away than the tolerance
+#      are not joined (NaN / None)
+#   3. The same join works live (StreamAligner, fed by the Cortex callbacks) and offline (asof_join on columns read
+#      from files, i.e. the Cortex export of a session)
+#
+# Usage: python backend/alignment.py base.csv other.csv [other.csv ...] --tolerance 0.1 -o aligned.csv
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore
+import argparse
+import csv
+import numpy as np
+
+
+# Columns kept per stream - float columns are numpy float arrays, the others object arrays
+STREAM_COLUMNS = {'com': {'action': str, 'power': float},
+                  'fac': {'eyeAct': str, 'uAct': str, 'uPow': float, 'lAct': str, 'lPow': float},
+                  'pow': {'theta': float, 'alpha': float, 'beta': float}}
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Index of the joined sample for every base time (-1 = nothing within the tolerance)
+# times must be sorted ascending
+def asof_indices(base_times, times, tolerance, direction='backward'):
+    base_times = np.asarray(base_times, dtype=float)
+    times = np.asarray(times, dtype=float)
+    n = len(times)
+    if n == 0:
+        return np.full(len(base_times), -1)
+
+    before = np.searchsorted(times, base_times, side='right') - 1  # last sample at or before
+    after = np.searchsorted(times, base_times, side='left')  # first sample at or after
+    before_gap = np.where(before >= 0, base_times - times[np.clip(before, 0, n - 1)], np.inf)
+    after_gap = np.where(after < n, times[np.clip(after, 0, n - 1)] - base_times, np.inf)
+
+    if direction == 'backward':
+        index, gap = before, before_gap
+    elif direction == 'forward':
+        index, gap = after, after_gap
+    elif direction == 'nearest':
+        use_after = after_gap < before_gap
+        index = np.where(use_after, after, before)
+        gap = np.where(use_after, after_gap, before_gap)
+    else:
+        raise ValueError('Unknown direction {0}. Use backward, forward or nearest.'.format(direction))
+    return np.where(gap <= tolerance, index, -1)
+
+
+# Columns of a stream joined onto the base times - {name: array}, NaN (float) or None (other) without a match
+def asof_join(base_times, times, columns, tolerance, direction='backward'):
+    index = asof_indices(base_times, times, tolerance, direction)
+    matched = index >= 0
+    joined = {}
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if values.dtype.kind == 'f':
+            out = np.full(len(index), np.nan)
+        else:
+            out = np.full(len(index), None, dtype=object)
+        out[matched] = values[index[matched]]
+        joined[name] = out
+    return joined
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class ColumnBuffer():
+    # Samples of one stream in growing numpy columns (the oldest half is dropped above max_samples)
+    def __init__(self, columns, capacity=1024, max_samples=100000):
+        self.types = columns
+        self.max_samples = max_samples
+        self.count = 0
+        self.sorted = True
+        self.times = np.empty(capacity)
+        self.columns = {name: np.empty(capacity, dtype=float if kind is float else object)
+                        for name, kind in columns.items()}
+
+
+    def append(self, time, data):
+        if self.count == len(self.times):
+            self.grow()
+        if self.count > 0 and time < self.times[self.count - 1]:
+            self.sorted = False  # sorted again before the next join
+        self.times[self.count] = time
+        for name, kind in self.types.items():
+            value = data.get(name)
+            self.columns[name][self.count] = value if kind is not float or value is not None else np.nan
+        self.count += 1
+
+
+    def grow(self):
+        if self.count >= self.max_samples:
+            keep = self.count // 2
+            self.times[:keep] = self.times[self.count - keep:self.count]
+            for column in self.columns.values():
+                column[:keep] = column[self.count - keep:self.count]
+            self.count = keep
+            return
+        self.times = np.resize(self.times, len(self.times) * 2)
+        for name in self.columns:
+            self.columns[name] = np.resize(self.columns[name], len(self.times))
+
+
+    # Views of the filled part (sorted by time)
+    def view(self):
+        if not self.sorted:
+            order = np.argsort(self.times[:self.count], kind='stable')
+            self.times[:self.count] = self.times[:self.count][order]
+            for column in self.columns.values():
+                column[:self.count] = column[:self.count][order]
+            self.sorted = True
+        return self.times[:self.count], {name: column[:self.count] for name, column in self.columns.items()}
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class StreamAligner():
+    """
+    Live columns of the streams with as-of joins on any timeline (thread safe).
+
+    Attributes
+    ----------
+    streams : dict
+        stream -> {column: type} (see STREAM_COLUMNS)
+
+    Methods
+    -------
+    add(stream, time, data):
+        Add a sample (dictionary of column values) of a stream
+    align(base_times, streams, tolerance, direction):
+        Columns of the streams joined onto the base times - {'stream.column': array}
+    timeline(stream):
+        Times of the samples of a stream (i.e. as base times)
+    clear():
+        Remove all samples
+    """
+    def __init__(self, streams=STREAM_COLUMNS, max_samples=100000):
+        self.streams = streams
+        self.max_samples = max_samples
+        self.lock = Semaphore(1)
+        self.clear()
+
+
+    def clear(self):
+        self.lock.acquire()
+        self.buffers = {stream: ColumnBuffer(columns, max_samples=self.max_samples)
+                        for stream, columns in self.streams.items()}
+        self.lock.release()
+
+
+    def add(self, stream, time, data):
+        self.lock.acquire()
+        buffer = self.buffers.get(stream)
+        if buffer is not None:
+            buffer.append(time, data)
+        self.lock.release()
+
+
+    def align(self, base_times, streams=None, tolerance=0.25, direction='backward'):
+        aligned = {}
+        self.lock.acquire()
+        for stream in (streams or self.buffers.keys()):
+            times, columns = self.buffers[stream].view()
+            for name, values in asof_join(base_times, times, columns, tolerance, direction).items():
+                aligned[stream + '.' + name] = values
+        self.lock.release()
+        return aligned
+
+
+    def timeline(self, stream):
+        self.lock.acquire()
+        times = self.buffers[stream].view()[0].copy()
+        self.lock.release()
+        return times
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Offline - columns of a CSV file with a time column (numbers where every value is a number)
+def read_columns(path, time_column='time'):
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    rows.sort(key=lambda row: float(row[time_column]))
+    times = np.array([float(row[time_column]) for row in rows])
+    columns = {}
+    for name in (rows[0].keys() if len(rows) > 0 else []):
+        if name == time_column:
+            continue
+        values = [row[name] for row in rows]
+        try:
+            columns[name] = np.array(values, dtype=float)
+        except ValueError:
+            columns[name] = np.array(values, dtype=object)
+    return times, columns
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='As-of join of CSV streams onto the times of a base CSV.')
+    parser.add_argument('base', help='CSV with the timeline (and its own columns)')
+    parser.add_argument('others', nargs='+', help='CSVs joined onto the timeline')
+    parser.add_argument('--time-column', default='time')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='largest time difference (s)')
+    parser.add_argument('--direction', choices=['backward', 'forward', 'nearest'], default='backward')
+    parser.add_argument('-o', '--output', default='aligned.csv')
+    args = parser.parse_args()
+
+    base_times, table = read_columns(args.base, args.time_column)
+    for path in args.others:
+        times, columns = read_columns(path, args.time_column)
+        prefix = path.rsplit('/', 1)[-1].rsplit('.', 1)[0] + '.'
+        for name, values in asof_join(base_times, times, columns, args.tolerance, args.direction).items():
+            table[prefix + name] = values
+
+    with open(args.output, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow([args.time_column] + list(table.keys()))
+        w.writerows(zip(base_times, *table.values()))
+    print('{0} rows written to {1}'.format(len(base_times), args.output))
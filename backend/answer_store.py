@@ -0,0 +1,166 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Transactional store of the answers of all sessions (replaces the appends to user_responses.txt)
+#   1. One SQLite database (WAL, synchronous=FULL - a committed answer survives a crash or power cut)
+#   2. One persistent connection owned by a writer thread - request threads put rows on a queue
+#   3. Grouped commits - all rows that are queued when the writer wakes up go in one transaction. A request that
+#      acknowledges answers to a page (/save_data) waits for the commit of its rows (flush), so grouping only delays
+#      the response
+#   4. Typed rows: session, question, kind (answer / score / word), answer, selection method, latency (s), time
+#   5. Export to JSON Lines (one answer per line), i.e. answers.jsonl in the session folder when a session stops
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore, Thread, Event
+import logging
+import sqlite3
+import queue
+import json
+import os
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    question INTEGER,
+    kind TEXT NOT NULL,
+    answer TEXT,
+    selection_method TEXT,
+    latency REAL,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_session ON answers(session_id, question);
+'''
+
+COLUMNS = ['session_id', 'question', 'kind', 'answer', 'selection_method', 'latency', 'time']
+INSERT = 'INSERT INTO answers ({0}) VALUES ({1})'.format(', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class AnswerStore():
+    """
+    Answers of all sessions in SQLite, written by one thread with grouped commits.
+
+    Attributes
+    ----------
+    path : str
+        database file (created, with its folder, by the first answer)
+    max_batch : int
+        most rows in one transaction
+
+    Methods
+    -------
+    add(session_id, question, answer, kind, method, latency, time):
+        Queue an answer (non blocking)
+    flush(timeout):
+        Wait until all queued answers are committed - False if that did not happen in time or a commit failed
+    export_jsonl(path, session_id):
+        Write the answers (of one session) as JSON Lines. Returns the number of answers
+    """
+    def __init__(self, path, max_batch=500):
+        self.path = path
+        self.max_batch = max_batch
+        self.queue = queue.Queue()  # unbounded - an answer is never dropped
+        self.lock = Semaphore(1)
+        self.thread = None
+        self.failed_batches = 0  # transactions that could not be committed
+
+
+    def start(self):
+        self.lock.acquire()
+        if self.thread is None:
+            self.thread = Thread(target=self.run, name='AnswerWriterThread', daemon=True)
+            self.thread.start()
+        self.lock.release()
+
+
+    def add(self, session_id, question, answer, kind='answer', method=None, latency=None, time=None):
+        self.start()
+        self.queue.put((session_id, question, kind, None if answer is None else str(answer), method, latency, time))
+
+
+    def flush(self, timeout=5.0):
+        if self.thread is None:
+            return True
+        failed = self.failed_batches
+        done = Event()
+        self.queue.put(done)
+        # rows queued before the event are in its batch or an earlier one - any failure since then may have been theirs
+        return done.wait(timeout) and self.failed_batches == failed
+
+
+    def export_jsonl(self, path, session_id=None):
+        self.flush()
+        if not os.path.exists(self.path):
+            return 0
+        db = sqlite3.connect(self.path)  # readers do not block the writer in WAL mode
+        sql = 'SELECT {0} FROM answers'.format(', '.join(COLUMNS))
+        params = ()
+        if session_id is not None:
+            sql += ' WHERE session_id = ?'
+            params = (session_id,)
+        count = 0
+        with open(path, 'w') as f:
+            for row in db.execute(sql + ' ORDER BY id', params):
+                f.write(json.dumps(dict(zip(COLUMNS, row))) + '\n')
+                count += 1
+        db.close()
+        return count
+
+
+    def run(self):
+        folder = os.path.dirname(self.path)
+        if folder != '':
+            os.makedirs(folder, exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=FULL')
+        db.executescript(SCHEMA)
+
+        while True:
+            # Block for the first item, then take everything that is already queued
+            items = [self.queue.get()]
+            while len(items) < self.max_batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            rows = [item for item in items if not isinstance(item, Event)]
+            if len(rows) > 0:
+                try:
+                    with db:  # one transaction (commit) for the whole batch
+                        db.executemany(INSERT, rows)
+                except sqlite3.Error:
+                    self.failed_batches += 1
+                    logger.exception('Could not store %d answers', len(rows))
+            for item in items:
+                if isinstance(item, Event):
+                    item.set()
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Rows of the answers sent by a page (/save_data)
+#   scores:   {'word': 'SAVEAHAART', 'Q0': 1, 'Q1': 0, ...} -> ('score', 0, 1), ('score', 1, 0), ...
+#   answers:  {'word': 'SAVEAHAART', '0': 'yes', ...}       -> ('answer', 0, 'yes'), ...
+#   the word of the A test is kept as ('word', None, 'SAVEAHAART')
+def page_rows(output):
+    rows = []
+    if not isinstance(output, dict):
+        return [('answer', None, json.dumps(output))]
+    for key, value in output.items():
+        key = str(key)
+        if key == 'word':
+            rows.append(('word', None, value))
+        elif key.startswith('Q') and key[1:].isdigit():
+            rows.append(('score', int(key[1:]), value))
+        elif key.isdigit():
+            rows.append(('answer', int(key), value))
+        else:
+            rows.append((key, None, value))
+    return rows
@@ -0,0 +1,225 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Speech of the ARI robot from the backend (replaces the rosbridge connection of every page)
+#   1. One persistent rosbridge connection (websocket) to the /tts action server of ARI - topics are advertised and
+#      subscribed once, not per page
+#   2. The goals of the fixed utterances (ARI/ARI_Speech.txt, letters and questions) are built when a session starts
+#      and kept in a cache - saying an utterance only adds a goal id and sends it
+#   3. Issue to speech latency (goal sent -> first feedback of the TTS server) is measured per utterance
+# The speech itself is synthesised on the robot (the TTS action has no pre-synthesis), so the cache holds the goals.
+# rosbridge_standin.py is a local stand-in of the robot for testing.
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore, Thread
+from collections import deque
+import websocket  # 'pip install websocket-client' for install
+import logging
+import json
+import time
+import os
+import re
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_URL = os.environ.get('ARI_ROSBRIDGE_URL', 'ws://ari-17c:9090')
+SPEECH_FILE = os.path.join('ARI', 'ARI_Speech.txt')
+TTS_SERVER = '/tts'
+TTS_ACTION = 'pal_interaction_msgs/TtsAction'
+RECONNECT_DELAY = 2.0  # s between connection attempts
+MAX_PENDING_AGE = 5.0  # utterances waiting longer than this (s) for the connection are dropped
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class AriSpeech():
+    """
+    rosbridge client for the text to speech of ARI with a cache of goals and latency measurement.
+
+    Attributes
+    ----------
+    url : str
+        rosbridge websocket of the robot
+    lang_id : str
+        language of the speech
+
+    Methods
+    -------
+    preload(utterances):
+        Connect (if needed) and build the goals of the utterances
+    say(text):
+        Send an utterance (non blocking). Returns the goal id
+    stats():
+        Connection, cache and latency statistics
+    stop():
+        Close the connection
+    """
+    def __init__(self, url=DEFAULT_URL, lang_id='en_GB', max_latencies=1000):
+        self.url = url
+        self.lang_id = lang_id
+        self.lock = Semaphore(1)
+        self.ws = None
+        self.thread = None
+        self.running = False
+        self.connected = False
+        self.cache = {}  # text -> goal message
+        self.hits = 0
+        self.misses = 0
+        self.count = 0
+        self.pending = []  # goals sent before the connection was open
+        self.issued = {}  # goal id -> (text, issue time) until the first feedback
+        self.latencies = deque(maxlen=max_latencies)
+        self.utterances = {}  # text -> {'count', 'last_latency', 'mean_latency'}
+
+
+    def start(self):
+        self.lock.acquire()
+        if self.thread is None:
+            self.running = True
+            self.thread = Thread(target=self.run, name='RosbridgeThread', daemon=True)
+            self.thread.start()
+        self.lock.release()
+
+
+    def stop(self):
+        self.running = False
+        if self.ws is not None:
+            self.ws.close()
+
+
+    def preload(self, utterances):
+        self.start()
+        self.lock.acquire()
+        for text in utterances:
+            if text not in self.cache:
+                self.cache[text] = self.build_goal(text)
+        self.lock.release()
+
+
+    def say(self, text):
+        self.start()
+        self.lock.acquire()
+        goal = self.cache.get(text)
+        if goal is None:
+            self.misses += 1
+            goal = self.build_goal(text)
+            self.cache[text] = goal  # said again later (i.e. the next session)
+        else:
+            self.hits += 1
+        self.count += 1
+        goal_id = 'ari_speech_{0}_{1}'.format(os.getpid(), self.count)
+        message = json.dumps({'op': 'publish', 'topic': TTS_SERVER + '/goal',
+                              'msg': {'goal_id': {'stamp': {'secs': 0, 'nsecs': 0}, 'id': goal_id}, 'goal': goal}})
+        now = time.monotonic()
+        self.issued[goal_id] = (text, now)
+        if self.connected:
+            self.lock.release()
+            self.send(message)
+        else:
+            self.pending.append((now, message))
+            self.lock.release()
+        return goal_id
+
+
+    def stats(self):
+        self.lock.acquire()
+        latencies = sorted(self.latencies)
+        stats = {'url': self.url, 'connected': self.connected, 'cache_size': len(self.cache), 'hits': self.hits,
+                 'misses': self.misses, 'waiting': len(self.issued),
+                 'utterances': {text: dict(entry) for text, entry in self.utterances.items()}}
+        self.lock.release()
+        if len(latencies) > 0:
+            stats['latency'] = {'count': len(latencies), 'mean': sum(latencies) / len(latencies),
+                                'p50': latencies[len(latencies) // 2],
+                                'p90': latencies[int(len(latencies) * 0.9)], 'max': latencies[-1]}
+        return stats
+
+
+    def build_goal(self, text):
+        return {'rawtext': {'text': text, 'lang_id': self.lang_id}}
+
+
+    def send(self, message):
+        try:
+            self.ws.send(message)
+        except (websocket.WebSocketException, OSError, AttributeError) as e:
+            logger.warning('Could not send to rosbridge: %s', e)
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+    # Connection (own thread) - reconnects until stopped
+    def run(self):
+        while self.running:
+            self.ws = websocket.WebSocketApp(self.url, on_open=self.on_open, on_message=self.on_message,
+                                             on_error=self.on_error, on_close=self.on_close)
+            self.ws.run_forever()
+            if self.running:
+                time.sleep(RECONNECT_DELAY)
+
+
+    def on_open(self, *args):
+        logger.info('rosbridge %s opened', self.url)
+        # same topics as the roslib ActionClient of the pages
+        self.send(json.dumps({'op': 'advertise', 'topic': TTS_SERVER + '/goal', 'type': TTS_ACTION + 'Goal'}))
+        self.send(json.dumps({'op': 'advertise', 'topic': TTS_SERVER + '/cancel', 'type': 'actionlib_msgs/GoalID'}))
+        self.send(json.dumps({'op': 'subscribe', 'topic': TTS_SERVER + '/feedback', 'type': TTS_ACTION + 'Feedback'}))
+        self.send(json.dumps({'op': 'subscribe', 'topic': TTS_SERVER + '/result', 'type': TTS_ACTION + 'Result'}))
+
+        # goals sent while not connected - too old ones are dropped (speech long after the page moved on)
+        self.lock.acquire()
+        self.connected = True
+        now = time.monotonic()
+        pending = [message for issue_time, message in self.pending if now - issue_time <= MAX_PENDING_AGE]
+        if len(pending) < len(self.pending):
+            logger.warning('Dropped %d utterances sent before rosbridge was connected', len(self.pending) - len(pending))
+        self.pending = []
+        self.lock.release()
+        for message in pending:
+            self.send(message)
+
+
+    def on_message(self, *args):
+        message = json.loads(args[1])
+        topic = message.get('topic')
+        if topic not in (TTS_SERVER + '/feedback', TTS_SERVER + '/result'):
+            return
+        goal_id = message['msg']['status']['goal_id']['id']
+        now = time.monotonic()
+
+        self.lock.acquire()
+        issued = self.issued.pop(goal_id, None)  # first feedback (or the result) - speech started
+        if issued is not None:
+            text, issue_time = issued
+            latency = now - issue_time
+            self.latencies.append(latency)
+            entry = self.utterances.setdefault(text, {'count': 0, 'last_latency': None, 'mean_latency': 0.0})
+            entry['count'] += 1
+            entry['last_latency'] = latency
+            entry['mean_latency'] += (latency - entry['mean_latency']) / entry['count']
+        self.lock.release()
+        if issued is not None:
+            logger.debug('Speech latency %.3f s: %s', latency, text)
+
+
+    def on_error(self, *args):
+        logger.warning('rosbridge error: %s', args[1])
+
+
+    def on_close(self, *args):
+        self.lock.acquire()
+        self.connected = False
+        self.lock.release()
+        logger.info('rosbridge %s closed', self.url)
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Utterances of the speech file - every text between single quotes (white space of line breaks collapsed)
+def parse_speech_file(path=SPEECH_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    return [' '.join(utterance.split()) for utterance in re.findall(r"'(.+?)'", text, re.S)]
@@ -0,0 +1,164 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# In memory cache of the static assets of the pages (scripts, libraries, style sheets)
+#   1. Built once at startup: every file of the static folder is read, hashed (content hash in the URL, i.e.
+#      javascript/a_test.3f2a9c1b0d4e.js) and compressed with gzip and brotli (if the brotli package is installed) -
+#      a variant is only kept if it is smaller
+#   2. Hashed URLs never change content - they are sent with a one year, immutable cache lifetime, so the browser
+#      does not ask again on page transitions. Plain URLs are revalidated (ETag, 304 without a body)
+#   3. Serving is a dictionary lookup - no file system access and no compression per request
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore
+import mimetypes
+import hashlib
+import gzip
+import os
+
+try:
+    import brotli  # optional - 'pip install brotli' for the br variants
+except ImportError:
+    brotli = None
+
+
+HASH_LENGTH = 12
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class Asset():
+    # One file with its compressed variants - encoding -> (body, etag)
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        root, extension = os.path.splitext(filename)
+        self.hashed_name = '{0}.{1}{2}'.format(root, self.digest, extension)
+        self.content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type == 'application/javascript':
+            self.content_type += '; charset=utf-8'
+
+        self.variants = {'identity': (data, '"{0}"'.format(self.digest))}
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) < len(data):
+            self.variants['gzip'] = (compressed, '"{0}-gzip"'.format(self.digest))
+        if brotli is not None:
+            compressed = brotli.compress(data, quality=11)
+            if len(compressed) < len(data):
+                self.variants['br'] = (compressed, '"{0}-br"'.format(self.digest))
+
+
+
+# Encodings the client accepts (q > 0), i.e. 'gzip, deflate, br;q=0.8'
+def accepted_encodings(header):
+    encodings = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name != '':
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class AssetCache():
+    """
+    Static files held in memory with content hashed names and compressed variants.
+
+    Attributes
+    ----------
+    folder : str
+        static folder (all files below it are cached)
+
+    Methods
+    -------
+    hashed_name(filename):
+        Name with the content hash (the filename itself if it is not cached)
+    response(filename, if_none_match, accept_encoding):
+        (body, status, headers) of a request - None if the file is not cached
+    reload():
+        Read the folder again (i.e. after editing a script)
+    stats():
+        Number of assets, bytes held and requests / 304 / bytes sent per encoding
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = Semaphore(1)
+        self.reload()
+
+
+    def reload(self):
+        assets = {}
+        for directory, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(directory, name)
+                filename = os.path.relpath(path, self.folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    asset = Asset(filename, f.read())
+                assets[filename] = asset
+                assets[asset.hashed_name] = asset
+        self.lock.acquire()
+        self.assets = assets
+        self.requests = {}
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.lock.release()
+
+
+    def hashed_name(self, filename):
+        asset = self.assets.get(filename)
+        return filename if asset is None else asset.hashed_name
+
+
+    def response(self, filename, if_none_match=None, accept_encoding=None):
+        asset = self.assets.get(filename)
+        if asset is None:
+            return None
+
+        accepted = accepted_encodings(accept_encoding)
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.variants and candidate in accepted:
+                encoding = candidate
+                break
+        body, etag = asset.variants[encoding]
+
+        headers = {'Content-Type': asset.content_type, 'ETag': etag, 'Vary': 'Accept-Encoding',
+                   'Cache-Control': IMMUTABLE if filename == asset.hashed_name else REVALIDATE}
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+
+        not_modified = if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(',')]
+        self.lock.acquire()
+        self.requests[encoding] = self.requests.get(encoding, 0) + 1
+        if not_modified:
+            self.not_modified += 1
+        else:
+            self.bytes_sent += len(body)
+        self.lock.release()
+
+        if not_modified:
+            return b'', 304, headers
+        headers['Content-Length'] = str(len(body))
+        return body, 200, headers
+
+
+    def stats(self):
+        assets = {asset.filename: asset for asset in self.assets.values()}
+        self.lock.acquire()
+        stats = {'assets': len(assets), 'brotli': brotli is not None,
+                 'bytes': {encoding: sum(len(asset.variants[encoding][0]) for asset in assets.values()
+                                         if encoding in asset.variants) for encoding in ('identity', 'gzip', 'br')},
+                 'requests': dict(self.requests), 'not_modified': self.not_modified, 'bytes_sent': self.bytes_sent,
+                 'files': {filename: asset.hashed_name for filename, asset in sorted(assets.items())}}
+        self.lock.release()
+        return stats
@@ -0,0 +1,155 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Band power feature extraction for raw EEG frames streamed from Cortex ('eeg' stream)
+# This gives a second, headset-independent selection signal next to the mental command ('com') data:
+#   1. Frames are stored in a fixed size ring buffer (channels x samples)
+#   2. Every hop a new overlapping segment is windowed and transformed once (vectorised across channels)
+#   3. Band power is the Welch average of the last few segment spectra - kept as a running sum so
+#      previous FFT segments are reused instead of recomputed
+# Run this file directly to benchmark the extractor against real time
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+import numpy as np
+from collections import deque
+
+
+# Frequency bands (Hz) - [low, high)
+BANDS = {'theta': (4.0, 8.0), 'alpha': (8.0, 13.0), 'beta': (13.0, 30.0)}
+
+# Columns of the Cortex 'eeg' stream that are not EEG channels (MARKERS is already removed by Cortex.handle_stream_data)
+NON_CHANNEL_LABELS = ['COUNTER', 'INTERPOLATED', 'RAW_CQ', 'MARKER_HARDWARE']
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class BandPowerExtractor():
+    """
+    Incremental per channel band power (theta/alpha/beta) over overlapping FFT segments.
+
+    Attributes
+    ----------
+    sample_rate : int
+        EEG sample rate in Hz (128 for EPOC/Insight, 256 for EPOC+ in high resolution mode)
+    segment_size : int
+        number of samples in one FFT segment
+    hop_size : int
+        number of new samples between two segments - a new result is published every hop
+    n_segments : int
+        number of segments averaged for one result (Welch average)
+
+    Methods
+    -------
+    push(frame, time):
+        Add one frame (one value per channel). Returns a new result every hop_size frames, else None
+    latest():
+        Last published result
+    reset():
+        Clear the ring buffer and the segment history
+    """
+    def __init__(self, n_channels, sample_rate=128, segment_size=128, hop_size=64, n_segments=4, bands=BANDS):
+        if hop_size <= 0 or hop_size > segment_size:
+            raise ValueError('hop_size must be between 1 and segment_size.')
+
+        self.n_channels = n_channels
+        self.sample_rate = sample_rate
+        self.segment_size = segment_size
+        self.hop_size = hop_size
+        self.n_segments = n_segments
+        self.bands = bands
+
+        # Hann window and scaling for a one sided power spectral density
+        self.window = np.hanning(segment_size)
+        self.scale = 1.0 / (sample_rate * np.sum(self.window ** 2))
+        freqs = np.fft.rfftfreq(segment_size, 1.0 / sample_rate)
+        self.df = freqs[1] - freqs[0]
+        # Boolean mask of FFT bins for each band
+        self.band_masks = {name: (freqs >= low) & (freqs < high) for name, (low, high) in bands.items()}
+
+        self.ring = np.zeros((n_channels, segment_size))
+        self.segment = np.empty((n_channels, segment_size))
+        self.psd_sum = np.zeros((n_channels, len(freqs)))
+        self.reset()
+
+
+    def reset(self):
+        self.ring.fill(0.0)
+        self.psd_sum.fill(0.0)
+        self.pos = 0  # next write position in ring buffer
+        self.filled = 0  # number of valid samples in ring buffer
+        self.since_hop = 0  # samples since last segment
+        self.spectra = deque()  # spectra of the segments currently in the Welch average
+        self.result = None
+
+
+    def push(self, frame, time=None):
+        self.ring[:, self.pos] = frame
+        self.pos = (self.pos + 1) % self.segment_size
+        self.filled = min(self.filled + 1, self.segment_size)
+        self.since_hop += 1
+
+        # Only transform once a full segment is available and a hop has passed
+        if self.filled < self.segment_size or self.since_hop < self.hop_size:
+            return None
+        self.since_hop = 0
+        return self._add_segment(time)
+
+
+    def latest(self):
+        return self.result
+
+
+    def _add_segment(self, time):
+        # Unroll ring buffer so the oldest sample comes first (pos points at the oldest sample when full)
+        tail = self.segment_size - self.pos
+        self.segment[:, :tail] = self.ring[:, self.pos:]
+        self.segment[:, tail:] = self.ring[:, :self.pos]
+
+        # Remove DC offset, apply window and transform all channels at once
+        self.segment -= self.segment.mean(axis=1, keepdims=True)
+        spectrum = np.fft.rfft(self.segment * self.window, axis=1)
+        psd = (spectrum.real ** 2 + spectrum.imag ** 2) * self.scale
+        psd[:, 1:-1] *= 2  # one sided spectrum (segment_size is even)
+
+        # Running Welch sum - add newest segment and drop the oldest one
+        self.spectra.append(psd)
+        self.psd_sum += psd
+        if len(self.spectra) > self.n_segments:
+            self.psd_sum -= self.spectra.popleft()
+
+        mean_psd = self.psd_sum / len(self.spectra)
+        self.result = {'time': time}
+        for name, mask in self.band_masks.items():
+            self.result[name] = (mean_psd[:, mask].sum(axis=1) * self.df).tolist()
+        return self.result
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Find the position of the EEG channels within the Cortex 'eeg' stream labels
+def channel_indices(labels):
+    return [i for i, label in enumerate(labels) if label not in NON_CHANNEL_LABELS]
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Benchmark - time needed to process a minute of 14 channel data frame by frame, compared to real time
+if __name__ == '__main__':
+    import time
+
+    n_channels = 14
+    sample_rate = 128
+    seconds = 60
+    data = np.random.randn(seconds * sample_rate, n_channels) * 20
+
+    extractor = BandPowerExtractor(n_channels, sample_rate=sample_rate)
+    start = time.perf_counter()
+    results = 0
+    for i, frame in enumerate(data):
+        if extractor.push(frame, i / sample_rate) is not None:
+            results += 1
+    elapsed = time.perf_counter() - start
+
+    print('processed {0} s of {1} channel data in {2:.3f} s ({3} results)'.format(seconds, n_channels, elapsed, results))
+    print('real time headroom: {0:.0f}x ({1:.1f} us per frame)'.format(seconds / elapsed, elapsed / len(data) * 1e6))
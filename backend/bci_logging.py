@@ -0,0 +1,153 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Logging set up for the backend (replaces print on the hot paths)
+#   1. Modules log through logging.getLogger(__name__) with lazy %-formatting - nothing is formatted
+#      when the level of the module is off
+#   2. The root logger only has a QueueHandler, so a log call never waits for stdout (i.e. journald)
+#   3. A listener thread writes the records to stdout and to an in memory ring of recent events
+#      (served over HTTP by main.py)
+# Per module levels (logger name = module name, i.e. 'cortex', 'backend.live_advance'):
+#   setup_logging(levels={'cortex': 'DEBUG'}) or ARI_LOG_LEVELS="cortex=DEBUG,backend.live_advance=WARNING"
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from logging.handlers import QueueHandler, QueueListener
+from threading import Semaphore
+from collections import deque
+import logging
+import queue
+import json
+import sys
+import os
+
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s'
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class RingBufferHandler(logging.Handler):
+    """
+    Keeps the last log records in memory (runs on the listener thread).
+
+    Methods
+    -------
+    records(limit, level):
+        Newest records (oldest first) at or above level as dictionaries
+    """
+    def __init__(self, size=1000):
+        logging.Handler.__init__(self)
+        self.ring = deque(maxlen=size)
+        self.ring_lock = Semaphore(1)
+
+
+    def emit(self, record):
+        entry = {'time': record.created, 'level': record.levelname, 'logger': record.name,
+                 'thread': record.threadName, 'message': record.getMessage()}
+        self.ring_lock.acquire()
+        self.ring.append(entry)
+        self.ring_lock.release()
+
+
+    def records(self, limit=100, level=logging.NOTSET):
+        level = level_number(level)
+        if limit <= 0:
+            return []
+        self.ring_lock.acquire()
+        entries = [entry for entry in self.ring if logging.getLevelName(entry['level']) >= level]
+        self.ring_lock.release()
+        return entries[-limit:]
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Lazy JSON for debug messages - only dumped when the record is actually formatted
+class lazy_json():
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return json.dumps(self.obj, indent=4)
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+ring_handler = None
+listener = None
+
+
+# Set up the queue handler, listener thread and ring of recent events (only once). Returns the ring handler
+def setup_logging(default_level='INFO', levels=None, ring_size=1000):
+    global ring_handler, listener
+    if listener is not None:
+        set_levels(levels)
+        return ring_handler
+
+    log_queue = queue.Queue(-1)  # unbounded - a log call never blocks
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    ring_handler = RingBufferHandler(ring_size)
+
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(default_level)
+
+    listener = QueueListener(log_queue, stream_handler, ring_handler, respect_handler_level=True)
+    listener.start()
+
+    set_levels(parse_levels(os.environ.get('ARI_LOG_LEVELS', '')))
+    set_levels(levels)
+    return ring_handler
+
+
+# Number of a level name ('debug', 'WARNING') or number - ValueError if it is unknown
+def level_number(level):
+    if isinstance(level, bool) or not isinstance(level, (str, int)):
+        raise ValueError('Unknown log level {0!r}'.format(level))
+    if isinstance(level, int):
+        return level
+    if level.strip().isdigit():  # query string, i.e. /logs?level=30
+        return int(level)
+    number = logging.getLevelName(level.strip().upper())
+    if not isinstance(number, int):
+        raise ValueError('Unknown log level {0!r}'.format(level))
+    return number
+
+
+# Set the level of one or more modules - {'cortex': 'DEBUG', 'backend.live_advance': 'WARNING'}
+# All levels are checked first, so an unknown level changes nothing (ValueError)
+def set_levels(levels):
+    if levels is None:
+        return
+    if not isinstance(levels, dict):
+        raise ValueError('Levels must be an object of logger name -> level')
+    numbers = {name: level_number(level) for name, level in levels.items()}
+    for name, number in numbers.items():
+        logging.getLogger(name).setLevel(number)
+
+
+# 'cortex=DEBUG,backend.live_advance=WARNING' -> {'cortex': 'DEBUG', 'backend.live_advance': 'WARNING'}
+def parse_levels(text):
+    levels = {}
+    for item in text.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip()
+    return levels
+
+
+# Levels of all loggers that have been given their own level
+def get_levels():
+    levels = {'root': logging.getLevelName(logging.getLogger().level)}
+    for name, logger in logging.Logger.manager.loggerDict.items():
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(logger.level)
+    return levels
+
+
+def stop_logging():
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
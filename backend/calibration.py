@@ -0,0 +1,214 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Mental command sensitivity calibration (replaces the fixed sensitivity [7, 7, 5, 5])
+#   1. Short guided trials for every candidate sensitivity: rest, think left, think right (the cue is in state())
+#   2. Measured from the live com stream (no extra thread - driven by the com samples, like selection.py):
+#      time to threshold - time from the start of a left / right trial to the first sample of that action above threshold
+#      false selections - crossings of the threshold by the wrong action or during rest, per second
+#   3. The sensitivity with the lowest score (time to threshold + penalty * false selection rate) is picked and
+#      cached per profile, so the next session starts with it
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore
+import json
+import os
+
+
+DEFAULT_SENSITIVITY = [7, 7, 5, 5]  # [left, right, unused, unused] - used until a profile is calibrated
+CANDIDATES = [3, 5, 7, 9]  # sensitivities tried for the left and right actions
+PHASES = ['rest', 'left', 'right']  # trials per candidate (the cue given to the patient)
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class SensitivityCalibration():
+    """
+    Guided trials that sweep the sensitivity and pick the best one.
+
+    Attributes
+    ----------
+    set_values : function
+        called with the sensitivity values to apply (i.e. set_mental_command_action_sensitivity)
+    on_done : function
+        called with (best values, results) when the last trial ends
+    phase_time : float
+        length of a trial (s), without the settle time
+    settle_time : float
+        time (s) ignored at the start of a trial - the patient reacts to the cue and Cortex applies the new sensitivity
+    threshold : float
+        power that counts as a selection
+    false_penalty : float
+        seconds added to the score per false selection per second
+
+    Methods
+    -------
+    start():
+        Start the trials (from the first com sample on)
+    cancel():
+        Stop without picking a sensitivity
+    on_sample(action, power, time):
+        Add a com sample
+    state():
+        Current trial, cue and results
+    """
+    def __init__(self, set_values, on_done=None, candidates=CANDIDATES, phase_time=5.0, settle_time=1.0,
+                 threshold=0.3, false_penalty=5.0):
+        self.set_values = set_values
+        self.on_done = on_done
+        self.candidates = candidates
+        self.phase_time = phase_time
+        self.settle_time = settle_time
+        self.threshold = threshold
+        self.false_penalty = false_penalty
+        self.lock = Semaphore(1)
+        self.running = False
+        self.trials = []
+        self.results = []
+        self.best = None
+
+
+    def start(self):
+        self.lock.acquire()
+        self.trials = [(sensitivity, phase) for sensitivity in self.candidates for phase in PHASES]
+        self.results = []
+        self.best = None
+        self.start_trial()
+        self.running = True
+        self.lock.release()
+        self.set_values(sensitivity_values(self.candidates[0]))
+
+
+    def cancel(self):
+        self.lock.acquire()
+        self.running = False
+        self.trials = []
+        self.lock.release()
+
+
+    def on_sample(self, action, power, time):
+        if not self.running:
+            return
+        self.lock.acquire()
+        if not self.running:
+            self.lock.release()
+            return
+        if self.phase_start is None:
+            self.phase_start = time  # trials run on the clock of the com stream
+
+        new_values = None
+        done = None
+        elapsed = time - self.phase_start - self.settle_time
+        if elapsed >= self.phase_time:
+            new_values, done = self.end_trial()
+        elif elapsed >= 0:
+            sensitivity, phase = self.trials[0]
+            above = action in ('left', 'right') and power >= self.threshold
+            if above and not self.above:
+                if action == phase and self.hit_time is None:
+                    self.hit_time = elapsed
+                elif action != phase:
+                    self.false_count += 1
+            self.above = above
+        self.lock.release()
+
+        # callbacks outside of the lock
+        if new_values is not None:
+            self.set_values(new_values)
+        if done is not None and self.on_done is not None:
+            self.on_done(*done)
+
+
+    def state(self):
+        self.lock.acquire()
+        state = {'running': self.running, 'results': list(self.results), 'best': self.best,
+                 'trials_left': len(self.trials)}
+        if self.running:
+            state['sensitivity'], state['cue'] = self.trials[0]
+        self.lock.release()
+        return state
+
+
+    def start_trial(self):
+        self.phase_start = None
+        self.hit_time = None
+        self.false_count = 0
+        self.above = False
+
+
+    # End the current trial - returns the values to apply next (or None) and the (best values, results) when done
+    def end_trial(self):
+        sensitivity, phase = self.trials.pop(0)
+        if phase == 'rest':
+            self.results.append({'sensitivity': sensitivity, 'times': [], 'false_count': 0, 'seconds': 0.0})
+        result = self.results[-1]
+        result['false_count'] += self.false_count
+        result['seconds'] += self.phase_time
+        if phase != 'rest':
+            # no selection at all counts as the full trial
+            result['times'].append(self.phase_time if self.hit_time is None else self.hit_time)
+
+        if len(self.trials) > 0:
+            self.start_trial()
+            if self.trials[0][0] != sensitivity:
+                return sensitivity_values(self.trials[0][0]), None
+            return None, None
+
+        # last trial - score every candidate
+        for result in self.results:
+            result['time_to_threshold'] = sum(result['times']) / len(result['times'])
+            result['false_rate'] = result['false_count'] / result['seconds']
+            result['score'] = result['time_to_threshold'] + self.false_penalty * result['false_rate']
+        best = min(self.results, key=lambda result: result['score'])
+        self.best = sensitivity_values(best['sensitivity'])
+        self.running = False
+        return None, (self.best, self.results)
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class SensitivityCache():
+    """
+    Calibrated sensitivity per profile in a JSON file (written atomically, only when a profile is calibrated).
+
+    Methods
+    -------
+    get(profile_name):
+        Cached values of a profile (None if not calibrated)
+    put(profile_name, values, results):
+        Cache the values (and the trial results) of a profile
+    """
+    def __init__(self, path=os.path.join('calibration', 'sensitivity.json')):
+        self.path = path
+        self.lock = Semaphore(1)
+        self.profiles = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.profiles = json.load(f)
+
+
+    def get(self, profile_name):
+        self.lock.acquire()
+        entry = self.profiles.get(profile_name)
+        self.lock.release()
+        return None if entry is None else entry['values']
+
+
+    def put(self, profile_name, values, results):
+        self.lock.acquire()
+        self.profiles[profile_name] = {'values': values, 'results': results}
+        folder = os.path.dirname(self.path)
+        if folder != '':
+            os.makedirs(folder, exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.profiles, f, indent=4)
+        os.replace(self.path + '.tmp', self.path)  # never a half written cache
+        self.lock.release()
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Values for set_mental_command_action_sensitivity - the candidate for left and right, the other actions unchanged
+def sensitivity_values(sensitivity):
+    return [sensitivity, sensitivity] + DEFAULT_SENSITIVITY[2:]
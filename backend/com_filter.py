@@ -0,0 +1,269 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Filter chain of the mental command power - runs on every com sample before it is buffered and moves the dot
+#   1. The sample is one signed value (left negative, right positive). Neutral samples skip the chain (they are
+#      ignored by the averages) but the stages keep their state
+#   2. Stages are stateful and allocate nothing per sample (fixed rings and scalars, built when the chain is built):
+#      ema        - exponential smoothing: y += alpha * (x - y)
+#      median     - median of the last size samples, or with max_deviation the sample itself unless it is further
+#                   than max_deviation from the median (outlier rejection - replaced by the median)
+#      dead_zone  - values below threshold become 0 (neutral), the rest is rescaled to 0 - 1
+#      rate_limit - the output changes by at most max_rate per second
+#   3. The chain is defined in a JSON file, i.e. config/com_filters.json (no file = no filtering):
+#      {"stages": [{"type": "median", "size": 5, "max_deviation": 0.4}, {"type": "ema", "alpha": 0.3},
+#                  {"type": "dead_zone", "threshold": 0.1}, {"type": "rate_limit", "max_rate": 4.0}]}
+#
+# Benchmark: python backend/com_filter.py config/com_filters.json --samples 200000
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+import argparse
+import random
+import json
+import time
+import os
+
+
+DEFAULT_PATH = os.path.join('config', 'com_filters.json')
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Stages - process(value, time) returns the filtered value, reset() forgets the state
+class EmaStage():
+    def __init__(self, alpha=0.3):
+        if not 0 < alpha <= 1:
+            raise ValueError('ema alpha must be in (0, 1]')
+        self.alpha = alpha
+        self.reset()
+
+
+    def reset(self):
+        self.value = None
+
+
+    def process(self, value, time):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+
+class MedianStage():
+    def __init__(self, size=5, max_deviation=None):
+        if size < 1:
+            raise ValueError('median size must be at least 1')
+        self.size = size
+        self.max_deviation = max_deviation
+        self.ring = [0.0] * size  # samples in arrival order
+        self.ordered = [0.0] * size  # the same samples sorted (insertion sort in place)
+        self.reset()
+
+
+    def reset(self):
+        self.count = 0
+        self.next = 0
+
+
+    def process(self, value, time):
+        ordered = self.ordered
+        if self.count < self.size:
+            n = self.count
+            self.count += 1
+        else:
+            # remove the oldest sample from the sorted samples
+            n = self.size - 1
+            old = self.ring[self.next]
+            i = 0
+            while i < n and ordered[i] != old:
+                i += 1
+            while i < n:
+                ordered[i] = ordered[i + 1]
+                i += 1
+        # insert the new sample
+        i = n
+        while i > 0 and ordered[i - 1] > value:
+            ordered[i] = ordered[i - 1]
+            i -= 1
+        ordered[i] = value
+        self.ring[self.next] = value
+        self.next = (self.next + 1) % self.size
+
+        count = self.count
+        if count % 2 == 1:
+            median = ordered[count // 2]
+        else:
+            median = (ordered[count // 2 - 1] + ordered[count // 2]) / 2
+        if self.max_deviation is None:
+            return median
+        return median if abs(value - median) > self.max_deviation else value
+
+
+
+class DeadZoneStage():
+    def __init__(self, threshold=0.1, rescale=True):
+        if not 0 <= threshold < 1:
+            raise ValueError('dead_zone threshold must be in [0, 1)')
+        self.threshold = threshold
+        self.rescale = rescale
+
+
+    def reset(self):
+        pass
+
+
+    def process(self, value, time):
+        magnitude = abs(value)
+        if magnitude < self.threshold:
+            return 0.0
+        if not self.rescale:
+            return value
+        magnitude = (magnitude - self.threshold) / (1 - self.threshold)
+        return magnitude if value > 0 else -magnitude
+
+
+
+class RateLimitStage():
+    def __init__(self, max_rate=4.0):
+        if max_rate <= 0:
+            raise ValueError('rate_limit max_rate must be positive')
+        self.max_rate = max_rate
+        self.reset()
+
+
+    def reset(self):
+        self.value = None
+        self.time = None
+
+
+    def process(self, value, time):
+        if self.value is not None:
+            step = self.max_rate * max(time - self.time, 0.0)
+            if value > self.value + step:
+                value = self.value + step
+            elif value < self.value - step:
+                value = self.value - step
+        self.value = value
+        self.time = time
+        return value
+
+
+STAGES = {'ema': EmaStage, 'median': MedianStage, 'dead_zone': DeadZoneStage, 'rate_limit': RateLimitStage}
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class FilterChain():
+    """
+    Stages applied in order to every com sample (called from the Cortex thread only).
+
+    Attributes
+    ----------
+    config : list
+        stage definitions - {'type': 'ema', 'alpha': 0.3} (see STAGES)
+
+    Methods
+    -------
+    apply(data):
+        Filter a com sample in place (action and power) - returns the signed value
+    process(value, time):
+        Filter a signed value
+    reset():
+        Forget the state of every stage (i.e. on a new session)
+    state():
+        Stages and the number of filtered / changed samples
+    """
+    def __init__(self, config=None):
+        self.config = list(config or [])
+        self.stages = []
+        for stage in self.config:
+            options = dict(stage)
+            kind = options.pop('type', None)
+            if kind not in STAGES:
+                raise ValueError('Unknown filter stage {0}. Use one of {1}.'.format(kind, ', '.join(STAGES)))
+            self.stages.append(STAGES[kind](**options))
+        self.samples = 0
+        self.changed = 0  # samples that changed direction or became neutral
+
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+
+    def process(self, value, time):
+        for stage in self.stages:
+            value = stage.process(value, time)
+        return value
+
+
+    def apply(self, data):
+        action = data['action']
+        if action != 'left' and action != 'right':
+            return 0.0
+        value = data['power'] if action == 'right' else -data['power']
+        if not self.stages:
+            return value
+        filtered = self.process(value, data['time'])
+        self.samples += 1
+        if filtered > 0:
+            data['action'] = 'right'
+            data['power'] = filtered
+        elif filtered < 0:
+            data['action'] = 'left'
+            data['power'] = -filtered
+        else:
+            data['action'] = 'neutral'
+            data['power'] = 0.0
+        if data['action'] != action:
+            self.changed += 1
+        return filtered
+
+
+    def state(self):
+        return {'stages': self.config, 'samples': self.samples, 'changed': self.changed}
+
+
+
+# Chain of a JSON file - an empty chain if the file does not exist
+def load_chain(path=DEFAULT_PATH):
+    if not os.path.exists(path):
+        return FilterChain()
+    with open(path) as f:
+        return FilterChain(json.load(f).get('stages', []))
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Benchmark - time per sample of the chain on a noisy synthetic com stream (8 Hz like Cortex, but run flat out)
+def benchmark(chain, samples=200000, seed=0):
+    rng = random.Random(seed)
+    stream = []
+    for i in range(samples):
+        target = 0.6 if (i // 40) % 2 == 0 else -0.6
+        value = target + rng.gauss(0, 0.25) + (rng.choice((-1, 1)) if rng.random() < 0.02 else 0)  # spikes
+        value = max(-1.0, min(1.0, value))
+        stream.append({'action': 'right' if value > 0 else 'left', 'power': abs(value), 'time': i / 8})
+
+    start = time.perf_counter()
+    for data in stream:
+        chain.apply(data)
+    elapsed = time.perf_counter() - start
+    return {'samples': samples, 'us_per_sample': elapsed / samples * 1e6, 'changed': chain.changed}
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the com filter chain.')
+    parser.add_argument('config', nargs='?', default=DEFAULT_PATH, help='JSON file with the stages')
+    parser.add_argument('--samples', type=int, default=200000)
+    args = parser.parse_args()
+
+    baseline = benchmark(FilterChain(), args.samples)
+    result = benchmark(load_chain(args.config), args.samples)
+    print('stages: {0}'.format(', '.join(stage['type'] for stage in load_chain(args.config).config) or 'none'))
+    print('{0:.2f} us/sample ({1:.2f} us/sample without stages), {2} of {3} samples changed direction'.format(
+        result['us_per_sample'], baseline['us_per_sample'], result['changed'], result['samples']))
@@ -6,6 +6,8 @@
 # -----------------------------------------------------------------------------------------------------------------------------
 
 import websocket #'pip install websocket-client' for install
+from bci_logging import lazy_json
+from handoff import HandoffQueue
 from datetime import datetime
 import json
 import ssl
@@ -14,6 +16,11 @@ import sys
 from pydispatch import Dispatcher
 import warnings
 import threading
+import logging
+import queue
+
+
+logger = logging.getLogger(__name__)
 
 
 # define request id
@@ -44,6 +51,8 @@ UNSUB_REQUEST_ID                    =   24
 
 #define error_code
 ERR_PROFILE_ACCESS_DENIED = -32046
+ERR_INVALID_TOKEN = -32014
+ERR_TOKEN_EXPIRED = -32015
 
 # define warning code
 CORTEX_STOP_ALL_STREAMS = 0
@@ -65,6 +74,11 @@ HEADSET_CANNOT_WORK_WITH_BTLE = 112
 HEADSET_CANNOT_CONNECT_DISABLE_MOTION = 113
 
 
+# Stream data frames can be dropped when the handoff queue is full - results, errors and warnings can not
+def is_stream_frame(message):
+    return '"sid"' in message
+
+
 class Cortex(Dispatcher):
 
     _events_ = ['inform_error','create_session_done', 'query_profile_done', 'load_unload_profile_done', 
@@ -77,10 +91,23 @@ class Cortex(Dispatcher):
         
         self.session_id = ''
         self.headset_id = ''
+        self.auth = ''
+        self.token_reused = False  # token of a snapshot - authorize again if Cortex rejects it
         self.debug = debug_mode
+        if debug_mode:
+            logger.setLevel(logging.DEBUG)  # requests and responses are logged at debug level
         self.debit = 10
         self.license = ''
 
+        # Requests queued by other threads (i.e. markers from Flask) - sent in batches from the processing thread
+        self.pending_requests = queue.Queue(maxsize=1000)
+
+        # Cost of every subscribed stream on the processing thread - stream -> {'messages', 'bytes', 'cpu' (s)}
+        self.stream_usage = {}
+
+        # Frames received by the websocket thread are parsed and handled in batches on the processing thread
+        self.handoff = HandoffQueue(self.process_frames, droppable=is_stream_frame, name='CortexProcessThread')
+
         if client_id == '':
             raise ValueError('Empty your_app_client_id. Please fill in your_app_client_id before running the example.')
         else:
@@ -92,7 +119,7 @@ class Cortex(Dispatcher):
             self.client_secret = client_secret
 
         for key, value in kwargs.items():
-            print('init {0} - {1}'.format(key, value))
+            logger.info('init %s - %s', key, value)
             if key == 'license':
                 self.license = value
             elif key == 'debit':
@@ -114,12 +141,14 @@ class Cortex(Dispatcher):
         # If you don't want to use the certificate, please replace by the below line  by sslopt={"cert_reqs": ssl.CERT_NONE}
         sslopt = {'ca_certs': "certificates/rootCA.pem", "cert_reqs": ssl.CERT_REQUIRED}
 
+        self.handoff.start()
         self.websock_thread  = threading.Thread(target=self.ws.run_forever, args=(None, sslopt), name=threadName)
         self.websock_thread .start()
         self.websock_thread.join()
 
     def close(self):
         self.ws.close()
+        self.handoff.stop()
 
     def set_wanted_headset(self, headsetId):
         self.headset_id = headsetId
@@ -128,20 +157,18 @@ class Cortex(Dispatcher):
         self.profile_name = profileName
 
     def on_open(self, *args, **kwargs):
-        print("websocket opened")
+        logger.info('websocket opened')
         self.do_prepare_steps()
 
     def on_error(self, *args):
         if len(args) == 2:
-            print(str(args[1]))
+            logger.error('websocket error: %s', args[1])
 
     def on_close(self, *args, **kwargs):
-        print("on_close")
-        print(args[1])
+        logger.info('on_close: %s', args[1:])
 
     def handle_result(self, recv_dic):
-        if self.debug:
-            print(recv_dic)
+        logger.debug('%s', recv_dic)
 
         req_id = recv_dic['id']
         result_dic = recv_dic['result']
@@ -165,7 +192,7 @@ class Cortex(Dispatcher):
                 msg = result_dic['message']
                 warnings.warn(msg)
         elif req_id == AUTHORIZE_ID:
-            print("Authorize successfully.")
+            logger.info('Authorize successfully.')
             self.auth = result_dic['cortexToken']
             # query headsets
             self.query_headset()
@@ -177,7 +204,7 @@ class Cortex(Dispatcher):
                 hs_id = ele['id']
                 status = ele['status']
                 connected_by = ele['connectedBy']
-                print('headsetId: {0}, status: {1}, connected_by: {2}'.format(hs_id, status, connected_by))
+                logger.info('headsetId: %s, status: %s, connected_by: %s', hs_id, status, connected_by)
                 if self.headset_id != '' and self.headset_id == hs_id:
                     found_headset = True
                     headset_status = status
@@ -198,21 +225,22 @@ class Cortex(Dispatcher):
                 elif headset_status == 'discovered':
                     self.connect_headset(self.headset_id)
                 elif headset_status == 'connecting':
-                    # wait 3 seconds and query headset again
-                    time.sleep(3)
-                    self.query_headset()
+                    # query headset again in 3 seconds (without blocking the processing thread)
+                    timer = threading.Timer(3, self.queue_request, (self.query_headset,))
+                    timer.daemon = True
+                    timer.start()
                 else:
                     warnings.warn('query_headset resp: Invalid connection status ' + headset_status)
         elif req_id == CREATE_SESSION_ID:
             self.session_id = result_dic['id']
-            print("The session " + self.session_id + " is created successfully.")
+            logger.info('The session %s is created successfully.', self.session_id)
             self.emit('create_session_done', data=self.session_id)
         elif req_id == SUB_REQUEST_ID:
             # handle data label
             for stream in result_dic['success']:
                 stream_name = stream['streamName']
                 stream_labels = stream['cols']
-                print('The data stream '+ stream_name + ' is subscribed successfully.')
+                logger.info('The data stream %s is subscribed successfully.', stream_name)
                 # ignore com, fac and sys data label because they are handled in on_new_data
                 if stream_name != 'com' and stream_name != 'fac':
                     self.extract_data_labels(stream_name, stream_labels)
@@ -220,16 +248,16 @@ class Cortex(Dispatcher):
             for stream in result_dic['failure']:
                 stream_name = stream['streamName']
                 stream_msg = stream['message']
-                print('The data stream '+ stream_name + ' is subscribed unsuccessfully. Because: ' + stream_msg)
+                logger.warning('The data stream %s is subscribed unsuccessfully. Because: %s', stream_name, stream_msg)
         elif req_id == UNSUB_REQUEST_ID:
             for stream in result_dic['success']:
                 stream_name = stream['streamName']
-                print('The data stream '+ stream_name + ' is unsubscribed successfully.')
+                logger.info('The data stream %s is unsubscribed successfully.', stream_name)
 
             for stream in result_dic['failure']:
                 stream_name = stream['streamName']
                 stream_msg = stream['message']
-                print('The data stream '+ stream_name + ' is unsubscribed unsuccessfully. Because: ' + stream_msg)
+                logger.warning('The data stream %s is unsubscribed unsuccessfully. Because: %s', stream_name, stream_msg)
 
         elif req_id == QUERY_PROFILE_ID:
             profile_list = []
@@ -245,22 +273,22 @@ class Cortex(Dispatcher):
                     # load profile
                     self.setup_profile(profile_name, 'load')
             elif action == 'load':
-                print('load profile successfully')
+                logger.info('load profile successfully')
                 self.emit('load_unload_profile_done', isLoaded=True)
             elif action == 'unload':
                 self.emit('load_unload_profile_done', isLoaded=False)
             elif action == 'save':
                 self.emit('save_profile_done')
         elif req_id == GET_CURRENT_PROFILE_ID:
-            print(result_dic)
+            logger.debug('%s', result_dic)
             name = result_dic['name']
             if name is None:
                 # no profile loaded with the headset
-                print('get_current_profile: no profile loaded with the headset ' + self.headset_id)
+                logger.info('get_current_profile: no profile loaded with the headset %s', self.headset_id)
                 self.setup_profile(self.profile_name, 'load')
             else:
                 loaded_by_this_app = result_dic['loadedByThisApp']
-                print('get current profile rsp: ' + name + ", loadedByThisApp: " + str(loaded_by_this_app))
+                logger.info('get current profile rsp: %s, loadedByThisApp: %s', name, loaded_by_this_app)
                 if name != self.profile_name:
                     warnings.warn("There is profile " + name + " is loaded for headset " + self.headset_id)
                 elif loaded_by_this_app == True:
@@ -269,7 +297,7 @@ class Cortex(Dispatcher):
                     self.setup_profile(self.profile_name, 'unload')
                     # warnings.warn("The profile " + name + " is loaded by other applications")
         elif req_id == DISCONNECT_HEADSET_ID:
-            print("Disconnect headset " + self.headset_id)
+            logger.info('Disconnect headset %s', self.headset_id)
             self.headset_id = ''
         elif req_id == MENTAL_COMMAND_ACTIVE_ACTION_ID:
             self.emit('get_mc_active_action_done', data=result_dic)
@@ -294,25 +322,30 @@ class Cortex(Dispatcher):
             for record in result_dic['failure']:
                 record_id = record['recordId']
                 failure_msg = record['message']
-                print('export_record resp failure cases: '+ record_id + ":" + failure_msg)
+                logger.warning('export_record resp failure cases: %s:%s', record_id, failure_msg)
 
             self.emit('export_record_done', data=success_export)
         elif req_id == INJECT_MARKER_REQUEST_ID:
             self.emit('inject_marker_done', data=result_dic['marker'])
-        elif req_id == INJECT_MARKER_REQUEST_ID:
+        elif req_id == UPDATE_MARKER_REQUEST_ID:
             self.emit('update_marker_done', data=result_dic['marker'])
         else:
-            print('No handling for response of request ' + str(req_id))
+            logger.warning('No handling for response of request %s', req_id)
 
     def handle_error(self, recv_dic):
         req_id = recv_dic['id']
-        print('handle_error: request Id ' + str(req_id))
+        if self.token_reused and recv_dic['error'].get('code') in (ERR_INVALID_TOKEN, ERR_TOKEN_EXPIRED):
+            logger.warning('Reused Cortex token rejected - authorizing again')
+            self.token_reused = False
+            self.auth = ''
+            self.authorize()
+            return
+        logger.error('handle_error: request Id %s', req_id)
         self.emit('inform_error', error_data=recv_dic['error'])
     
     def handle_warning(self, warning_dic):
 
-        if self.debug:
-            print(warning_dic)
+        logger.debug('%s', warning_dic)
         warning_code = warning_dic['code']
         warning_msg = warning_dic['message']
         if warning_code == ACCESS_RIGHT_GRANTED:
@@ -378,12 +411,44 @@ class Cortex(Dispatcher):
             sys_data = result_dic['sys']
             self.emit('new_sys_data', data=sys_data)
         else :
-            print(result_dic)
-
+            logger.warning('No handling for stream data %s', result_dic)
+
+    # Queue a request (a method of this class and its arguments) to be sent from the processing thread
+    # Never blocks - the request is dropped if the queue is full
+    def queue_request(self, request, *args, **kwargs):
+        try:
+            self.pending_requests.put_nowait((request, args, kwargs))
+        except queue.Full:
+            logger.warning('Request queue full - %s dropped', request.__name__)
+
+    # Send all queued requests (runs on the processing thread)
+    def send_pending_requests(self):
+        while True:
+            try:
+                request, args, kwargs = self.pending_requests.get_nowait()
+            except queue.Empty:
+                return
+            request(*args, **kwargs)
+
+    # Websocket thread - only hands the frame over (never blocks on the processing of the samples)
     def on_message(self, *args):
-        recv_dic = json.loads(args[1])
+        self.handoff.put(args[1])
+
+    # Processing thread - a batch of frames (empty without frames for a while, to send the queued requests)
+    def process_frames(self, frames):
+        self.send_pending_requests()
+        for message in frames:
+            try:
+                self.process_message(message)
+            except Exception:
+                logger.exception('Handling of a message failed: %s', message[:200])
+
+    def process_message(self, message):
+        start = time.thread_time()
+        recv_dic = json.loads(message)
         if 'sid' in recv_dic:
             self.handle_stream_data(recv_dic)
+            self.count_stream(recv_dic, len(message), time.thread_time() - start)
         elif 'result' in recv_dic:
             self.handle_result(recv_dic)
         elif 'error' in recv_dic:
@@ -393,21 +458,32 @@ class Cortex(Dispatcher):
         else:
             raise KeyError
 
+    # Add a message of a stream to its usage (parse and handling time of the processing thread)
+    def count_stream(self, recv_dic, size, cpu):
+        for key in recv_dic:
+            if key != 'sid' and key != 'time':
+                usage = self.stream_usage.get(key)
+                if usage is None:
+                    usage = self.stream_usage[key] = {'messages': 0, 'bytes': 0, 'cpu': 0.0}
+                usage['messages'] += 1
+                usage['bytes'] += size
+                usage['cpu'] += cpu
+                return
+
     def query_headset(self):
-        print('query headset --------------------------------')
+        logger.debug('query headset')
         query_headset_request = {
             "jsonrpc": "2.0", 
             "id": QUERY_HEADSET_ID,
             "method": "queryHeadsets",
             "params": {}
         }
-        if self.debug:
-            print('queryHeadsets request \n', json.dumps(query_headset_request, indent=4))
+        logger.debug('queryHeadsets request \n%s', lazy_json(query_headset_request))
 
-        self.ws.send(json.dumps(query_headset_request, indent=4))
+        self.ws.send(json.dumps(query_headset_request))
 
     def connect_headset(self, headset_id):
-        print('connect headset --------------------------------')
+        logger.debug('connect headset')
         connect_headset_request = {
             "jsonrpc": "2.0", 
             "id": CONNECT_HEADSET_ID,
@@ -417,13 +493,12 @@ class Cortex(Dispatcher):
                 "headset": headset_id
             }
         }
-        if self.debug:
-            print('controlDevice request \n', json.dumps(connect_headset_request, indent=4))
+        logger.debug('controlDevice request \n%s', lazy_json(connect_headset_request))
 
-        self.ws.send(json.dumps(connect_headset_request, indent=4))
+        self.ws.send(json.dumps(connect_headset_request))
 
     def request_access(self):
-        print('request access --------------------------------')
+        logger.debug('request access')
         request_access_request = {
             "jsonrpc": "2.0", 
             "method": "requestAccess",
@@ -434,10 +509,10 @@ class Cortex(Dispatcher):
             "id": REQUEST_ACCESS_ID
         }
 
-        self.ws.send(json.dumps(request_access_request, indent=4))
+        self.ws.send(json.dumps(request_access_request))
 
     def has_access_right(self):
-        print('check has access right --------------------------------')
+        logger.debug('check has access right')
         has_access_request = {
             "jsonrpc": "2.0", 
             "method": "hasAccessRight",
@@ -447,10 +522,10 @@ class Cortex(Dispatcher):
             },
             "id": HAS_ACCESS_RIGHT_ID
         }
-        self.ws.send(json.dumps(has_access_request, indent=4))
+        self.ws.send(json.dumps(has_access_request))
 
     def authorize(self):
-        print('authorize --------------------------------')
+        logger.debug('authorize')
         authorize_request = {
             "jsonrpc": "2.0",
             "method": "authorize", 
@@ -463,8 +538,7 @@ class Cortex(Dispatcher):
             "id": AUTHORIZE_ID
         }
 
-        if self.debug:
-            print('auth request \n', json.dumps(authorize_request, indent=4))
+        logger.debug('auth request \n%s', lazy_json(authorize_request))
 
         self.ws.send(json.dumps(authorize_request))
 
@@ -473,7 +547,7 @@ class Cortex(Dispatcher):
             warnings.warn("There is existed session " + self.session_id)
             return
 
-        print('create session --------------------------------')
+        logger.debug('create session')
         create_session_request = { 
             "jsonrpc": "2.0",
             "id": CREATE_SESSION_ID,
@@ -485,13 +559,12 @@ class Cortex(Dispatcher):
             }
         }
         
-        if self.debug:
-            print('create session request \n', json.dumps(create_session_request, indent=4))
+        logger.debug('create session request \n%s', lazy_json(create_session_request))
 
         self.ws.send(json.dumps(create_session_request))
 
     def close_session(self):
-        print('close session --------------------------------')
+        logger.debug('close session')
         close_session_request = { 
             "jsonrpc": "2.0",
             "id": CREATE_SESSION_ID,
@@ -506,7 +579,7 @@ class Cortex(Dispatcher):
         self.ws.send(json.dumps(close_session_request))
 
     def get_cortex_info(self):
-        print('get cortex version --------------------------------')
+        logger.debug('get cortex version')
         get_cortex_info_request = {
             "jsonrpc": "2.0",
             "method": "getCortexInfo",
@@ -527,13 +600,23 @@ class Cortex(Dispatcher):
         None
         """
 
+    # Token of a previous run (hot restart) - access right and authorize are skipped while Cortex accepts it
+    def set_token(self, token, headset_id=''):
+        self.auth = token
+        self.token_reused = token != ''
+        if headset_id != '':
+            self.headset_id = headset_id
+
     def do_prepare_steps(self):
-        print('do_prepare_steps--------------------------------')
+        logger.debug('do_prepare_steps')
+        if self.token_reused:
+            self.query_headset()
+            return
         # check access right
         self.has_access_right()
 
     def disconnect_headset(self):
-        print('disconnect headset --------------------------------')
+        logger.debug('disconnect headset')
         disconnect_headset_request = {
             "jsonrpc": "2.0", 
             "id": DISCONNECT_HEADSET_ID,
@@ -547,7 +630,7 @@ class Cortex(Dispatcher):
         self.ws.send(json.dumps(disconnect_headset_request))
 
     def sub_request(self, stream):
-        print('subscribe request --------------------------------')
+        logger.debug('subscribe request')
         sub_request_json = {
             "jsonrpc": "2.0", 
             "method": "subscribe", 
@@ -558,13 +641,12 @@ class Cortex(Dispatcher):
             }, 
             "id": SUB_REQUEST_ID
         }
-        if self.debug:
-            print('subscribe request \n', json.dumps(sub_request_json, indent=4))
+        logger.debug('subscribe request \n%s', lazy_json(sub_request_json))
 
         self.ws.send(json.dumps(sub_request_json))
 
     def unsub_request(self, stream):
-        print('unsubscribe request --------------------------------')
+        logger.debug('unsubscribe request')
         unsub_request_json = {
             "jsonrpc": "2.0", 
             "method": "unsubscribe", 
@@ -575,8 +657,7 @@ class Cortex(Dispatcher):
             }, 
             "id": UNSUB_REQUEST_ID
         }
-        if self.debug:
-            print('unsubscribe request \n', json.dumps(unsub_request_json, indent=4))
+        logger.debug('unsubscribe request \n%s', lazy_json(unsub_request_json))
 
         self.ws.send(json.dumps(unsub_request_json))
 
@@ -595,11 +676,11 @@ class Cortex(Dispatcher):
             data_labels = stream_cols
 
         labels['labels'] = data_labels
-        print(labels)
+        logger.info('%s', labels)
         self.emit('new_data_labels', data=labels)
 
     def query_profile(self):
-        print('query profile --------------------------------')
+        logger.debug('query profile')
         query_profile_json = {
             "jsonrpc": "2.0",
             "method": "queryProfile",
@@ -609,14 +690,12 @@ class Cortex(Dispatcher):
             "id": QUERY_PROFILE_ID
         }
 
-        if self.debug:
-            print('query profile request \n', json.dumps(query_profile_json, indent=4))
-            print('\n')
+        logger.debug('query profile request \n%s', lazy_json(query_profile_json))
 
         self.ws.send(json.dumps(query_profile_json))
 
     def get_current_profile(self):
-        print('get current profile:')
+        logger.debug('get current profile')
         get_profile_json = {
             "jsonrpc": "2.0",
             "method": "getCurrentProfile",
@@ -627,14 +706,12 @@ class Cortex(Dispatcher):
             "id": GET_CURRENT_PROFILE_ID
         }
         
-        if self.debug:
-            print('get current profile json:\n', json.dumps(get_profile_json, indent=4))
-            print('\n')
+        logger.debug('get current profile json:\n%s', lazy_json(get_profile_json))
 
         self.ws.send(json.dumps(get_profile_json))
 
     def setup_profile(self, profile_name, status):
-        print('setup profile: ' + status + ' -------------------------------- ')
+        logger.debug('setup profile: %s', status)
         setup_profile_json = {
             "jsonrpc": "2.0",
             "method": "setupProfile",
@@ -647,14 +724,12 @@ class Cortex(Dispatcher):
             "id": SETUP_PROFILE_ID
         }
         
-        if self.debug:
-            print('setup profile json:\n', json.dumps(setup_profile_json, indent=4))
-            print('\n')
+        logger.debug('setup profile json:\n%s', lazy_json(setup_profile_json))
 
         self.ws.send(json.dumps(setup_profile_json))
 
     def train_request(self, detection, action, status):
-        print('train request --------------------------------')
+        logger.debug('train request')
         train_request_json = {
             "jsonrpc": "2.0", 
             "method": "training", 
@@ -667,14 +742,12 @@ class Cortex(Dispatcher):
             }, 
             "id": TRAINING_ID
         }
-        if self.debug:
-            print('training request:\n', json.dumps(train_request_json, indent=4))
-            print('\n')
+        logger.debug('training request:\n%s', lazy_json(train_request_json))
 
         self.ws.send(json.dumps(train_request_json))
 
     def create_record(self, title, **kwargs):
-        print('create record --------------------------------')
+        logger.debug('create record')
 
         if (len(title) == 0):
             warnings.warn('Empty record_title. Please fill the record_title before running script.')
@@ -693,13 +766,12 @@ class Cortex(Dispatcher):
             "params": params_val, 
             "id": CREATE_RECORD_REQUEST_ID
         }
-        if self.debug:
-            print('create record request:\n', json.dumps(create_record_request, indent=4))
+        logger.debug('create record request:\n%s', lazy_json(create_record_request))
 
         self.ws.send(json.dumps(create_record_request))
 
     def stop_record(self):
-        print('stop record --------------------------------')
+        logger.debug('stop record')
         stop_record_request = {
             "jsonrpc": "2.0", 
             "method": "stopRecord",
@@ -710,13 +782,12 @@ class Cortex(Dispatcher):
 
             "id": STOP_RECORD_REQUEST_ID
         }
-        if self.debug:
-            print('stop record request:\n', json.dumps(stop_record_request, indent=4))
+        logger.debug('stop record request:\n%s', lazy_json(stop_record_request))
         self.ws.send(json.dumps(stop_record_request))
 
     def export_record(self, folder, stream_types, export_format, record_ids,
                       version, **kwargs):
-        print('export record --------------------------------: ')
+        logger.debug('export record')
         #validate destination folder
         if (len(folder) == 0):
             warnings.warn('Invalid folder parameter. Please set a writable destination folder for exporting data.')
@@ -743,14 +814,12 @@ class Cortex(Dispatcher):
             "params": params_val
         }
 
-        if self.debug:
-            print('export record request \n',
-                json.dumps(export_record_request, indent=4))
+        logger.debug('export record request \n%s', lazy_json(export_record_request))
         
         self.ws.send(json.dumps(export_record_request))
 
     def inject_marker_request(self, time, value, label, **kwargs):
-        print('inject marker --------------------------------')
+        logger.debug('inject marker')
         params_val = {"cortexToken": self.auth, 
                       "session": self.session_id, 
                       "time": time,
@@ -766,12 +835,11 @@ class Cortex(Dispatcher):
             "method": "injectMarker", 
             "params": params_val
         }
-        if self.debug:
-            print('inject marker request \n', json.dumps(inject_marker_request, indent=4))
+        logger.debug('inject marker request \n%s', lazy_json(inject_marker_request))
         self.ws.send(json.dumps(inject_marker_request))
 
     def update_marker_request(self, markerId, time, **kwargs):
-        print('update marker --------------------------------')
+        logger.debug('update marker')
         params_val = {"cortexToken": self.auth, 
                       "session": self.session_id,
                       "markerId": markerId,
@@ -786,12 +854,11 @@ class Cortex(Dispatcher):
             "method": "updateMarker", 
             "params": params_val
         }
-        if self.debug:
-            print('update marker request \n', json.dumps(update_marker_request, indent=4))
+        logger.debug('update marker request \n%s', lazy_json(update_marker_request))
         self.ws.send(json.dumps(update_marker_request))
 
     def get_mental_command_action_sensitivity(self, profile_name):
-        print('get mental command sensitivity ------------------')
+        logger.debug('get mental command sensitivity')
         sensitivity_request = {
             "id": SENSITIVITY_REQUEST_ID,
             "jsonrpc": "2.0",
@@ -802,13 +869,12 @@ class Cortex(Dispatcher):
                 "status": "get"
             }
         }
-        if self.debug:
-            print('get mental command sensitivity \n', json.dumps(sensitivity_request, indent=4))
+        logger.debug('get mental command sensitivity \n%s', lazy_json(sensitivity_request))
 
         self.ws.send(json.dumps(sensitivity_request))
 
     def set_mental_command_action_sensitivity(self, profile_name, values):
-        print('set mental command sensitivity ------------------')
+        logger.debug('set mental command sensitivity')
         sensitivity_request = {
                                 "id": SENSITIVITY_REQUEST_ID,
                                 "jsonrpc": "2.0",
@@ -821,13 +887,12 @@ class Cortex(Dispatcher):
                                     "values": values
                                 }
                             }
-        if self.debug:
-            print('set mental command sensitivity \n', json.dumps(sensitivity_request, indent=4))
+        logger.debug('set mental command sensitivity \n%s', lazy_json(sensitivity_request))
             
         self.ws.send(json.dumps(sensitivity_request))
 
     def get_mental_command_active_action(self, profile_name):
-        print('get mental command active action ------------------')
+        logger.debug('get mental command active action')
         command_active_request = {
             "id": MENTAL_COMMAND_ACTIVE_ACTION_ID,
             "jsonrpc": "2.0",
@@ -838,13 +903,12 @@ class Cortex(Dispatcher):
                 "status": "get"
             }
         }
-        if self.debug:
-            print('get mental command active action \n', json.dumps(command_active_request, indent=4))
+        logger.debug('get mental command active action \n%s', lazy_json(command_active_request))
 
         self.ws.send(json.dumps(command_active_request))
 
     def set_mental_command_active_action(self, actions):
-        print('set mental command active action ------------------')
+        logger.debug('set mental command active action')
         command_active_request = {
             "id": SET_MENTAL_COMMAND_ACTIVE_ACTION_ID,
             "jsonrpc": "2.0",
@@ -857,13 +921,12 @@ class Cortex(Dispatcher):
             }
         }
 
-        if self.debug:
-            print('set mental command active action \n', json.dumps(command_active_request, indent=4))
+        logger.debug('set mental command active action \n%s', lazy_json(command_active_request))
 
         self.ws.send(json.dumps(command_active_request))
 
     def get_mental_command_brain_map(self, profile_name):
-        print('get mental command brain map ------------------')
+        logger.debug('get mental command brain map')
         brain_map_request = {
             "id": MENTAL_COMMAND_BRAIN_MAP_ID,
             "jsonrpc": "2.0",
@@ -874,12 +937,11 @@ class Cortex(Dispatcher):
                 "session": self.session_id
             }
         }
-        if self.debug:
-            print('get mental command brain map \n', json.dumps(brain_map_request, indent=4))
+        logger.debug('get mental command brain map \n%s', lazy_json(brain_map_request))
         self.ws.send(json.dumps(brain_map_request))
 
     def get_mental_command_training_threshold(self, profile_name):
-        print('get mental command training threshold -------------')
+        logger.debug('get mental command training threshold')
         training_threshold_request = {
             "id": MENTAL_COMMAND_TRAINING_THRESHOLD,
             "jsonrpc": "2.0",
@@ -889,8 +951,7 @@ class Cortex(Dispatcher):
                 "session": self.session_id
             }
         }
-        if self.debug:
-            print('get mental command training threshold \n', json.dumps(training_threshold_request, indent=4))
+        logger.debug('get mental command training threshold \n%s', lazy_json(training_threshold_request))
         self.ws.send(json.dumps(training_threshold_request))
 
 # -------------------------------------------------------------------
@@ -0,0 +1,131 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Sequential evidence (Wald SPRT) for yes/no answers from the mental command stream
+# Instead of waiting for the full timeout, the evidence of every averaged window is weighted by the
+# number of samples it holds and a decision is emitted as soon as the configured error rates are met.
+#
+# Model: every non neutral com sample is a signed power x (right/yes positive, left/no negative)
+#   yes: x ~ N(+mu, sigma^2)      no: x ~ N(-mu, sigma^2)
+#   log likelihood ratio of n samples with mean m:  2 * mu * n * m / sigma^2
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore
+import math
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class SequentialDecision():
+    """
+    Sample weighted sequential probability ratio test per question.
+
+    Attributes
+    ----------
+    alpha : float
+        accepted rate of deciding 'yes' when the answer is 'no'
+    beta : float
+        accepted rate of deciding 'no' when the answer is 'yes'
+    mu : float
+        expected mean signed power of a sample when the patient intends an answer
+    sigma : float
+        standard deviation of the signed power of a sample
+    sample_rate : float
+        com samples per second (used for the expected time to decision)
+
+    Methods
+    -------
+    start(question, time):
+        Start accumulating evidence for a new question (the previous question is added to the report)
+    add(mean, count, time):
+        Add an averaged window of count samples. Returns the decision ('yes', 'no' or None)
+    state():
+        Current evidence and decision of the question
+    report():
+        Decision, time to decision and expected time to decision for every finished question
+    snapshot() / restore(state):
+        Evidence of all questions as plain data (for a hot restart)
+    """
+    def __init__(self, alpha=0.01, beta=0.01, mu=0.3, sigma=0.6, sample_rate=8.0):
+        self.alpha = alpha
+        self.beta = beta
+        self.mu = mu
+        self.sigma = sigma
+        self.sample_rate = sample_rate
+
+        # Wald thresholds - accept 'yes' above upper, 'no' below lower
+        self.upper = math.log((1 - beta) / alpha)
+        self.lower = math.log(beta / (1 - alpha))
+        self.expected_time = self.expected_time_to_decision()
+
+        self.lock = Semaphore(1)
+        self.questions = {}
+        self.current = None
+
+
+    def start(self, question, time):
+        self.lock.acquire()
+        if self.current is not None:
+            self.questions[self.current['question']] = self.current
+        self.current = {'question': question, 'start': time, 'llr': 0.0, 'samples': 0,
+                        'decision': None, 'time_to_decision': None, 'expected_time': self.expected_time}
+        self.lock.release()
+
+
+    def add(self, mean, count, time):
+        self.lock.acquire()
+        current = self.current
+        if current is None or count <= 0:
+            self.lock.release()
+            return None
+
+        current['llr'] += 2 * self.mu * count * mean / self.sigma ** 2
+        current['samples'] += count
+        if current['decision'] is None:
+            if current['llr'] >= self.upper:
+                current['decision'] = 'yes'
+            elif current['llr'] <= self.lower:
+                current['decision'] = 'no'
+            if current['decision'] is not None:
+                current['time_to_decision'] = time - current['start']
+        decision = current['decision']
+        self.lock.release()
+        return decision
+
+
+    def state(self):
+        self.lock.acquire()
+        state = None if self.current is None else dict(self.current)
+        self.lock.release()
+        return state
+
+
+    def report(self):
+        self.lock.acquire()
+        report = {str(question): dict(q) for question, q in self.questions.items()}
+        if self.current is not None:
+            report[str(self.current['question'])] = dict(self.current)
+        self.lock.release()
+        return report
+
+
+    def snapshot(self):
+        self.lock.acquire()
+        state = {'questions': {question: dict(q) for question, q in self.questions.items()},
+                 'current': None if self.current is None else dict(self.current)}
+        self.lock.release()
+        return state
+
+
+    def restore(self, state):
+        self.lock.acquire()
+        self.questions = state['questions']
+        self.current = state['current']
+        self.lock.release()
+
+
+    # Wald's approximation of the average number of samples, worst of the two hypotheses, in seconds
+    def expected_time_to_decision(self):
+        drift = 2 * self.mu ** 2 / self.sigma ** 2  # expected log likelihood ratio per sample under 'yes'
+        n_yes = ((1 - self.beta) * self.upper + self.beta * self.lower) / drift
+        n_no = ((1 - self.alpha) * self.lower + self.alpha * self.upper) / -drift
+        return max(n_yes, n_no) / self.sample_rate
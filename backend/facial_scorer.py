@@ -0,0 +1,203 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Facial expression features per question (CAM-ICU feature 3 - altered level of consciousness)
+#   1. Every fac sample updates the statistics of the current question in constant time (counters, fixed histogram
+#      bins and running mean / variance - no sample is kept)
+#   2. Blinks are counted once per blink (first sample of a run of 'blink'), the rate is per minute of the question
+#   3. When the question changes the statistics are closed into a feature vector (fixed names and order)
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore
+import math
+
+
+# Actions of the Cortex fac stream - other values are counted as 'other'
+EYE_ACTIONS = ['neutral', 'blink', 'winkL', 'winkR', 'horiEye']
+UPPER_ACTIONS = ['neutral', 'surprise', 'frown']
+LOWER_ACTIONS = ['neutral', 'smile', 'clench', 'laugh', 'smirkLeft', 'smirkRight']
+POWER_BINS = 10  # histogram bins of the action powers (0 - 1)
+
+
+# Names of the feature vector (same order as QuestionFacial.vector())
+FEATURE_NAMES = (['samples', 'duration', 'blink_count', 'blink_rate'] +
+                 ['eye_' + action for action in EYE_ACTIONS + ['other']] +
+                 ['upper_' + action for action in UPPER_ACTIONS + ['other']] +
+                 ['lower_' + action for action in LOWER_ACTIONS + ['other']] +
+                 ['uPow_mean', 'uPow_sd', 'uPow_p50', 'uPow_p90', 'lPow_mean', 'lPow_sd', 'lPow_p50', 'lPow_p90'])
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class PowerStats():
+    # Running mean / variance (Welford) and a fixed histogram of a power (0 - 1)
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.bins = [0] * POWER_BINS
+
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.bins[min(max(int(value * POWER_BINS), 0), POWER_BINS - 1)] += 1
+
+
+    def sd(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+    # Upper edge of the bin that holds the q quantile
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        total = 0
+        for i, count in enumerate(self.bins):
+            total += count
+            if total >= target:
+                return (i + 1) / POWER_BINS
+        return 1.0
+
+
+
+class QuestionFacial():
+    # Statistics of the fac samples of one question
+    def __init__(self, question, start_time):
+        self.question = question
+        self.start_time = start_time
+        self.first_time = None
+        self.last_time = None
+        self.samples = 0
+        self.blinks = 0
+        self.last_eye = None
+        self.eye = dict.fromkeys(EYE_ACTIONS + ['other'], 0)
+        self.upper = dict.fromkeys(UPPER_ACTIONS + ['other'], 0)
+        self.lower = dict.fromkeys(LOWER_ACTIONS + ['other'], 0)
+        self.upper_power = PowerStats()
+        self.lower_power = PowerStats()
+
+
+    def add(self, data):
+        if self.first_time is None:
+            self.first_time = data['time']
+        self.last_time = data['time']
+        self.samples += 1
+
+        eye = data['eyeAct'] if data['eyeAct'] in self.eye else 'other'
+        self.eye[eye] += 1
+        if eye == 'blink' and self.last_eye != 'blink':
+            self.blinks += 1  # new blink
+        self.last_eye = eye
+
+        self.upper[data['uAct'] if data['uAct'] in self.upper else 'other'] += 1
+        self.lower[data['lAct'] if data['lAct'] in self.lower else 'other'] += 1
+        self.upper_power.add(data['uPow'])
+        self.lower_power.add(data['lPow'])
+
+
+    def features(self):
+        duration = 0.0 if self.first_time is None else self.last_time - self.first_time
+        samples = max(self.samples, 1)
+        features = {'samples': self.samples, 'duration': duration, 'blink_count': self.blinks,
+                    'blink_rate': self.blinks * 60 / duration if duration > 0 else 0.0}
+        # shares of the samples per action
+        features.update({'eye_' + action: count / samples for action, count in self.eye.items()})
+        features.update({'upper_' + action: count / samples for action, count in self.upper.items()})
+        features.update({'lower_' + action: count / samples for action, count in self.lower.items()})
+        for name, stats in (('uPow', self.upper_power), ('lPow', self.lower_power)):
+            features[name + '_mean'] = stats.mean
+            features[name + '_sd'] = stats.sd()
+            features[name + '_p50'] = stats.quantile(0.5)
+            features[name + '_p90'] = stats.quantile(0.9)
+        return features
+
+
+    def vector(self):
+        features = self.features()
+        return [features[name] for name in FEATURE_NAMES]
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class FacialScorer():
+    """
+    Streaming facial expression statistics per question (thread safe).
+
+    Methods
+    -------
+    on_sample(data):
+        Add a fac sample to the current question (constant time)
+    start(question, time):
+        Close the current question and start a new one. Returns the result of the closed question (or None)
+    current():
+        Result of the current question so far
+    results():
+        Results of all closed questions
+    clear():
+        Remove all questions
+    snapshot() / restore(state):
+        Results of the closed questions (for a hot restart - the current question starts again)
+    """
+    def __init__(self):
+        self.lock = Semaphore(1)
+        self.clear()
+
+
+    def clear(self):
+        self.lock.acquire()
+        self.question = None
+        self.closed = []
+        self.lock.release()
+
+
+    def on_sample(self, data):
+        self.lock.acquire()
+        if self.question is not None:
+            self.question.add(data)
+        self.lock.release()
+
+
+    def start(self, question, time):
+        self.lock.acquire()
+        closed = self.question
+        self.question = QuestionFacial(question, time)
+        result = None
+        if closed is not None:
+            result = self.result(closed, time)
+            self.closed.append(result)
+        self.lock.release()
+        return result
+
+
+    def current(self):
+        self.lock.acquire()
+        result = None if self.question is None else self.result(self.question, None)
+        self.lock.release()
+        return result
+
+
+    def results(self):
+        self.lock.acquire()
+        results = list(self.closed)
+        self.lock.release()
+        return results
+
+
+    def snapshot(self):
+        return {'closed': self.results()}
+
+
+    def restore(self, state):
+        self.lock.acquire()
+        self.question = None
+        self.closed = list(state['closed'])
+        self.lock.release()
+
+
+    def result(self, question, end_time):
+        return {'question': question.question, 'start_time': question.start_time, 'end_time': end_time,
+                'features': question.features(), 'vector': question.vector()}
@@ -0,0 +1,138 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Bounded handoff between the websocket receive thread and a processing thread
+#   1. The receive thread only puts the raw frame into the queue (never parses, never waits on a consumer), so socket
+#      reads keep up with Cortex whatever LiveAdvance does with the samples
+#   2. The processing thread takes the frames in batches (up to max_batch) and hands every batch to the handler.
+#      Without frames for idle_interval the handler gets an empty batch (i.e. to send queued requests)
+#   3. When the queue is full stream frames are dropped (counted) - other frames (results, errors, warnings) wait for
+#      space, they drive the Cortex bring-up and must not be lost
+#   4. Queue depth, drops and batch size / processing time are kept for the health page
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore, Thread
+import logging
+import queue
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class HandoffQueue():
+    """
+    Frames from a receive thread processed in batches on an own thread.
+
+    Attributes
+    ----------
+    handler : function
+        called with a list of frames (empty without frames for idle_interval) on the processing thread
+    droppable : function
+        True for a frame that may be dropped when the queue is full
+    max_frames : int
+        size of the queue
+    max_batch : int
+        largest number of frames per batch
+
+    Methods
+    -------
+    start() / stop():
+        Start / stop the processing thread
+    put(frame):
+        Add a frame (receive thread) - returns False if it was dropped
+    stats():
+        Depth, drops and batch size / processing time
+    """
+    def __init__(self, handler, droppable=None, max_frames=5000, max_batch=100, idle_interval=0.1,
+                 name='ProcessThread'):
+        self.handler = handler
+        self.droppable = droppable or (lambda frame: True)
+        self.frames = queue.Queue(maxsize=max_frames)
+        self.max_batch = max_batch
+        self.idle_interval = idle_interval
+        self.name = name
+        self.running = False
+        self.thread = None
+        self.lock = Semaphore(1)
+        self.received = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.batches = 0
+        self.processed = 0
+        self.batch_time = 0.0
+        self.max_batch_time = 0.0
+        self.last_batch_time = 0.0
+        self.max_batch_size = 0
+
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        self.running = False
+
+
+    def put(self, frame):
+        self.received += 1
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            if self.droppable(frame):
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % 1000 == 0:
+                    logger.warning('Handoff queue full - %s frames dropped', self.dropped)
+                return False
+            self.frames.put(frame)  # control frame - wait for the processing thread
+        depth = self.frames.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+
+    def run(self):
+        while self.running:
+            batch = []
+            try:
+                batch.append(self.frames.get(timeout=self.idle_interval))
+                while len(batch) < self.max_batch:
+                    batch.append(self.frames.get_nowait())
+            except queue.Empty:
+                pass
+
+            start = time.perf_counter()
+            try:
+                self.handler(batch)
+            except Exception:
+                logger.exception('Processing of %s frames failed', len(batch))
+            if len(batch) == 0:
+                continue
+            elapsed = time.perf_counter() - start
+
+            self.lock.acquire()
+            self.batches += 1
+            self.processed += len(batch)
+            self.batch_time += elapsed
+            self.last_batch_time = elapsed
+            self.max_batch_time = max(self.max_batch_time, elapsed)
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+            self.lock.release()
+
+
+    def stats(self):
+        self.lock.acquire()
+        batches = max(self.batches, 1)
+        stats = {'depth': self.frames.qsize(), 'max_depth': self.max_depth, 'capacity': self.frames.maxsize,
+                 'received': self.received, 'dropped': self.dropped, 'processed': self.processed,
+                 'batches': self.batches, 'mean_batch_size': self.processed / batches,
+                 'max_batch_size': self.max_batch_size,
+                 'mean_batch_ms': self.batch_time / batches * 1000, 'last_batch_ms': self.last_batch_time * 1000,
+                 'max_batch_ms': self.max_batch_time * 1000}
+        self.lock.release()
+        return stats
@@ -0,0 +1,202 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Bounded history store for the averaged (per poll) com and fac data
+# Memory stays flat for long running stations while the session history can still be queried:
+#   1. A recent tier keeps the last entries at full resolution
+#   2. Entries leaving the recent tier are downsampled into buckets of coarser tiers
+#      (min/mean/max for numbers, most common value for strings)
+#   3. Buckets leaving the coarsest tier are optionally spilled to disk (JSON lines) instead of being dropped
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore
+from collections import Counter, deque
+import json
+import os
+
+
+# Default coarse tiers: (bucket length in seconds, max number of buckets)
+# 10 s buckets for the last hour, then 5 min buckets for the last day
+DEFAULT_TIERS = ((10, 360), (300, 288))
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class TieredHistory():
+    """
+    Thread safe, bounded time series of dictionaries (i.e. {'com': 0.2} or an averaged facial expression)
+
+    Attributes
+    ----------
+    recent_size : int
+        number of entries kept at full resolution
+    tiers : tuple
+        (bucket length in seconds, max buckets) for every coarse tier, finest first
+    spill_path : str
+        JSON lines file that receives buckets leaving the coarsest tier. None to drop them
+
+    Methods
+    -------
+    add(time, values):
+        Add a new entry
+    latest():
+        Values of the newest entry (None if empty)
+    query(start, end):
+        All entries and buckets overlapping [start, end], oldest first
+    clear():
+        Remove everything that is held in memory
+    snapshot() / restore(state):
+        Entries and buckets held in memory as plain data (for a hot restart)
+    """
+    def __init__(self, recent_size=600, tiers=DEFAULT_TIERS, spill_path=None):
+        self.recent_size = recent_size
+        self.tiers = tiers
+        self.spill_path = spill_path
+        self.lock = Semaphore(1)
+        self.clear()
+
+
+    def clear(self):
+        self.lock.acquire()
+        self.recent = deque()
+        self.buckets = [deque() for _ in self.tiers]  # finished buckets per tier
+        self.open_buckets = [None for _ in self.tiers]  # bucket currently being filled per tier
+        self.lock.release()
+
+
+    def snapshot(self):
+        self.lock.acquire()
+        state = {'recent': list(self.recent), 'buckets': [list(tier) for tier in self.buckets],
+                 'open_buckets': list(self.open_buckets)}
+        self.lock.release()
+        return state
+
+
+    def restore(self, state):
+        self.lock.acquire()
+        self.recent = deque(state['recent'])
+        self.buckets = [deque(tier) for tier in state['buckets']]
+        self.open_buckets = list(state['open_buckets'])
+        self.lock.release()
+
+
+    def add(self, time, values):
+        self.lock.acquire()
+        self.recent.append((time, values))
+        if len(self.recent) > self.recent_size:
+            old_time, old_values = self.recent.popleft()
+            self._add_to_tier(0, new_bucket(old_time, old_values))
+        self.lock.release()
+
+
+    def latest(self):
+        self.lock.acquire()
+        values = self.recent[-1][1] if len(self.recent) > 0 else None
+        self.lock.release()
+        return values
+
+
+    def query(self, start=None, end=None, include_spilled=False):
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+
+        self.lock.acquire()
+        # Coarsest data is the oldest - walk the tiers from coarse to fine
+        out = []
+        for tier in reversed(range(len(self.tiers))):
+            for bucket in self.buckets[tier]:
+                if bucket['end'] >= start and bucket['start'] <= end:
+                    out.append(bucket_summary(bucket))
+            bucket = self.open_buckets[tier]
+            if bucket is not None and bucket['end'] >= start and bucket['start'] <= end:
+                out.append(bucket_summary(bucket))
+        for time, values in self.recent:
+            if start <= time <= end:
+                entry = {'time': time}
+                entry.update(values)
+                out.append(entry)
+        self.lock.release()
+
+        if include_spilled:
+            out = self._read_spilled(start, end) + out
+        return out
+
+
+    # Merge a bucket (or single entry) into the open bucket of a tier
+    def _add_to_tier(self, tier, bucket):
+        if tier >= len(self.tiers):
+            self._spill(bucket)
+            return
+
+        length, max_buckets = self.tiers[tier]
+        current = self.open_buckets[tier]
+        # Bucket boundaries are aligned to multiples of the bucket length
+        if current is not None and bucket['start'] >= current['start'] + length:
+            self.buckets[tier].append(current)
+            current = None
+            if len(self.buckets[tier]) > max_buckets:
+                self._add_to_tier(tier + 1, self.buckets[tier].popleft())
+
+        if current is None:
+            bucket_start = bucket['start'] - bucket['start'] % length
+            current = {'start': bucket_start, 'end': bucket['end'], 'count': 0, 'fields': {}}
+            self.open_buckets[tier] = current
+        merge_bucket(current, bucket)
+
+
+    def _spill(self, bucket):
+        if self.spill_path is None:
+            return
+        with open(self.spill_path, 'a') as f:
+            f.write(json.dumps(bucket_summary(bucket)) + '\n')
+
+
+    def _read_spilled(self, start, end):
+        if self.spill_path is None or not os.path.exists(self.spill_path):
+            return []
+        out = []
+        with open(self.spill_path) as f:
+            for line in f:
+                bucket = json.loads(line)
+                if bucket['end'] >= start and bucket['time'] <= end:
+                    out.append(bucket)
+        return out
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Bucket helpers
+# A bucket holds per field either [min, max, sum] (numbers) or a Counter (strings)
+def new_bucket(time, values):
+    bucket = {'start': time, 'end': time, 'count': 1, 'fields': {}}
+    for key, value in values.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            bucket['fields'][key] = [value, value, value]
+        else:
+            bucket['fields'][key] = Counter([value])
+    return bucket
+
+
+def merge_bucket(into, bucket):
+    into['end'] = max(into['end'], bucket['end'])
+    into['count'] += bucket['count']
+    for key, field in bucket['fields'].items():
+        current = into['fields'].get(key)
+        if current is None:
+            into['fields'][key] = field.copy()
+        elif isinstance(field, Counter):
+            current.update(field)
+        else:
+            current[0] = min(current[0], field[0])
+            current[1] = max(current[1], field[1])
+            current[2] += field[2]
+
+
+def bucket_summary(bucket):
+    summary = {'time': bucket['start'], 'end': bucket['end'], 'count': bucket['count']}
+    for key, field in bucket['fields'].items():
+        if isinstance(field, Counter):
+            summary[key] = field.most_common()[0][0]
+        else:
+            summary[key] = {'min': field[0], 'mean': field[2] / bucket['count'], 'max': field[1]}
+    return summary
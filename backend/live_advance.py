@@ -7,13 +7,50 @@
 #   2. A function to average the buffer (thread safe)
 #   3. A function that averages a bigger buffer of all the streamed data
 #   4. A function to clear the buffer (thread safe)
+#   5. Band power features (theta/alpha/beta) from the raw EEG stream (see band_power.py)
+#   6. A bounded, tiered history of the averaged data (see history.py)
+#   7. A sequential (sample weighted) early decision per question (see decision.py)
+#   8. Server side dot movement and answer selection at headset rate (see selection.py)
+#   9. Aggregation once per window into a non destructive log that any number of pages can read (see window_log.py)
+#   10. Sample rate and gap monitoring of the streams, gaps are marked in the recording (see stream_monitor.py)
+#   11. Explicit sessions (start/stop/reset) - output files are only opened when a session starts (see session.py)
+#   12. Cortex markers for questions and answers and a Cortex record per session (sent from the Cortex thread)
+#   13. Answers in a transactional SQLite store, exported per session as JSON Lines (see answer_store.py)
+#   14. Mental command sensitivity calibration, cached per profile (see calibration.py)
+#   15. Server clocked question timeline with switch and presentation jitter in the recording (see stimulus.py)
+#   16. As-of alignment of the streams on their Cortex time - recording rows join com and fac of one instant
+#       (see alignment.py)
+#   17. Facial expression features per question, closed when the question changes (see facial_scorer.py)
+#   18. Configurable filter chain of the com power (smoothing, outliers, dead zone, rate limit - see com_filter.py)
+#   19. Streams are subscribed per page phase and consumer, debounced (see subscriptions.py)
+#   20. Snapshots of the session state every second - a restarted backend resumes the session (see snapshot.py)
 # -----------------------------------------------------------------------------------------------------------------------------
 # -----------------------------------------------------------------------------------------------------------------------------
 import cortex
 from cortex import Cortex
-from threading import Semaphore
+from band_power import BandPowerExtractor, channel_indices
+from history import TieredHistory
+from decision import SequentialDecision
+from selection import SelectionStateMachine
+from window_log import WindowLog
+from stream_monitor import StreamMonitor
+from session import SessionRecorder, check_patient
+from answer_store import AnswerStore, page_rows
+from calibration import SensitivityCalibration, SensitivityCache, DEFAULT_SENSITIVITY
+from stimulus import StimulusScheduler
+from alignment import StreamAligner, STREAM_COLUMNS
+from facial_scorer import FacialScorer, FEATURE_NAMES
+from com_filter import FilterChain, load_chain
+from subscriptions import SubscriptionManager
+from snapshot import SnapshotWriter, read_snapshot
+from threading import Semaphore, Thread
 from collections import Counter
-import csv
+import time
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
 
 
 # -----------------------------------------------------------------------------------------------------------------------------
@@ -42,6 +79,14 @@ class LiveAdvance():
         To get the sensitivity of the 4 active mental command actions.
     set_sensitivity(profile_name):
         To set the sensitivity of the 4 active mental command actions.
+    start_session(patient):
+        To reset all buffers and open the output files of a new session
+    stop_session():
+        To close the output files of the current session
+    reset():
+        To replace all buffers with empty ones (constant time)
+    restore(max_age):
+        To resume the session of the last snapshot (after a crash or an upgrade of the backend)
     """
     def __init__(self, app_client_id, app_client_secret, **kwargs):
         self.c = Cortex(app_client_id, app_client_secret, debug_mode=False, **kwargs)
@@ -51,20 +96,88 @@ class LiveAdvance():
         self.c.bind(save_profile_done=self.on_save_profile_done)
         self.c.bind(new_com_data=self.on_new_com_data)
         self.c.bind(new_fe_data=self.on_new_fe_data)
+        self.c.bind(new_eeg_data=self.on_new_eeg_data)
+        self.c.bind(new_data_labels=self.on_new_data_labels)
+        self.c.bind(new_dev_data=self.on_new_dev_data)
         self.c.bind(get_mc_active_action_done=self.on_get_mc_active_action_done)
         self.c.bind(mc_action_sensitivity_done=self.on_mc_action_sensitivity_done)
         self.c.bind(inform_error=self.on_inform_error)
+        self.c.bind(inject_marker_done=self.on_inject_marker_done)
+        self.c.bind(create_record_done=self.on_create_record_done)
+        self.c.bind(stop_record_done=self.on_stop_record_done)
+        self.c.bind(export_record_done=self.on_export_record_done)
 
         self.com_buffer = []
         self.fac_buffer = []
-        self.avg_com_buffer = []
-        self.avg_fac_buffer = []
+        # History of the averaged data - full resolution for recent entries, downsampled afterwards
+        self.avg_com_buffer = TieredHistory()
+        self.avg_fac_buffer = TieredHistory()
         self.t_buffer = []
         self.com_lock = Semaphore(1)
         self.fac_lock = Semaphore(1)
         self.t_lock = Semaphore(1)
 
+        # Sequential evidence for an early yes/no decision of the current question
+        self.decision = SequentialDecision()
+
+        # Dot movement and answer selection - answers are saved as soon as the dot hits a box
+        self.selection = SelectionStateMachine(on_answer=self.save_answer)
+
+        # Window aggregates (com, fac) - the buffers are averaged once per window by the window thread
+        self.window_log = WindowLog()
+        self.window_interval = 0.1
+        self.windows_running = False
+        self.com_count = 0  # number of samples in the last com average
+
+        # Sample rate and gaps of every stream - gaps are written to the recording
+        self.monitor = StreamMonitor(on_gap=self.save_gap, on_gap_start=self.save_gap_start)
+
+        # Output files - nothing is written until a session is started
+        self.recorder = SessionRecorder()
+        self.session_id = None
+        self.resumed = False  # the open session came from a snapshot (restore)
+
+        # Answers of all sessions - the database is created by the first answer
+        self.answers = AnswerStore(os.path.join(self.recorder.root, 'answers.db'))
+
+        # Sensitivity calibration - the calibrated values of a profile are used from the next session on
+        self.sensitivity_cache = SensitivityCache()
+        self.calibration = SensitivityCalibration(self.set_calibration_values, on_done=self.on_calibration_done)
+        self.subscribed = False  # Cortex session ready for subscriptions
+
+        # Subscribed streams follow the page phase and the consumers (checked by the window thread)
+        self.subscriptions = SubscriptionManager(self.subscribe_streams, self.unsubscribe_streams)
+
+        # State of the open session written every second - restored when the backend starts again
+        self.snapshots = SnapshotWriter(os.path.join(self.recorder.root, 'snapshot.bin'), self.snapshot_state)
+
+        # Question timeline of the pages - switches the question number and times out questions
+        self.stimulus = StimulusScheduler(on_switch=self.on_stimulus, on_timeout=self.timeout_answer)
+
+        # Columns of the com, fac and pow streams on their Cortex time - joined as-of for the recording rows
+        self.aligner = StreamAligner()
+        self.align_tolerance = 0.25  # largest time (s) between a com sample and the fac sample joined to it
+        self.last_com_time = None
+
+        # Facial expression statistics of the current question (CAM-ICU feature 3)
+        self.facial = FacialScorer()
+
+        # Filter chain of the com samples (config/com_filters.json) - applied before buffering and the dot
+        self.com_filter = load_chain()
+
+        # Cortex record of the session and marker of the current question (ids are set by the Cortex callbacks)
+        self.record_id = None
+        self.export_dir = None
+        self.question_marker_id = None
+
+        # Band power extractor is created once the eeg labels (channels) are known
+        self.pow_extractor = None
+        self.eeg_channels = []
+        self.band_power = None
+        self.pow_lock = Semaphore(1)
+
         self.question_number = -1
+        self.question_time = 0  # time the current question was shown (for the answer latency)
         self.start_time = 0
 
 
@@ -157,6 +270,7 @@ class LiveAdvance():
         To subscribe to one or more data streams
         'com': Mental command
         'fac' : Facial expression
+        'eeg' : Raw EEG (used for band power)
         'sys': training event
 
         Parameters
@@ -228,8 +342,246 @@ class LiveAdvance():
         self.c.set_mental_command_action_sensitivity(profile_name, values)
 
 
+    # Start the guided calibration trials (the cue of the current trial is in self.calibration.state())
+    def start_calibration(self):
+        if self.profile_name == '' or not self.subscribed:
+            return False  # needs a loaded profile and the com stream
+        self.subscriptions.acquire('calibration', ['com'], time.monotonic())
+        self.calibration.start()
+        return True
+
+
+    # Sensitivity of a calibration trial - sent from the Cortex thread
+    def set_calibration_values(self, values):
+        self.c.queue_request(self.c.set_mental_command_action_sensitivity, self.profile_name, values)
+
+
+    def on_calibration_done(self, values, results):
+        logger.info('Calibrated sensitivity %s for profile %s', values, self.profile_name)
+        self.sensitivity_cache.put(self.profile_name, values, results)
+        self.set_calibration_values(values)  # saved to the profile once Cortex confirms
+        self.subscriptions.release('calibration', time.monotonic())
+
+
+    # Page phase (intro, test, exit - see subscriptions.py) and page activity
+    def set_phase(self, phase):
+        self.subscriptions.set_phase(phase, time.monotonic())
+
+
+    def touch(self):
+        self.subscriptions.touch(time.monotonic())
+
+
+    # Sent from the processing thread - unsubscribed streams are paused in the monitor (no gap is recorded)
+    def subscribe_streams(self, streams):
+        self.c.queue_request(self.c.sub_request, streams)
+
+
+    def unsubscribe_streams(self, streams):
+        for stream in streams:
+            self.monitor.pause(stream)
+        self.c.queue_request(self.c.unsub_request, streams)
+
+
+    # Phase, subscribed streams and the messages, bytes and CPU time saved by unsubscribing
+    def subscription_state(self):
+        return self.subscriptions.state(time.monotonic(), self.c.stream_usage)
+
+
+    def start_session(self, patient=''):
+        check_patient(patient)  # before anything of the open session is reset
+        start_time = time.time()
+        self.reset()  # no stale data from the previous session
+        self.set_start_time(start_time)
+        self.set_question_number(-1)
+        self.session_id = self.recorder.open(patient, start_time)
+        self.resumed = False
+        self.snapshots.start()
+        logger.info('Session %s started', self.session_id)
+
+        # Wrap the session in a Cortex record so the full rate headset data can be aligned offline
+        if self.c.session_id != '':
+            self.c.queue_request(self.c.create_record, self.session_id, description='CAM-ICU session')
+        return self.session_id
+
+
+    def stop_session(self):
+        if self.session_id is None:
+            return
+        self.stimulus.stop()
+        self.recorder.write_json('decisions.json', self.decision.report())
+        self.recorder.write_json('stimuli.json', self.stimulus.report())
+        self.stimulus.clear_report()
+        self.save_aligned()
+        self.recorder.write_json('facial_features.json', self.facial_features())
+        self.answers.export_jsonl(os.path.join(self.recorder.session_dir, 'answers.jsonl'), self.session_id)
+        self.recorder.close(time.time())
+
+        # Stop the Cortex record - it is exported to the session folder once Cortex confirms the stop
+        if self.record_id is not None:
+            self.export_dir = os.path.abspath(self.recorder.session_dir)
+            self.c.queue_request(self.c.stop_record)
+        logger.info('Session %s stopped', self.session_id)
+        self.session_id = None
+        self.snapshots.remove()  # ended normally - nothing to resume
+
+
+    def reset(self):
+        # Swap in new, empty buffers while holding all buffer locks - constant time whatever the buffer size,
+        # the old buffers are left to the garbage collector
+        self.com_lock.acquire()
+        self.fac_lock.acquire()
+        self.t_lock.acquire()
+        self.com_buffer = []
+        self.fac_buffer = []
+        self.t_buffer = []
+        self.com_count = 0
+        self.avg_com_buffer = TieredHistory()
+        self.avg_fac_buffer = TieredHistory()
+        self.decision = SequentialDecision()
+        self.t_lock.release()
+        self.fac_lock.release()
+        self.com_lock.release()
+
+        self.pow_lock.acquire()
+        self.band_power = None
+        if self.pow_extractor is not None:
+            self.pow_extractor.reset()
+        self.pow_lock.release()
+
+        self.aligner.clear()
+        self.last_com_time = None
+        self.facial.clear()
+        self.com_filter.reset()
+
+
+    # Replace the com filter chain (stage definitions, see com_filter.py) - raises ValueError for unknown stages
+    def set_com_filters(self, config):
+        self.com_filter = FilterChain(config)  # swapped in one assignment - the Cortex thread uses the old or new chain
+
+
+    # State of the open session as plain data (None without a session) - written by the snapshot thread
+    def snapshot_state(self):
+        recorder = self.recorder.state()
+        if self.session_id is None or recorder is None:
+            return None
+        self.t_lock.acquire()
+        t_buffer = list(self.t_buffer)
+        self.t_lock.release()
+        return {'time': time.time(),
+                'session': recorder,
+                'start_time': self.start_time,
+                'question_number': self.question_number,
+                'question_time': self.question_time,
+                't_buffer': t_buffer,
+                'avg_com': self.avg_com_buffer.snapshot(),
+                'avg_fac': self.avg_fac_buffer.snapshot(),
+                'decision': self.decision.snapshot(),
+                'windows': self.window_log.snapshot(),
+                'facial': self.facial.snapshot(),
+                'stimulus': self.stimulus.snapshot(),
+                'selection': self.selection.snapshot(),
+                'phase': self.subscriptions.phase,
+                'cortex': {'auth': self.c.auth, 'headset_id': self.c.headset_id}}
+
+
+    # Resume the session of the last snapshot - the time without snapshots is marked as an outage in the recording.
+    # Returns False if there is no snapshot or it is older than max_age (s)
+    def restore(self, max_age=600):
+        state = read_snapshot(self.snapshots.path)
+        if state is None:
+            return False
+        now = time.time()
+        outage = now - state['time']
+        if outage > max_age:
+            logger.warning('Snapshot of session %s is %.0f s old - not resumed', state['session']['info']['session_id'],
+                           outage)
+            self.snapshots.remove()
+            return False
+
+        self.reset()
+        self.session_id = self.recorder.reopen(state['session'])
+        self.resumed = True
+        self.start_time = state['start_time']
+        self.question_number = state['question_number']
+        self.question_time = state['question_time']
+        self.t_lock.acquire()
+        self.t_buffer = list(state['t_buffer'])
+        self.t_lock.release()
+        self.avg_com_buffer.restore(state['avg_com'])
+        self.avg_fac_buffer.restore(state['avg_fac'])
+        self.decision.restore(state['decision'])
+        self.window_log.restore(state['windows'])
+        self.facial.restore(state['facial'])
+        self.facial.start(self.question_number, now)
+        self.selection.restore(state['selection'])  # the open page set up its geometry once, when it was loaded
+        self.selection.set_question(self.question_number)  # the current question is answered again
+        self.save_marker(state['time'], 'outage:{0:.3f}'.format(outage))
+        self.subscriptions.set_phase(state['phase'], time.monotonic())  # the open page keeps its streams
+        self.c.set_token(state['cortex']['auth'], state['cortex']['headset_id'])
+        self.stimulus.restore(state['stimulus'])  # the current question is asked again
+        self.snapshots.start()
+        logger.warning('Session %s resumed after an outage of %.3f s', self.session_id, outage)
+        return True
+
+
+    # Returns the facial expression features of the previous question (None for the first question)
     def set_question_number(self, new_number):
         self.question_number = new_number
+        self.question_time = time.time()
+        facial = self.facial.start(new_number, self.question_time)
+        self.decision.start(new_number, time.time())  # start collecting evidence for the new question
+        self.selection.set_question(new_number)  # reset the dot for the new question
+
+        # Marker for the question - the previous question marker ends now
+        if self.session_id is not None:
+            now = time.time() * 1000
+            if self.question_marker_id is not None:
+                self.c.queue_request(self.c.update_marker_request, self.question_marker_id, now)
+                self.question_marker_id = None
+            self.mark('question', new_number, now)
+        return facial
+
+
+    # Facial expression features of the closed questions and the current one
+    def facial_features(self):
+        return {'names': FEATURE_NAMES, 'questions': self.facial.results(), 'current': self.facial.current()}
+
+
+    # Question switched by the stimulus scheduler (scheduler thread, monotonic times)
+    def on_stimulus(self, question, scheduled, actual):
+        self.set_question_number(question)
+        self.clear_timeout()
+        self.save_marker(time.time(), 'stimulus:{0}:{1:.3f}'.format(question, (actual - scheduled) * 1000))
+
+
+    # The page presented the question of a stimulus event - presentation latency in the recording
+    def stimulus_shown(self, seq):
+        stimulus = self.stimulus.shown(seq)
+        if stimulus is not None and stimulus['shown_latency'] is not None:
+            self.save_marker(time.time(), 'shown:{0}:{1:.3f}'.format(stimulus['question'],
+                                                                     stimulus['shown_latency'] * 1000))
+
+
+    # Answer of a question that timed out - same rule as the timeout of the pages (sign of average_t)
+    def timeout_answer(self, question):
+        total = self.average_t()
+        answer = 'yes' if total > 0 else 'no' if total < 0 else 'NaN'
+        if self.session_id is not None:
+            now = time.time()
+            self.answers.add(self.session_id, question, answer, 'answer', 'timeout', now - self.question_time, now)
+        self.mark('answer', answer)
+        return answer
+
+
+    # Add a marker to the Cortex session (non blocking - sent from the Cortex thread)
+    # time in ms since epoch, value is a string or an integer
+    def mark(self, label, value, time_ms=None):
+        if self.c.session_id == '':
+            return  # no headset session
+        if time_ms is None:
+            time_ms = time.time() * 1000
+        self.c.queue_request(self.c.inject_marker_request, time_ms, value, label)
 
         
     def set_start_time(self, time):
@@ -240,12 +592,17 @@ class LiveAdvance():
 # -----------------------------------------------------------------------------------------------------------------------------
     # callbacks functions
     def on_create_session_done(self, *args, **kwargs):
-        print('on_create_session_done')
+        logger.info('on_create_session_done')
+        if self.session_id is not None and self.record_id is None:
+            # session opened before the Cortex session existed (i.e. restored from a snapshot) - the rest of it goes
+            # into a new Cortex record
+            description = 'CAM-ICU session (resumed)' if self.resumed else 'CAM-ICU session'
+            self.c.create_record(self.session_id, description=description)
         self.c.query_profile()
 
 
     def on_query_profile_done(self, *args, **kwargs):
-        print('on_query_profile_done')
+        logger.info('on_query_profile_done')
         self.profile_lists = kwargs.get('data')
         if self.profile_name in self.profile_lists:
             # the profile is existed
@@ -257,49 +614,79 @@ class LiveAdvance():
 
     def on_load_unload_profile_done(self, *args, **kwargs):
         is_loaded = kwargs.get('isLoaded')
-        print("on_load_unload_profile_done: " + str(is_loaded))
+        logger.info('on_load_unload_profile_done: %s', is_loaded)
         
         if is_loaded == True:
             # get active action
             self.get_active_action(self.profile_name)
         else:
-            print('The profile ' + self.profile_name + ' is unloaded')
+            logger.info('The profile %s is unloaded', self.profile_name)
             self.profile_name = ''
 
 
     def on_save_profile_done (self, *args, **kwargs):
-        print('Save profile ' + self.profile_name + " successfully")
-        # subscribe mental command data 'com' and facial expression data 'fac
-        stream = ['com', 'fac']
-        self.c.sub_request(stream)
+        logger.info('Save profile %s successfully', self.profile_name)
+        if self.subscribed:
+            return  # profile saved after a calibration - streams are already subscribed
+        self.subscribed = True
+        # subscribe the streams of the current page phase: mental command data 'com', facial expression data 'fac',
+        # raw eeg 'eeg' for band power and device information 'dev' (signal quality and battery) for the stream monitor
+        self.subscriptions.enable(time.monotonic())
 
 
     def on_get_mc_active_action_done(self, *args, **kwargs):
         data = kwargs.get('data')
-        print('on_get_mc_active_action_done: {}'.format(data))
+        logger.info('on_get_mc_active_action_done: %s', data)
         self.get_sensitivity(self.profile_name)
 
 
     def on_mc_action_sensitivity_done(self, *args, **kwargs):
         data = kwargs.get('data')
-        print('on_mc_action_sensitivity_done: {}'.format(data))
+        logger.info('on_mc_action_sensitivity_done: %s', data)
         if isinstance(data, list):
-            # get sensitivity
-            new_values = [7,7,5,5]
+            # get sensitivity -> calibrated values of the profile (default until it is calibrated)
+            new_values = self.sensitivity_cache.get(self.profile_name)
+            if new_values is None:
+                logger.info('Profile %s is not calibrated - default sensitivity', self.profile_name)
+                new_values = DEFAULT_SENSITIVITY
             self.set_sensitivity(self.profile_name, new_values)
-        else:
-            # set sensitivity done -> save profile
+        elif not self.calibration.running:
+            # set sensitivity done -> save profile (not for the trials of a calibration)
             self.save_profile(self.profile_name)
 
 
+    def on_inject_marker_done(self, *args, **kwargs):
+        marker = kwargs.get('data')
+        if marker.get('label') == 'question':
+            self.question_marker_id = marker['uuid']  # ended by the next question
+
+
+    def on_create_record_done(self, *args, **kwargs):
+        record = kwargs.get('data')
+        self.record_id = record['uuid']
+        logger.info('Cortex record %s created', self.record_id)
+
+
+    def on_stop_record_done(self, *args, **kwargs):
+        record = kwargs.get('data')
+        logger.info('Cortex record %s stopped - exporting to %s', record['uuid'], self.export_dir)
+        # runs on the Cortex thread - the export request can be sent straight away
+        self.c.export_record(self.export_dir, ['EEG', 'MOTION', 'PM', 'BP'], 'CSV', [record['uuid']], 'V2')
+        self.record_id = None
+
+
+    def on_export_record_done(self, *args, **kwargs):
+        logger.info('Cortex records exported: %s', kwargs.get('data'))
+
+
     def on_inform_error(self, *args, **kwargs):
         error_data = kwargs.get('error_data')
         error_code = error_data['code']
         error_message = error_data['message']
-        print(error_data)
+        logger.error('%s', error_data)
         if error_code == cortex.ERR_PROFILE_ACCESS_DENIED:
             # disconnect headset for next use
-            print('Get error ' + error_message + ". Disconnect headset to fix this issue for next use.")
+            logger.error('Get error %s. Disconnect headset to fix this issue for next use.', error_message)
             self.c.disconnect_headset()
 
 
@@ -313,12 +700,23 @@ class LiveAdvance():
         # Data is as follows:
         # action: range(right, left, neutral) - type of command
         # power: range(0 - 1) - strength of command
-        self.com_lock.acquire() # Acquire lock
         data = kwargs.get('data')
-        # print('mc data: {}'.format(data))
+        # The sample is read before it is buffered - once in com_buffer, average_com (window thread) may negate
+        # the power of a left sample in place
+        self.aligner.add('com', data['time'], data)
+        self.last_com_time = data['time']
+        self.monitor.record('com', data['time'])
+        self.calibration.on_sample(data['action'], data['power'], data['time'])  # raw - calibrates Cortex itself
+        signed = self.com_filter.apply(data)  # in place - action and power of the filtered value, left is negative
+        self.com_lock.acquire() # Acquire lock
+        # logger.debug('mc data: %s', data)
         self.com_buffer.append(data) 
         self.com_lock.release() # Release Lock
 
+        # Move the server side dot - neutral does not move the dot
+        if signed != 0:
+            self.selection.on_sample(signed, data['time'])
+
 
     # When new facial expression data is received store it in buffer
     def on_new_fe_data(self, *args, **kwargs):
@@ -328,11 +726,57 @@ class LiveAdvance():
         # uPow: range(0 - 1) - upper facial action power 
         # lAct: range(smile, clenched teeth, laugh) - lower facial action
         # lPow: range(0 - 1) - lower facial action power
-        self.fac_lock.acquire()  # Acquire lock
         data = kwargs.get('data')
-        # print('facial data: {}'.format(data))
+        self.aligner.add('fac', data['time'], data)
+        self.facial.on_sample(data)
+        self.fac_lock.acquire()  # Acquire lock
+        # logger.debug('facial data: %s', data)
         self.fac_buffer.append(data)
         self.fac_lock.release()  # release lock
+        self.monitor.record('fac', data['time'])
+
+
+    # When new device data is received update the stream monitor
+    def on_new_dev_data(self, *args, **kwargs):
+        # Data is as follows:
+        # signal: range(0 - 1) - overall signal quality
+        # dev: list of contact quality per sensor
+        # batteryPercent: range(0 - 100) - battery level
+        data = kwargs.get('data')
+        self.monitor.record('dev', data['time'])
+        self.monitor.set_device(data['signal'], data['batteryPercent'])
+
+
+    # When the eeg stream is subscribed Cortex sends its column labels - used to find the channels
+    def on_new_data_labels(self, *args, **kwargs):
+        data = kwargs.get('data')
+        if data['streamName'] == 'eeg':
+            self.pow_lock.acquire()
+            self.eeg_channels = channel_indices(data['labels'])
+            self.pow_extractor = BandPowerExtractor(len(self.eeg_channels))
+            self.pow_lock.release()
+
+
+    # When new eeg data is received add it to the band power extractor
+    def on_new_eeg_data(self, *args, **kwargs):
+        # Data is as follows:
+        # eeg: list of values (COUNTER, INTERPOLATED, channels..., RAW_CQ, MARKER_HARDWARE)
+        # time: time of sample
+        data = kwargs.get('data')
+        self.monitor.record('eeg', data['time'])
+        result = None
+        self.pow_lock.acquire()
+        if self.pow_extractor is not None:
+            eeg = data['eeg']
+            # A new result is only returned every hop (fixed rate)
+            result = self.pow_extractor.push([eeg[i] for i in self.eeg_channels], data['time'])
+            if result is not None:
+                self.band_power = result
+        self.pow_lock.release()
+        if result is not None:
+            # mean over the channels per band
+            self.aligner.add('pow', result['time'], {band: sum(result[band]) / len(result[band])
+                                                     for band in STREAM_COLUMNS['pow']})
   
         
 
@@ -353,6 +797,8 @@ class LiveAdvance():
 
         # If buffer empty
         if (len(self.com_buffer) <= 0):
+            self.com_count = 0
+            self.com_lock.release()  # Unlock
             return 0 
         
         sum = 0
@@ -371,14 +817,21 @@ class LiveAdvance():
         else:    
             total = sum/ count
 
-        self.avg_com_buffer.append(total)
+        self.avg_com_buffer.add(time.time(), {'com': total})
+        self.com_count = count
         self.com_buffer.clear()  # Clear buffer for next set of data    
         self.com_lock.release()  # Unlock
 
-        # Add to timeout buffer
-        self.t_lock.acquire()
-        self.t_buffer.append(total)
-        self.t_lock.release()
+        # Only a question collects the timeout sum and decision evidence - without one (question -1, intro and exit
+        # pages) nothing clears t_buffer, it would grow for as long as the page is open
+        if self.question_number >= 0:
+            # Add to timeout buffer - with the number of samples the average holds
+            self.t_lock.acquire()
+            self.t_buffer.append((total, count))
+            self.t_lock.release()
+
+            # Add evidence for an early decision
+            self.decision.add(total, count, time.time())
 
         return total  # Return avg power
 
@@ -414,21 +867,64 @@ class LiveAdvance():
         # Average power for the most common lower facial expression
         avg['lPow'] = float(sum(i['lPow'] for i in self.fac_buffer if i['lAct'] == avg['lAct'])) / lAct_c.most_common()[0][1]
         
-        self.avg_fac_buffer.append(avg)
+        self.avg_fac_buffer.add(time.time(), avg)
         self.fac_buffer.clear()  # clear buffer for next round data
         self.fac_lock.release()  # Unlock
         return avg
     
 
     # Calculate the timout out average data 
+    # Every average is weighted by the number of samples it holds, the sign shows the answer (> 0 yes, < 0 no)
     def average_t(self):
         self.t_lock.acquire()
         total = 0
-        total += sum(self.t_buffer)
+        total += sum(avg * count for avg, count in self.t_buffer)
         self.t_lock.release()
         return total
     
 
+    # Aggregate the buffers of one window, save it to the CSV and add it to the window log
+    def aggregate_window(self):
+        current_time = time.time()
+        com = self.average_com()
+        fac = self.average_fac()
+        self.save_current_avg(current_time)
+        return self.window_log.append({'time': current_time, 'com': com, 'count': self.com_count, 'fac': fac})
+
+
+    # Aggregate a window every window_interval seconds (on its own thread)
+    def start_windows(self, interval=0.1):
+        self.window_interval = interval
+        self.windows_running = True
+        Thread(target=self.run_windows, name='WindowThread', daemon=True).start()
+
+
+    def stop_windows(self):
+        self.windows_running = False
+
+
+    def run_windows(self):
+        next_time = time.monotonic()
+        while self.windows_running:
+            self.aggregate_window()
+            self.subscriptions.check(time.monotonic())
+            self.monitor.check_overdue(time.time())  # Cortex time - a stream that stopped has no sample to end its gap
+            next_time += self.window_interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.monotonic()  # behind schedule - skip the missed windows
+
+
+    # Latest band power (published at a fixed rate by the extractor - None until enough eeg data is received)
+    def average_pow(self):
+        self.pow_lock.acquire()
+        band_power = self.band_power
+        self.pow_lock.release()
+        return band_power
+
+
     def clear_timeout(self):
         self.t_lock.acquire()
         self.t_buffer.clear()  # clear timout buffer as question was answered
@@ -438,29 +934,30 @@ class LiveAdvance():
 # -----------------------------------------------------------------------------------------------------------------------------
 # -----------------------------------------------------------------------------------------------------------------------------
 # Functions related to saving data
-    # Create CSV and Add header to file
-    header = ['question_number', 'time', 'com_power', 'eyeAct', 'uAct', 'uPow', 'lAct', 'lPow']
-    with open('user_answers/user_recordings.csv', 'w') as f:
-        w = csv.writer(f)
-        w.writerow(header)
-
+# The CSV (and its header) is created by the recorder when a session starts (see session.py)
 
 
     def save_current_avg(self, time):
         c_time = time - self.start_time  # time elapsed since starting 
 
-        # Acquire data from buffer - thread safe
-        self.fac_lock.acquire()
-        self.com_lock.acquire()
+        # Latest com average (history is thread safe) with the facial expression sample as-of the Cortex time of the
+        # latest com sample - both come from the same instant (NaN if there is no fac sample within the tolerance)
+        com_data = self.avg_com_buffer.latest()
+        if self.last_com_time is None:
+            fac_data = self.avg_fac_buffer.latest()
+        else:
+            aligned = self.aligner.align([self.last_com_time], ['fac'], self.align_tolerance)
+            fac_data = None
+            if aligned['fac.eyeAct'][0] is not None:
+                fac_data = {name: aligned['fac.' + name][0] for name in STREAM_COLUMNS['fac']}
 
-        if len(self.avg_fac_buffer) == 0:  # If  buffer empty 
+        if fac_data is None:  # If  buffer empty 
             eyeAct = 'NaN'
             uAct = 'NaN'
             uPow = 'NaN'
             lAct = 'NaN'
             lPow = 'NaN'
         else:
-            fac_data = self.avg_fac_buffer[-1] # -1 for last entry in buffers
             # extract data for facial expression
             eyeAct = fac_data['eyeAct']
             uAct = fac_data['uAct']
@@ -468,25 +965,72 @@ class LiveAdvance():
             lAct = fac_data['lAct']
             lPow = fac_data['lPow']
 
-        if len(self.avg_com_buffer) == 0:
+        if com_data is None:
             com = 'NaN'
         else:
-            com = self.avg_com_buffer[-1]
-
-        self.fac_lock.release()
-        self.com_lock.release()
+            com = com_data['com']
 
 
         # create new entry for CSV with structure:
         # [time, question number, avg mental command (for this time frame - 0.1s), avg facial expression (for this time frame)]
-        new_entry = [self.question_number, c_time, com, eyeAct, uAct, uPow, lAct, lPow]  
+        new_entry = [self.question_number, c_time, com, eyeAct, uAct, uPow, lAct, lPow, '']  
+        self.write_recording(new_entry)
 
-        # write new entry to CSV
-        with open('user_answers/user_recordings.csv', 'a') as f:
-            w = csv.writer(f)
-            w.writerow(new_entry)
-      
-        
+
+    # All com samples of the session with the fac and pow samples as-of their Cortex time (aligned.csv, for offline use)
+    def save_aligned(self):
+        times = self.aligner.timeline('com')
+        aligned = self.aligner.align(times, tolerance=self.align_tolerance)
+        self.recorder.write_csv('aligned.csv', ['time'] + list(aligned.keys()), zip(times, *aligned.values()))
+
+
+    # Add a marker row to the CSV (no data, only the marker text)
+    def save_marker(self, time, marker):
+        c_time = time - self.start_time  # time elapsed since starting 
+        self.write_recording([self.question_number, c_time, 'NaN', 'NaN', 'NaN', 'NaN', 'NaN', 'NaN', marker])
+
+
+    # Mark a gap of a stream in the recording - i.e. 'gap:com:2.350' for 2.35 seconds without com data
+    def save_gap(self, stream, start, end):
+        logger.warning('Gap of %.3f s in stream %s', end - start, stream)
+        self.save_marker(start, 'gap:{0}:{1:.3f}'.format(stream, end - start))
+
+
+    # Stream stopped - no sample since start (the gap marker follows when the stream comes back)
+    def save_gap_start(self, stream, start):
+        logger.warning('No %s sample since %.3f s', stream, time.time() - start)
+        self.save_marker(start, 'gap_start:{0}'.format(stream))
+
+
+    # write new entry to CSV of the session (recorder is thread safe - window and websocket thread both write rows)
+    def write_recording(self, new_entry):
+        self.recorder.write_row(new_entry)
+
+
+    # Save an answer selected on the server (selection state machine) - same store as the answers sent by the pages
+    def save_answer(self, event):
+        if self.session_id is not None:
+            self.answers.add(self.session_id, event['question'], event['answer'], 'answer', 'dot',
+                             event['time'] - self.question_time, event['time'])
+        self.mark('answer', event['answer'])
+        self.stimulus.answered(event['question'])  # next question of the timeline
+
+
+    # Save the answers sent by a page (one row per answer, score and word)
+    # Returns False if the answers could not be committed (the page must not treat them as saved)
+    def save_response(self, output):
+        saved = True
+        if self.session_id is not None:
+            now = time.time()
+            # The pages post the whole test once it is complete - only the answer (and score) of the current question
+            # was given just now, the latency of the earlier ones is in their dot / timeout rows
+            latency = now - self.question_time if self.question_time > 0 else None
+            for kind, question, value in page_rows(output):
+                self.answers.add(self.session_id, question, value, kind, 'page',
+                                 latency if question == self.question_number else None, now)
+            saved = self.answers.flush()  # acknowledged only once the grouped commit with these rows is done
+        self.mark('answers_saved', self.question_number)
+        return saved
 
 
 # -----------------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,424 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# HTTP load and soak test of the Flask endpoints of main.py
+#   1. serve: main.py without a headset - a synthetic stream source feeds LiveAdvance with com, fac and dev samples at
+#      Cortex rates, the rosbridge stand-in replaces ARI. It records to its own folder (--root, default a temporary
+#      one) and closes its session on SIGTERM
+#   2. run: page clients replay what the question pages do - /next_question when a question starts, /BCI_data every
+#      req_interval, /timeout_data when a question times out, /save_data when a test is complete (one keep-alive
+#      connection per client, requests of a client are sequential like the synchronous XHR of the pages)
+#   3. Latency per endpoint in fixed log buckets (bounded memory for multi hour soaks), errors per endpoint and the
+#      RSS of the server (/proc, Linux) per report interval - growth is the least squares slope in MB per hour
+#
+# Usage: python backend/load_test.py run --clients 4 --duration 60 (starts the server itself)
+#        python backend/load_test.py run --url http://localhost:5000 --pid 1234 --duration 14400 --report soak.json
+#        python backend/load_test.py serve --port 5001
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore, Thread, Event
+from urllib.parse import urlparse
+import http.client
+import subprocess
+import tempfile
+import argparse
+import random
+import shutil
+import signal
+import math
+import json
+import time
+import sys
+import os
+
+
+ENDPOINTS = ['/BCI_data', '/timeout_data', '/next_question', '/save_data']
+FAC_EYE = ['neutral', 'neutral', 'neutral', 'blink', 'winkL', 'winkR']
+FAC_UPPER = ['neutral', 'surprise', 'frown']
+FAC_LOWER = ['neutral', 'smile', 'clench']
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class SyntheticSource():
+    """
+    Fake Cortex streams - calls the new data callbacks of LiveAdvance like the websocket thread does.
+
+    Attributes
+    ----------
+    stream : LiveAdvance
+        receiver of the samples
+    rates : dict
+        samples per second of com, fac and dev
+
+    Methods
+    -------
+    start() / stop():
+        Start / stop the source thread
+    """
+    def __init__(self, stream, rates=None, seed=0):
+        self.stream = stream
+        self.rates = rates or {'com': 8, 'fac': 32, 'dev': 2}
+        self.random = random.Random(seed)
+        self.stopped = Event()
+        self.thread = None
+
+
+    def start(self):
+        self.thread = Thread(target=self.run, name='SyntheticSourceThread', daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        self.stopped.set()
+
+
+    def run(self):
+        handlers = {'com': self.com, 'fac': self.fac, 'dev': self.dev}
+        due = {name: time.monotonic() for name in self.rates}
+        while not self.stopped.is_set():
+            name = min(due, key=due.get)
+            wait = due[name] - time.monotonic()
+            if wait > 0 and self.stopped.wait(wait):
+                return
+            handlers[name](time.time())
+            due[name] += 1 / self.rates[name]
+
+
+    def com(self, now):
+        # slow drift between left and right with noise (the patient thinking of one answer)
+        target = math.sin(now / 5)
+        value = max(-1.0, min(1.0, target + self.random.gauss(0, 0.3)))
+        action = 'neutral' if abs(value) < 0.1 else 'right' if value > 0 else 'left'
+        self.stream.on_new_com_data(data={'action': action, 'power': abs(value), 'time': now})
+
+
+    def fac(self, now):
+        r = self.random
+        self.stream.on_new_fe_data(data={'eyeAct': r.choice(FAC_EYE), 'uAct': r.choice(FAC_UPPER), 'uPow': r.random(),
+                                         'lAct': r.choice(FAC_LOWER), 'lPow': r.random(), 'time': now})
+
+
+    def dev(self, now):
+        self.stream.on_new_dev_data(data={'signal': 1.0, 'dev': [4] * 14, 'batteryPercent': 80, 'time': now})
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class LatencyHistogram():
+    # Latencies in log spaced buckets (50 us to about 100 s, 10 % wide) - constant memory whatever the duration
+    def __init__(self, low=5e-5, ratio=1.1, buckets=150):
+        self.low = low
+        self.ratio = ratio
+        self.counts = [0] * buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def add(self, value):
+        index = 0 if value <= self.low else int(math.log(value / self.low, self.ratio)) + 1
+        self.counts[min(index, len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+
+    # Upper edge of the bucket that holds the q quantile (at most 10 % above the real value)
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        target = q * self.count
+        total = 0
+        for i, count in enumerate(self.counts):
+            total += count
+            if total >= target:
+                return min(self.low * self.ratio ** i, self.max)
+        return self.max
+
+
+    def summary(self):
+        if self.count == 0:
+            return {'count': 0}
+        ms = lambda value: round(value * 1000, 3)
+        return {'count': self.count, 'mean_ms': ms(self.total / self.count), 'p50_ms': ms(self.quantile(0.5)),
+                'p95_ms': ms(self.quantile(0.95)), 'p99_ms': ms(self.quantile(0.99)), 'max_ms': ms(self.max)}
+
+
+
+class Stats():
+    # Latencies and errors per endpoint - totals and the current report interval
+    def __init__(self):
+        self.lock = Semaphore(1)
+        self.total = {endpoint: LatencyHistogram() for endpoint in ENDPOINTS}
+        self.errors = dict.fromkeys(ENDPOINTS, 0)
+        self.error_messages = {}
+        self.new_interval()
+
+
+    def new_interval(self):
+        self.interval = {endpoint: LatencyHistogram() for endpoint in ENDPOINTS}
+        self.interval_errors = dict.fromkeys(ENDPOINTS, 0)
+
+
+    def add(self, endpoint, latency, error=None):
+        self.lock.acquire()
+        self.interval[endpoint].add(latency)
+        if error is not None:
+            self.interval_errors[endpoint] += 1
+            self.error_messages[error] = self.error_messages.get(error, 0) + 1
+        self.lock.release()
+
+
+    # Close the report interval - its histograms are merged into the totals
+    def close_interval(self):
+        self.lock.acquire()
+        interval, errors = self.interval, self.interval_errors
+        self.new_interval()
+        self.lock.release()
+        for endpoint in ENDPOINTS:
+            self.total[endpoint].merge(interval[endpoint])
+            self.errors[endpoint] += errors[endpoint]
+        return interval, errors
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class PageClient():
+    # One open question page - questions answered after an exponential time or timed out
+    def __init__(self, url, stats, stopped, req_interval=0.5, answer_time=4.0, timeout=10.0, questions=10, seed=0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.stats = stats
+        self.stopped = stopped
+        self.req_interval = req_interval
+        self.answer_time = answer_time
+        self.timeout = timeout
+        self.questions = questions
+        self.random = random.Random(seed)
+        self.connection = None
+
+
+    def request(self, method, endpoint, query='', body=None):
+        headers = {} if body is None else {'Content-Type': 'application/json'}
+        payload = None if body is None else json.dumps(body)
+        start = time.perf_counter()
+        error = None
+        data = None
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self.connection.request(method, endpoint + query, payload, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+            if response.status >= 400:
+                error = 'HTTP {0} {1}'.format(response.status, endpoint)
+        except (OSError, http.client.HTTPException) as e:
+            error = '{0} {1}'.format(type(e).__name__, endpoint)
+            self.connection.close()
+            self.connection = None
+        self.stats.add(endpoint, time.perf_counter() - start, error)
+        return data
+
+
+    def run(self):
+        cursor = -1
+        while not self.stopped.is_set():
+            answers = {}
+            for question in range(self.questions):
+                self.request('POST', '/next_question', body=question)
+                answer_time = self.random.expovariate(1 / self.answer_time)
+                end = time.monotonic() + min(answer_time, self.timeout)
+                while time.monotonic() < end:
+                    data = self.request('GET', '/BCI_data', '?cursor={0}'.format(cursor))
+                    try:
+                        cursor = json.loads(data)['cursor']
+                    except (TypeError, ValueError, KeyError):
+                        pass
+                    if self.stopped.wait(self.req_interval):
+                        return
+                if answer_time >= self.timeout:
+                    answers[str(question)] = self.request('GET', '/timeout_data') is not None
+                else:
+                    answers[str(question)] = self.random.random() < 0.5
+            self.request('POST', '/save_data', body={'score': sum(answers.values())})
+            self.request('POST', '/save_data', body={q: 'yes' if a else 'no' for q, a in answers.items()})
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# RSS of a process in MB (None where /proc is not available)
+def rss_mb(pid):
+    try:
+        with open('/proc/{0}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+# Least squares slope of (hours, MB) points
+def growth_per_hour(points):
+    points = [(t, m) for t, m in points if m is not None]
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_m = sum(m for _, m in points) / n
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    return None if var == 0 else sum((t - mean_t) * (m - mean_m) for t, m in points) / var
+
+
+def wait_ready(url, deadline=30.0):
+    parsed = urlparse(url)
+    end = time.monotonic() + deadline
+    while time.monotonic() < end:
+        try:
+            connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=2)
+            connection.request('GET', '/stream_health')
+            if connection.getresponse().status == 200:
+                return True
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def run(args):
+    server = None
+    url, pid = args.url, args.pid
+    if url is None:
+        # own server process - the load is measured against it, not against this process
+        url = 'http://127.0.0.1:{0}'.format(args.port)
+        root = tempfile.mkdtemp(prefix='load_test_')  # recordings, answers.db and snapshot of the synthetic session
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve', '--port', str(args.port),
+                                   '--patient', args.patient, '--root', root],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        pid = server.pid
+    try:
+        if not wait_ready(url):
+            print('server at {0} not ready'.format(url))
+            return None
+
+        stats = Stats()
+        stopped = Event()
+        clients = [PageClient(url, stats, stopped, args.interval, args.answer_time, args.timeout, args.questions, seed=i)
+                   for i in range(args.clients)]
+        threads = [Thread(target=client.run, name='PageClient-{0}'.format(i), daemon=True)
+                   for i, client in enumerate(clients)]
+
+        start = time.monotonic()
+        rss_points = [(0.0, rss_mb(pid) if pid else None)]
+        intervals = []
+        for thread in threads:
+            thread.start()
+        while time.monotonic() - start < args.duration:
+            time.sleep(min(args.report_interval, max(args.duration - (time.monotonic() - start), 0)))
+            elapsed = time.monotonic() - start
+            interval, errors = stats.close_interval()
+            rss = rss_mb(pid) if pid else None
+            rss_points.append((elapsed / 3600, rss))
+            poll = interval['/BCI_data'].summary()
+            row = {'elapsed_s': round(elapsed, 1), 'requests': sum(h.count for h in interval.values()),
+                   'errors': sum(errors.values()), 'BCI_data_p50_ms': poll.get('p50_ms'),
+                   'BCI_data_p99_ms': poll.get('p99_ms'), 'rss_mb': None if rss is None else round(rss, 1)}
+            intervals.append(row)
+            print(json.dumps(row))
+        stopped.set()
+        for thread in threads:
+            thread.join(timeout=35)
+        stats.close_interval()
+
+        requests = sum(h.count for h in stats.total.values())
+        errors = sum(stats.errors.values())
+        growth = growth_per_hour(rss_points)
+        report = {'url': url, 'clients': args.clients, 'duration_s': args.duration, 'requests': requests,
+                  'requests_per_s': round(requests / max(args.duration, 1e-9), 2),
+                  'error_rate': errors / requests if requests else None,
+                  'endpoints': {endpoint: dict(stats.total[endpoint].summary(), errors=stats.errors[endpoint])
+                                for endpoint in ENDPOINTS},
+                  'error_messages': stats.error_messages,
+                  'rss_start_mb': rss_points[0][1], 'rss_end_mb': rss_points[-1][1],
+                  'rss_growth_mb_per_hour': None if growth is None else round(growth, 3),
+                  'intervals': intervals}
+        if args.report is not None:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=4)
+        return report
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def serve(args):
+    # Run in a folder of its own - user_answers (recordings, answers.db, snapshot.bin) is relative to the working
+    # directory, so the synthetic session never mixes with real sessions and main.py does not resume a real one
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    root = args.root or tempfile.mkdtemp(prefix='load_test_')
+    os.makedirs(root, exist_ok=True)
+    os.chdir(root)
+    print('Recording to {0}'.format(os.path.abspath('user_answers')))
+    from rosbridge_standin import RosbridgeStandIn
+    os.environ['ARI_ROSBRIDGE_URL'] = RosbridgeStandIn(port=0, synth_delay=0.05, speak_rate=1000).start()
+    import main
+
+    # terminate() of run - close the session like /exit does, so no snapshot of it is left to resume
+    def on_terminate(signum, frame):
+        main.stream.stop_session()
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, on_terminate)
+
+    main.stream.start_session(args.patient)  # what /intro does - answers of the load test go to their own session
+    main.stream.start_windows()
+    SyntheticSource(main.stream).start()
+    main.app.run(host='127.0.0.1', port=args.port, threaded=True)
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP load and soak test of the Flask endpoints.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='main.py with a synthetic stream source')
+    serve_parser.add_argument('--port', type=int, default=5001)
+    serve_parser.add_argument('--patient', default='LOADTEST')
+    serve_parser.add_argument('--root', help='working folder of the server (default: a new temporary folder)')
+
+    run_parser = commands.add_parser('run', help='page clients against a server (started if no --url)')
+    run_parser.add_argument('--url', help='running server, i.e. http://localhost:5000')
+    run_parser.add_argument('--pid', type=int, help='process id of the running server (for the RSS)')
+    run_parser.add_argument('--port', type=int, default=5001, help='port of the started server')
+    run_parser.add_argument('--patient', default='LOADTEST')
+    run_parser.add_argument('--clients', type=int, default=1, help='open question pages')
+    run_parser.add_argument('--duration', type=float, default=60, help='seconds')
+    run_parser.add_argument('--interval', type=float, default=0.5, help='req_interval of the pages (s)')
+    run_parser.add_argument('--answer-time', type=float, default=4.0, help='mean time to an answer (s)')
+    run_parser.add_argument('--timeout', type=float, default=10.0, help='question timeout (s)')
+    run_parser.add_argument('--questions', type=int, default=10, help='questions per test')
+    run_parser.add_argument('--report-interval', type=float, default=10, help='seconds between report lines')
+    run_parser.add_argument('--report', help='JSON file for the full report')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args)
+    else:
+        report = run(args)
+        if report is not None:
+            print(json.dumps({key: value for key, value in report.items() if key != 'intervals'}, indent=4))
@@ -0,0 +1,163 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Opt in profiling of a running station (switched on and off at runtime through /admin/profiling in main.py)
+#   1. A sampling profiler reads the stack of the selected threads (websocket thread, Flask request threads, ...)
+#      every few milliseconds and counts identical stacks - the stack is not touched between samples
+#   2. tracemalloc snapshots are taken at a fixed interval for long sessions
+# Results are written per session to profiles/<session>/:
+#   stacks.folded - collapsed stacks ('thread;file:function;... count'), loads into flamegraph.pl, speedscope, inferno
+#   memory_<n>.tracemalloc - snapshots, load with tracemalloc.Snapshot.load()
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore, Thread
+from collections import Counter
+from datetime import datetime
+import threading
+import tracemalloc
+import time
+import sys
+import os
+
+
+# Threads that are profiled - name prefix (or part of the name) -> name used in the output
+DEFAULT_THREADS = {'WebsockThread': 'WebsockThread',  # Cortex.open - only hands the frames over
+                   'CortexProcessThread': 'CortexProcessThread',  # parsing, events and the LiveAdvance callbacks
+                   'process_request_thread': 'FlaskRequestThread',  # werkzeug threaded server
+                   'WindowThread': 'WindowThread'}  # LiveAdvance.start_windows
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class SamplingProfiler():
+    """
+    Low overhead sampling profiler per named thread with optional tracemalloc snapshots.
+
+    Attributes
+    ----------
+    output_dir : str
+        folder that receives one sub folder per profiling session
+    threads : dict
+        part of a thread name -> name in the output (threads that match nothing are not sampled)
+
+    Methods
+    -------
+    start(interval, memory_interval):
+        Start sampling every interval seconds (and a tracemalloc snapshot every memory_interval seconds, 0 = off)
+    stop():
+        Stop sampling and write the results. Returns the session folder
+    status():
+        Current state and number of samples
+    """
+    def __init__(self, output_dir='profiles', threads=DEFAULT_THREADS):
+        self.output_dir = output_dir
+        self.threads = threads
+        self.lock = Semaphore(1)
+        self.running = False
+        self.thread = None
+        self.session_dir = None
+        self.stacks = Counter()
+        self.samples = 0
+        self.snapshots = 0
+
+
+    def start(self, interval=0.005, memory_interval=0):
+        self.lock.acquire()
+        if self.running:
+            self.lock.release()
+            return self.session_dir
+
+        self.session_dir = os.path.join(self.output_dir, '{:%Y%m%d%H%M%S}'.format(datetime.now()))
+        os.makedirs(self.session_dir, exist_ok=True)
+        self.interval = interval
+        self.memory_interval = memory_interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.snapshots = 0
+        self.running = True
+        if memory_interval > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+
+        self.thread = Thread(target=self.run, name='ProfilerThread', daemon=True)
+        self.thread.start()
+        self.lock.release()
+        return self.session_dir
+
+
+    def stop(self):
+        self.lock.acquire()
+        if not self.running:
+            self.lock.release()
+            return self.session_dir
+        self.running = False
+        thread = self.thread
+        self.lock.release()
+
+        thread.join()
+        self.write_stacks()
+        if self.memory_interval > 0:
+            self.take_snapshot()
+            tracemalloc.stop()
+        return self.session_dir
+
+
+    def status(self):
+        return {'running': self.running, 'session': self.session_dir, 'samples': self.samples,
+                'stacks': len(self.stacks), 'snapshots': self.snapshots}
+
+
+    def run(self):
+        own_id = threading.get_ident()
+        next_snapshot = time.monotonic() + self.memory_interval
+        while self.running:
+            # Names of the threads to sample - looked up every round as request threads come and go
+            names = {}
+            for thread in threading.enumerate():
+                name = self.output_name(thread.name)
+                if name is not None and thread.ident != own_id:
+                    names[thread.ident] = name
+
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id)
+                if name is not None:
+                    self.stacks[fold_stack(name, frame)] += 1
+            self.samples += 1
+
+            if self.memory_interval > 0 and time.monotonic() >= next_snapshot:
+                self.take_snapshot()
+                next_snapshot += self.memory_interval
+            time.sleep(self.interval)
+
+
+    def output_name(self, thread_name):
+        for part, name in self.threads.items():
+            if part in thread_name:
+                return name
+        return None
+
+
+    def write_stacks(self):
+        with open(os.path.join(self.session_dir, 'stacks.folded'), 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{0} {1}\n'.format(stack, count))
+
+
+    def take_snapshot(self):
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot()
+        snapshot.dump(os.path.join(self.session_dir, 'memory_{0}.tracemalloc'.format(self.snapshots)))
+        self.snapshots += 1
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Collapsed stack of a frame, root first: 'thread;file:function;file:function'
+def fold_stack(thread_name, frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    stack.append(thread_name)
+    return ';'.join(reversed(stack))
@@ -0,0 +1,197 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Local stand-in of the rosbridge server of ARI (for testing ari_speech.py and the pages without the robot)
+#   1. Minimal websocket server (standard library only - text frames, ping, close)
+#   2. Understands the rosbridge operations of the TTS action client: advertise, subscribe, publish on /tts/goal
+#   3. Every goal gets a feedback after synth_delay (speech starts) and a result once the text is "spoken"
+#
+# Usage: python backend/rosbridge_standin.py --port 9090 --synth-delay 0.3
+#        ARI_ROSBRIDGE_URL=ws://localhost:9090 python main.py
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore, Thread, Timer
+import socketserver
+import argparse
+import hashlib
+import base64
+import struct
+import json
+import time
+
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class RosbridgeStandIn():
+    """
+    Fake rosbridge server with a /tts action server.
+
+    Attributes
+    ----------
+    port : int
+        port to listen on (0 = any free port, see self.port after start)
+    synth_delay : float
+        time (s) from a goal to its first feedback
+    speak_rate : float
+        characters per second of the fake speech (time to the result)
+
+    Methods
+    -------
+    start():
+        Listen on its own thread. Returns the url
+    stop():
+        Stop listening
+    """
+    def __init__(self, host='localhost', port=9090, synth_delay=0.2, speak_rate=15.0):
+        self.host = host
+        self.port = port
+        self.synth_delay = synth_delay
+        self.speak_rate = speak_rate
+        self.goals = []  # (receive time, goal id, text) of every goal
+        self.server = None
+
+
+    def start(self):
+        standin = self
+
+        class Handler(WebsocketHandler):
+            def on_text(self, text):
+                standin.on_text(self, text)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        Thread(target=self.server.serve_forever, name='RosbridgeStandInThread', daemon=True).start()
+        return 'ws://{0}:{1}'.format(self.host, self.port)
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+    def on_text(self, client, text):
+        message = json.loads(text)
+        if message.get('op') == 'subscribe':
+            client.topics.add(message['topic'])
+        elif message.get('op') == 'publish' and message['topic'] == '/tts/goal':
+            goal_id = message['msg']['goal_id']['id']
+            text = message['msg']['goal']['rawtext']['text']
+            self.goals.append((time.time(), goal_id, text))
+            speak_time = len(text) / self.speak_rate
+            Timer(self.synth_delay, self.publish, (client, '/tts/feedback', goal_id, 1,
+                                                   {'event_type': 1, 'text_said': text})).start()
+            Timer(self.synth_delay + speak_time, self.publish, (client, '/tts/result', goal_id, 3, {})).start()
+
+
+    # Action feedback / result - status 1 is ACTIVE, 3 is SUCCEEDED (actionlib_msgs/GoalStatus)
+    def publish(self, client, topic, goal_id, status, body):
+        if topic not in client.topics:
+            return
+        msg = {'status': {'goal_id': {'id': goal_id}, 'status': status}}
+        msg['feedback' if topic.endswith('feedback') else 'result'] = body
+        client.send_text(json.dumps({'op': 'publish', 'topic': topic, 'msg': msg}))
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class WebsocketHandler(socketserver.StreamRequestHandler):
+    # One websocket connection (RFC 6455) - only what rosbridge clients use
+    def handle(self):
+        self.topics = set()
+        self.send_lock = Semaphore(1)
+        if not self.handshake():
+            return
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                return
+            opcode, payload = frame
+            if opcode == 0x8:  # close
+                self.send_frame(0x8, b'')
+                return
+            if opcode == 0x9:  # ping
+                self.send_frame(0xA, payload)
+            elif opcode == 0x1:
+                self.on_text(payload.decode('utf-8'))
+
+
+    def on_text(self, text):
+        pass
+
+
+    def handshake(self):
+        headers = {}
+        self.rfile.readline()  # GET / HTTP/1.1
+        while True:
+            line = self.rfile.readline().decode('latin-1').strip()
+            if line == '':
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if key is None:
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.wfile.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                          'Sec-WebSocket-Accept: {0}\r\n\r\n'.format(accept)).encode())
+        return True
+
+
+    def read_frame(self):
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None
+        opcode = header[0] & 0x0F
+        masked = header[1] & 0x80
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('>H', self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('>Q', self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if masked else b'\0\0\0\0'
+        payload = self.rfile.read(length)
+        return opcode, bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+
+    def send_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        self.send_lock.acquire()
+        try:
+            self.wfile.write(header + payload)
+        except OSError:
+            pass  # client gone
+        self.send_lock.release()
+
+
+    def send_text(self, text):
+        self.send_frame(0x1, text.encode('utf-8'))
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in of the rosbridge server of ARI.')
+    parser.add_argument('--port', type=int, default=9090)
+    parser.add_argument('--synth-delay', type=float, default=0.2, help='seconds from a goal to speech')
+    args = parser.parse_args()
+
+    standin = RosbridgeStandIn(port=args.port, synth_delay=args.synth_delay)
+    print('rosbridge stand-in on {0}'.format(standin.start()))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        standin.stop()
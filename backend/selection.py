@@ -0,0 +1,155 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Server side answer selection - same dot and collision rules as the question pages (move_dot / colision_detection)
+# but fed with every mental command sample as it arrives from the headset instead of once per page poll:
+#   1. The page sends its geometry (dot start position, boxes, strength and poll interval) when it is set up
+#   2. Every com sample moves the dot by power * strength, scaled to the part of a poll interval it covers
+#   3. When the dot touches a box an answer event is stored (sequence numbered) and the dot is reset
+#   4. The page only renders the dot position and reacts to answer events
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore
+from collections import deque
+
+
+# States of the state machine
+INACTIVE = 'inactive'  # no page geometry yet
+MOVING = 'moving'  # dot follows the com stream
+ANSWERED = 'answered'  # a box was hit, waiting for the next question
+
+MAX_DT = 0.5  # largest time step (s) applied for one sample - avoids a jump after a gap in the stream
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class SelectionStateMachine():
+    """
+    Dot position, collision detection and answer events for the current question.
+
+    Attributes
+    ----------
+    on_answer : function
+        called with the answer event when a box is hit (i.e. to record the answer)
+    max_events : int
+        number of answer events kept for the page to collect
+
+    Methods
+    -------
+    configure(x, boxes, strength, interval):
+        Set the page geometry and start moving
+    clear():
+        Remove the page geometry (stop selecting)
+    set_question(question):
+        Reset the dot for a new question
+    on_sample(power, time):
+        Move the dot by one signed com sample (left negative, right positive)
+    state(cursor):
+        Dot position and all answer events after cursor
+    snapshot() / restore(state):
+        Page geometry, status, question and event sequence number (for a hot restart - the open page keeps
+        selecting without a new /selection_setup)
+    """
+    def __init__(self, on_answer=None, max_events=100):
+        self.on_answer = on_answer
+        self.lock = Semaphore(1)
+        self.events = deque(maxlen=max_events)
+        self.seq = 0
+        self.question = -1
+        self.clear()
+
+
+    def configure(self, x, boxes, strength, interval):
+        # x: start position of the dot (px), boxes: {name: [x, w]} (px), interval: page poll interval (s)
+        self.lock.acquire()
+        self.start_x = x
+        self.x = x
+        self.boxes = boxes
+        self.strength = strength
+        self.interval = interval
+        self.last_time = None
+        self.status = MOVING
+        self.lock.release()
+
+
+    def clear(self):
+        self.lock.acquire()
+        self.start_x = 0
+        self.x = 0
+        self.boxes = {}
+        self.strength = 0
+        self.interval = 1
+        self.last_time = None
+        self.status = INACTIVE
+        self.lock.release()
+
+
+    def set_question(self, question):
+        self.lock.acquire()
+        self.question = question
+        self.x = self.start_x
+        self.last_time = None
+        if self.status != INACTIVE:
+            self.status = MOVING
+        self.lock.release()
+
+
+    def on_sample(self, power, time):
+        self.lock.acquire()
+        if self.status != MOVING:
+            self.lock.release()
+            return None
+
+        # The pages move by (average power * strength) once per poll interval, so one sample moves by the
+        # part of the interval it covers. The first sample after a reset has no previous time.
+        dt = 0 if self.last_time is None else min(max(time - self.last_time, 0), MAX_DT)
+        self.last_time = time
+        self.x += power * self.strength * dt / self.interval
+
+        event = None
+        for name, (box_x, box_w) in self.boxes.items():
+            # same rule as colision_detection on the pages
+            if abs(self.x - box_x - box_w / 2) <= box_w / 2:
+                self.seq += 1
+                event = {'seq': self.seq, 'question': self.question, 'answer': name, 'time': time}
+                self.events.append(event)
+                self.status = ANSWERED
+                self.x = self.start_x
+                break
+        self.lock.release()
+
+        if event is not None and self.on_answer is not None:
+            self.on_answer(event)
+        return event
+
+
+    def state(self, cursor=0):
+        self.lock.acquire()
+        state = {'x': self.x, 'question': self.question, 'status': self.status,
+                 'events': [event for event in self.events if event['seq'] > cursor]}
+        self.lock.release()
+        return state
+
+
+    def snapshot(self):
+        self.lock.acquire()
+        state = {'start_x': self.start_x, 'boxes': self.boxes, 'strength': self.strength, 'interval': self.interval,
+                 'status': self.status, 'question': self.question, 'seq': self.seq}
+        self.lock.release()
+        return state
+
+
+    def restore(self, state):
+        self.lock.acquire()
+        self.start_x = state['start_x']
+        self.x = self.start_x
+        self.boxes = state['boxes']
+        self.strength = state['strength']
+        self.interval = state['interval']
+        self.status = state['status']
+        self.question = state['question']
+        # The snapshot can be older than the last answer event the page received - skip a full event log, so new
+        # events always come after the cursor of the page (see StimulusScheduler.restore)
+        self.seq = state['seq'] + self.events.maxlen
+        self.events.clear()
+        self.last_time = None
+        self.lock.release()
@@ -0,0 +1,164 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Per session output files
+# Nothing is created or truncated until a session starts - importing the backend has no disk side effects.
+# Every session gets its own folder:
+#   user_answers/<session_id>/session.json         - session id, patient, start and end time
+#   user_answers/<session_id>/user_recordings.csv  - one row per data window (and marker rows)
+#   user_answers/<session_id>/answers.jsonl        - answers, exported from user_answers/answers.db (see answer_store.py)
+# Older sessions have user_responses.txt (str(dict) per line) instead of answers.jsonl.
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore
+from datetime import datetime
+import json
+import re
+import time
+import csv
+import os
+
+
+# Header of the recording CSV
+# marker is empty for normal rows and describes an event (i.e. a gap in a stream) for marker rows
+RECORDING_HEADER = ['question_number', 'time', 'com_power', 'eyeAct', 'uAct', 'uPow', 'lAct', 'lPow', 'marker']
+
+# Patient ids that can be part of a folder name (letters, digits, _ and -)
+PATIENT_PATTERN = re.compile(r'[A-Za-z0-9_-]{0,64}')
+
+
+# The patient id comes from the intro page URL - it must not reach outside of the session folder. ValueError if not valid
+def check_patient(patient):
+    if not isinstance(patient, str) or PATIENT_PATTERN.fullmatch(patient) is None:
+        raise ValueError('Invalid patient id {0!r} - use up to 64 letters, digits, _ and -'.format(patient))
+    return patient
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class SessionRecorder():
+    """
+    Thread safe writer of the files of one session. The files stay open for the whole session.
+
+    Attributes
+    ----------
+    root : str
+        folder that holds one sub folder per session
+
+    Methods
+    -------
+    open(patient, start_time):
+        Create the session folder and files. Returns the session id (ValueError for an invalid patient id)
+    reopen(state):
+        Open the files of a session again (after a restart) - new rows are appended. Returns the session id
+    close(end_time):
+        Close the files of the session
+    write_row(row):
+        Add a row to the recording CSV (ignored when no session is open)
+    write_json(filename, data):
+        Write data as a JSON file in the session folder (ignored when no session is open)
+    write_csv(filename, header, rows):
+        Write rows as a CSV file in the session folder (ignored when no session is open)
+    """
+    def __init__(self, root='user_answers'):
+        self.root = root
+        self.lock = Semaphore(1)
+        self.session_id = None
+        self.session_dir = None
+        self.info = None
+        self.recording_file = None
+        self.recording_writer = None
+
+
+    def open(self, patient, start_time):
+        check_patient(patient)
+        self.close(start_time)  # only one session at a time
+
+        # session id - start time (and patient if known) i.e. 20230725-141502_P07
+        session_id = '{:%Y%m%d-%H%M%S}'.format(datetime.fromtimestamp(start_time))
+        if patient != '':
+            session_id += '_' + patient
+        session_dir = os.path.join(self.root, session_id)
+        count = 1
+        while os.path.exists(session_dir):  # never overwrite an older session started in the same second
+            count += 1
+            session_dir = os.path.join(self.root, '{0}-{1}'.format(session_id, count))
+        session_id = os.path.basename(session_dir)
+        os.makedirs(session_dir)
+
+        self.lock.acquire()
+        self.session_id = session_id
+        self.session_dir = session_dir
+        self.info = {'session_id': session_id, 'patient': patient, 'start_time': start_time, 'end_time': None}
+        self.write_info()
+
+        self.recording_file = open(os.path.join(session_dir, 'user_recordings.csv'), 'w', newline='')
+        self.recording_writer = csv.writer(self.recording_file)
+        self.recording_writer.writerow(RECORDING_HEADER)
+        self.lock.release()
+        return session_id
+
+
+    # Folder and info of the open session (for a snapshot)
+    def state(self):
+        self.lock.acquire()
+        state = None if self.session_id is None else {'session_dir': self.session_dir, 'info': dict(self.info)}
+        self.lock.release()
+        return state
+
+
+    def reopen(self, state):
+        self.close(time.time())
+        self.lock.acquire()
+        self.session_dir = state['session_dir']
+        self.info = dict(state['info'], end_time=None)
+        self.session_id = self.info['session_id']
+        self.write_info()
+        self.recording_file = open(os.path.join(self.session_dir, 'user_recordings.csv'), 'a', newline='')
+        self.recording_writer = csv.writer(self.recording_file)
+        self.lock.release()
+        return self.session_id
+
+
+    def close(self, end_time):
+        self.lock.acquire()
+        if self.session_id is not None:
+            self.info['end_time'] = end_time
+            self.write_info()
+            self.recording_file.close()
+            self.session_id = None
+            self.recording_file = None
+            self.recording_writer = None
+        self.lock.release()
+
+
+    def write_row(self, row):
+        self.lock.acquire()
+        if self.recording_writer is not None:
+            self.recording_writer.writerow(row)
+            self.recording_file.flush()  # rows must be on disk if the process stops
+        self.lock.release()
+
+
+    # Write data as a JSON file in the session folder (ignored when no session is open)
+    def write_json(self, filename, data):
+        self.lock.acquire()
+        if self.session_id is not None:
+            with open(os.path.join(self.session_dir, filename), 'w') as f:
+                json.dump(data, f)
+        self.lock.release()
+
+
+    # Write rows as a CSV file in the session folder (ignored when no session is open)
+    def write_csv(self, filename, header, rows):
+        self.lock.acquire()
+        if self.session_id is not None:
+            with open(os.path.join(self.session_dir, filename), 'w', newline='') as f:
+                w = csv.writer(f)
+                w.writerow(header)
+                w.writerows(rows)
+        self.lock.release()
+
+
+    def write_info(self):
+        with open(os.path.join(self.session_dir, 'session.json'), 'w') as f:
+            json.dump(self.info, f)
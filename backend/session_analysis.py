@@ -0,0 +1,282 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Post session analysis of a folder of sessions (one sub folder per session, see session.py)
+# For every session and question:
+#   1. Response time (time between the first and last recording row of the question)
+#   2. CAM-ICU feature 2 (A test, questions 0 - 9) and feature 3 (logic questions, 10 - 13) answers and scores
+#   3. Facial expression aggregates (blinks, most common actions, mean powers) and stream gaps
+# Sessions are parsed in a process pool (one process per core) and the parsed sessions are cached, so a rerun
+# only parses new or changed sessions. The output is one table (CSV) with a row per session and question.
+#
+# Usage: python backend/session_analysis.py user_answers -o session_summary.csv
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+import argparse
+import math
+import json
+import ast
+import csv
+import os
+
+
+CACHE_DIR = '.analysis_cache'
+CACHE_VERSION = 2  # bumped when the parsed session changes
+
+A_TEST_QUESTIONS = range(0, 10)  # CAM-ICU feature 2 - inattention
+LOGIC_QUESTIONS = range(10, 14)  # CAM-ICU feature 3 - disorganised thinking
+
+TABLE_HEADER = ['session_id', 'patient', 'question_number', 'start_time', 'response_time', 'answer', 'score',
+                'method', 'com_mean', 'blinks', 'eyeAct', 'uAct', 'uPow_mean', 'lAct', 'lPow_mean', 'gaps',
+                'feature2_errors', 'feature2_missing', 'feature3_errors', 'feature3_missing']
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Finding sessions
+# A session is every folder that holds a user_recordings.csv
+def find_sessions(root):
+    sessions = []
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d != CACHE_DIR]
+        if 'user_recordings.csv' in files:
+            sessions.append(folder)
+    return sorted(sessions)
+
+
+# Files of a session that are read - changes to any of them invalidate the cache
+def session_files(session_dir):
+    names = ['session.json', 'user_recordings.csv', 'answers.jsonl', 'user_responses.txt']
+    return [os.path.join(session_dir, name) for name in names if os.path.exists(os.path.join(session_dir, name))]
+
+
+def cache_key(session_dir):
+    key = [CACHE_VERSION]
+    for path in session_files(session_dir):
+        stat = os.stat(path)
+        key.append([os.path.basename(path), stat.st_mtime, stat.st_size])
+    return key
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Parsing one session (runs in a worker process)
+def parse_session(session_dir):
+    info = {'session_id': os.path.basename(os.path.normpath(session_dir)), 'patient': ''}
+    info_path = os.path.join(session_dir, 'session.json')
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            info.update(json.load(f))
+
+    questions = parse_recordings(os.path.join(session_dir, 'user_recordings.csv'))
+    answers_path = os.path.join(session_dir, 'answers.jsonl')
+    if os.path.exists(answers_path):
+        answers = parse_answers(answers_path)
+    else:  # sessions from before the answer store
+        answers = parse_responses(os.path.join(session_dir, 'user_responses.txt'))
+    for number, answer in answers.items():
+        questions.setdefault(number, empty_question()).update(answer)
+
+    return {'session_id': info['session_id'], 'patient': info.get('patient', ''),
+            'start_time': info.get('start_time'), 'end_time': info.get('end_time'), 'questions': questions}
+
+
+def empty_question():
+    return {'start_time': None, 'response_time': None, 'answer': None, 'score': None, 'method': None,
+            'com_mean': None, 'blinks': 0, 'eyeAct': None, 'uAct': None, 'uPow_mean': None, 'lAct': None,
+            'lPow_mean': None, 'gaps': 0}
+
+
+# Per question aggregates of the recording rows
+def parse_recordings(path):
+    rows = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            number = int(row['question_number'])
+            rows.setdefault(number, []).append(row)
+
+    questions = {}
+    for number, q_rows in rows.items():
+        question = empty_question()
+        data_rows = [row for row in q_rows if row.get('marker', '') == '']
+        question['gaps'] = sum(1 for row in q_rows if row.get('marker', '').startswith('gap:'))
+        times = [float(row['time']) for row in data_rows]
+        if len(times) > 0:
+            question['start_time'] = min(times)
+            question['response_time'] = max(times) - min(times)
+        question['com_mean'] = mean(to_float(row['com_power']) for row in data_rows)
+        question['uPow_mean'] = mean(to_float(row['uPow']) for row in data_rows)
+        question['lPow_mean'] = mean(to_float(row['lPow']) for row in data_rows)
+        question['blinks'] = sum(1 for row in data_rows if row['eyeAct'] == 'blink')
+        question['eyeAct'] = most_common(row['eyeAct'] for row in data_rows)
+        question['uAct'] = most_common(row['uAct'] for row in data_rows)
+        question['lAct'] = most_common(row['lAct'] for row in data_rows)
+        questions[number] = question
+    return questions
+
+
+# Answers and scores per question from the export of the answer store (see answer_store.py)
+def parse_answers(path):
+    answers = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            row = json.loads(line)
+            if row['question'] is None or row['kind'] not in ('answer', 'score'):
+                continue
+            entry = answers.setdefault(int(row['question']), {})
+            if row['kind'] == 'score':
+                entry['score'] = row['answer']
+            else:
+                entry['answer'] = row['answer']
+                if entry.get('method') != 'dot':  # an answer selected on the server stays a dot answer
+                    entry['method'] = row['selection_method']
+    return answers
+
+
+# Answers and scores per question from the lines of user_responses.txt (str(dict) per line)
+#   scores sent by the pages:   {'word': 'SAVEAHAART', 'Q0': 1, 'Q1': 0, ...} / {'Q10': 1, ...}
+#   answers sent by the pages:  {'word': 'SAVEAHAART', '0': 'yes', ...} / {'10': 'no', ...}
+#   answers of the server:      {'question': 3, 'answer': 'yes', 'method': 'dot', 'time': ...}
+def parse_responses(path):
+    answers = {}
+    if not os.path.exists(path):
+        return answers
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line == '':
+                continue
+            try:
+                output = ast.literal_eval(line)
+            except (ValueError, SyntaxError):
+                continue
+            if not isinstance(output, dict):
+                continue
+
+            if 'question' in output and 'answer' in output:
+                entry = answers.setdefault(int(output['question']), {})
+                entry['answer'] = output['answer']
+                entry['method'] = output.get('method')
+                continue
+            for key, value in output.items():
+                if key == 'word':
+                    continue
+                if key.startswith('Q') and key[1:].isdigit():
+                    answers.setdefault(int(key[1:]), {})['score'] = value
+                elif key.isdigit():
+                    entry = answers.setdefault(int(key), {})
+                    entry['answer'] = value
+                    entry['method'] = entry.get('method') or 'page'
+    return answers
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Helpers
+def to_float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def mean(values):
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if len(values) > 0 else None
+
+
+def most_common(values):
+    counts = Counter(value for value in values if value not in ('', 'NaN'))
+    return counts.most_common()[0][0] if len(counts) > 0 else None
+
+
+# Number of wrong and missing (timed out without selection) answers of a CAM-ICU feature
+def feature_summary(questions, numbers):
+    errors = sum(1 for n in numbers if n in questions and questions[n]['score'] in (0, '0'))
+    missing = sum(1 for n in numbers if n not in questions or questions[n]['score'] in (None, 'NaN'))
+    return errors, missing
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Analysis of all sessions - parse what is not cached, then build the table
+def analyse(root, workers=None):
+    cache_dir = os.path.join(root, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    sessions = find_sessions(root)
+    parsed = {}
+    to_parse = []
+    for session_dir in sessions:
+        cache_path = os.path.join(cache_dir, cache_name(root, session_dir))
+        key = cache_key(session_dir)
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached['key'] == key:
+                parsed[session_dir] = cached['session']
+                continue
+        to_parse.append((session_dir, cache_path, key))
+
+    if len(to_parse) > 0:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            results = pool.map(parse_session, [session_dir for session_dir, _, _ in to_parse])
+            for (session_dir, cache_path, key), session in zip(to_parse, results):
+                parsed[session_dir] = session
+                with open(cache_path, 'w') as f:
+                    json.dump({'key': key, 'session': session}, f)
+
+    table = []
+    for session_dir in sessions:
+        table.extend(session_rows(parsed[session_dir]))
+    return table, len(to_parse), len(sessions)
+
+
+def cache_name(root, session_dir):
+    return os.path.relpath(session_dir, root).replace(os.sep, '__') + '.json'
+
+
+def session_rows(session):
+    # JSON turns the question numbers into strings
+    questions = {int(number): question for number, question in session['questions'].items()}
+    f2_errors, f2_missing = feature_summary(questions, A_TEST_QUESTIONS)
+    f3_errors, f3_missing = feature_summary(questions, LOGIC_QUESTIONS)
+
+    rows = []
+    for number in sorted(questions):
+        row = {'session_id': session['session_id'], 'patient': session['patient'], 'question_number': number,
+               'feature2_errors': f2_errors, 'feature2_missing': f2_missing,
+               'feature3_errors': f3_errors, 'feature3_missing': f3_missing}
+        row.update(questions[number])
+        rows.append(row)
+    return rows
+
+
+def write_table(table, path):
+    with open(path, 'w', newline='') as f:
+        w = csv.DictWriter(f, fieldnames=TABLE_HEADER, extrasaction='ignore')
+        w.writeheader()
+        w.writerows(table)
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarise a folder of CAM-ICU sessions into one table.')
+    parser.add_argument('root', help='folder with one sub folder per session (i.e. user_answers)')
+    parser.add_argument('-o', '--output', default='session_summary.csv', help='output CSV file')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: cores)')
+    args = parser.parse_args()
+
+    table, n_parsed, n_sessions = analyse(args.root, args.workers)
+    write_table(table, args.output)
+    print('{0} sessions ({1} parsed, {2} cached), {3} rows written to {4}'.format(
+        n_sessions, n_parsed, n_sessions - n_parsed, len(table), args.output))
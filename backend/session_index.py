@@ -0,0 +1,176 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# SQLite index of a folder of sessions for cross-patient queries
+#   1. Every session folder (see session.py) is parsed once (same parsing as session_analysis.py): one row per session
+#      and one row per question (recording aggregates, answer and score from the /save_data lines)
+#   2. Ingestion is incremental - a session is only parsed again when its files changed (mtime / size)
+#   3. WAL mode and indexes on patient, session, question number and answer keep cohort queries in milliseconds
+#
+# Usage: python backend/session_index.py user_answers --db sessions.db [--timeouts 4]
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from session_analysis import find_sessions, parse_session, cache_key
+import argparse
+import sqlite3
+import json
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    patient TEXT,
+    start_time REAL,
+    end_time REAL,
+    path TEXT,
+    file_key TEXT
+);
+CREATE TABLE IF NOT EXISTS questions (
+    session_id TEXT REFERENCES sessions(session_id) ON DELETE CASCADE,
+    question_number INTEGER,
+    start_time REAL,
+    response_time REAL,
+    answer TEXT,
+    score TEXT,
+    method TEXT,
+    com_mean REAL,
+    blinks INTEGER,
+    eyeAct TEXT,
+    uAct TEXT,
+    uPow_mean REAL,
+    lAct TEXT,
+    lPow_mean REAL,
+    gaps INTEGER,
+    PRIMARY KEY (session_id, question_number)
+);
+CREATE INDEX IF NOT EXISTS sessions_patient ON sessions(patient);
+CREATE INDEX IF NOT EXISTS questions_number_answer ON questions(question_number, answer);
+CREATE INDEX IF NOT EXISTS questions_answer ON questions(answer);
+'''
+
+QUESTION_COLUMNS = ['start_time', 'response_time', 'answer', 'score', 'method', 'com_mean', 'blinks', 'eyeAct', 'uAct',
+                    'uPow_mean', 'lAct', 'lPow_mean', 'gaps']
+
+# No selection before the timeout - the pages save 'NaN' (older sessions may have no answer at all)
+TIMEOUT = "(q.answer IS NULL OR q.answer = 'NaN')"
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class SessionIndex():
+    """
+    SQLite index of sessions and their questions.
+
+    Attributes
+    ----------
+    path : str
+        database file
+
+    Methods
+    -------
+    ingest(root):
+        Add new and changed sessions of a folder. Returns the number of (re)indexed sessions
+    sessions(patient):
+        Sessions (of one patient)
+    timeouts(question_number, patient):
+        Sessions where a question timed out without a selection
+    answers(question_number, answer, patient):
+        Questions (of one number) with a given answer
+    query(sql, params):
+        Any read only query - rows as dictionaries
+    close():
+        Close the database
+    """
+    def __init__(self, path='sessions.db'):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA foreign_keys=ON')
+        self.db.executescript(SCHEMA)
+
+
+    def ingest(self, root):
+        known = {row['path']: row['file_key'] for row in self.db.execute('SELECT path, file_key FROM sessions')}
+        count = 0
+        for session_dir in find_sessions(root):
+            key = json.dumps(cache_key(session_dir))
+            if known.get(session_dir) == key:
+                continue
+            self.add_session(session_dir, key)
+            count += 1
+        return count
+
+
+    def add_session(self, session_dir, key):
+        session = parse_session(session_dir)
+        with self.db:  # one transaction per session
+            self.db.execute('DELETE FROM sessions WHERE session_id = ? OR path = ?', (session['session_id'], session_dir))
+            self.db.execute('INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?)',
+                            (session['session_id'], session['patient'], session.get('start_time'), session.get('end_time'),
+                             session_dir, key))
+            self.db.executemany(
+                'INSERT INTO questions VALUES (?, ?, {0})'.format(', '.join('?' * len(QUESTION_COLUMNS))),
+                [[session['session_id'], number] + [to_sql(question[column]) for column in QUESTION_COLUMNS]
+                 for number, question in session['questions'].items()])
+
+
+    def sessions(self, patient=None):
+        if patient is None:
+            return self.query('SELECT * FROM sessions ORDER BY start_time')
+        return self.query('SELECT * FROM sessions WHERE patient = ? ORDER BY start_time', (patient,))
+
+
+    def timeouts(self, question_number, patient=None):
+        sql = ('SELECT s.session_id, s.patient, q.question_number, q.response_time FROM questions q '
+               'JOIN sessions s ON s.session_id = q.session_id WHERE q.question_number = ? AND ' + TIMEOUT)
+        return self.query_patient(sql, [question_number], patient)
+
+
+    def answers(self, question_number, answer, patient=None):
+        sql = ('SELECT s.session_id, s.patient, q.* FROM questions q '
+               'JOIN sessions s ON s.session_id = q.session_id WHERE q.question_number = ? AND q.answer = ?')
+        return self.query_patient(sql, [question_number, answer], patient)
+
+
+    def query_patient(self, sql, params, patient):
+        if patient is not None:
+            sql += ' AND s.patient = ?'
+            params.append(patient)
+        return self.query(sql + ' ORDER BY s.start_time', params)
+
+
+    def query(self, sql, params=()):
+        return [dict(row) for row in self.db.execute(sql, params)]
+
+
+    def close(self):
+        self.db.close()
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Scores and answers are saved as sent by the pages (numbers or strings) - keep them as text
+def to_sql(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index a folder of CAM-ICU sessions in SQLite.')
+    parser.add_argument('root', help='folder with one sub folder per session (i.e. user_answers)')
+    parser.add_argument('--db', default='sessions.db', help='SQLite database file')
+    parser.add_argument('--timeouts', type=int, default=None, help='list sessions where this question timed out')
+    parser.add_argument('--patient', default=None, help='only sessions of this patient')
+    args = parser.parse_args()
+
+    index = SessionIndex(args.db)
+    print('{0} sessions indexed'.format(index.ingest(args.root)))
+    if args.timeouts is not None:
+        for row in index.timeouts(args.timeouts, args.patient):
+            print(row['session_id'], row['patient'])
+    index.close()
@@ -0,0 +1,233 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Offline simulator of the answer selection (for tuning strength, req_interval and timeout_interval of the pages)
+#   1. Synthetic com streams per simulated patient: intended answer (yes = right, no = left), intent strength,
+#      noise, share of neutral samples and an onset latency (reaction + headset latency) before the intent shows
+#   2. The same rules as the backend and the pages, vectorised with numpy over all patients and questions:
+#      average_com  - mean of the signed (left negative) non neutral powers, 0 without samples
+#      /BCI_data    - sample weighted mean of the windows since the last poll (windows_power)
+#      move_dot     - x += power * strength once per poll (mode 'page'), or per sample like selection.py (mode 'server')
+#      collision    - |x - box.x - box.w / 2| <= box.w / 2
+#      timeout      - sign of average_t (sum of the signed powers of the question) -> yes / no / NaN
+#   3. Distributions of the time to answer, timeout rate and wrong selections
+# validate() runs a few patients through the real LiveAdvance (on_new_com_data, average_com, average_t and the
+# selection state machine) and compares the answers with the vectorised version.
+#
+# Usage: python backend/simulator.py --patients 5000 --strength 100 150 200 --req-interval 250 500
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+import argparse
+import itertools
+import time
+import numpy as np
+
+from selection import MAX_DT
+
+
+# Page geometry (px) - dot starts in the middle of a 1920 px screen, boxes {name: [x, w]}
+DEFAULT_GEOMETRY = {'x': 960, 'boxes': {'no': [200, 200], 'yes': [1520, 200]}}
+
+# Patient model - every simulated patient draws its own intent strength and onset from these
+DEFAULT_MODEL = {'sample_rate': 8.0,  # com samples per second (Cortex)
+                 'intent_mean': 0.35,  # mean signed power towards the intended box
+                 'intent_sd': 0.15,  # spread of the intent strength between patients
+                 'noise_sd': 0.4,  # noise of one sample
+                 'neutral': 0.3,  # share of neutral samples
+                 'onset_mean': 1.0,  # mean onset latency (s) - only noise before the onset
+                 'onset_sd': 0.5}
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Synthetic com streams - signed powers (left negative) and a mask of the non neutral samples, one row per question
+# Returns (truth, signed, active, sample_times): truth is +1 for yes, -1 for no
+def generate(n_patients, n_questions, duration, model=DEFAULT_MODEL, seed=None):
+    rng = np.random.default_rng(seed)
+    rows = n_patients * n_questions
+    n_samples = int(np.ceil(duration * model['sample_rate']))
+    sample_times = (np.arange(n_samples) + 1) / model['sample_rate']
+
+    # per patient, repeated for every question of the patient
+    intent = np.clip(rng.normal(model['intent_mean'], model['intent_sd'], n_patients), 0, 1)
+    intent = np.repeat(intent, n_questions)
+    onset = np.maximum(rng.normal(model['onset_mean'], model['onset_sd'], rows), 0)
+    truth = rng.choice([-1, 1], rows)
+
+    drive = np.where(sample_times[None, :] >= onset[:, None], (truth * intent)[:, None], 0.0)
+    value = drive + rng.normal(0, model['noise_sd'], (rows, n_samples))
+    active = rng.random((rows, n_samples)) >= model['neutral']  # neutral samples do not count
+    signed = np.clip(value, -1, 1) * active  # power is 0 - 1, left negative
+    return truth, signed, active, sample_times
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Selection of every question - returns (answer, answer_time): answer +1 yes, -1 no, 0 NaN (timeout without samples)
+def select(signed, active, sample_times, strength=150, req_interval=500, timeout_interval=10000,
+           geometry=DEFAULT_GEOMETRY, mode='page'):
+    rows = signed.shape[0]
+    interval = req_interval / 1000
+    timeout = timeout_interval / 1000
+    in_time = sample_times < timeout
+
+    if mode == 'page':
+        # polls at interval, 2 * interval, ... before the timeout - samples are summed per poll with a cumulative sum
+        poll_times = np.arange(1, int(np.ceil(timeout / interval))) * interval
+        bounds = np.searchsorted(sample_times, poll_times, side='right')
+        bounds = np.concatenate([[0], bounds])
+        sum_cum = np.concatenate([np.zeros((rows, 1)), np.cumsum(signed, axis=1)], axis=1)
+        count_cum = np.concatenate([np.zeros((rows, 1)), np.cumsum(active, axis=1)], axis=1)
+        poll_sum = sum_cum[:, bounds[1:]] - sum_cum[:, bounds[:-1]]
+        poll_count = count_cum[:, bounds[1:]] - count_cum[:, bounds[:-1]]
+        power = np.divide(poll_sum, poll_count, out=np.zeros_like(poll_sum), where=poll_count > 0)
+        x = geometry['x'] + strength * np.cumsum(power, axis=1)
+        step_times = poll_times
+    else:
+        # server side selection - every non neutral sample moves the dot by the part of a poll interval since the
+        # previous non neutral sample (neutral samples do not reach the state machine, see on_new_com_data)
+        index = np.where(active, np.arange(signed.shape[1])[None, :], -1)
+        last_active = np.maximum.accumulate(index, axis=1)
+        previous = np.concatenate([np.full((rows, 1), -1), last_active[:, :-1]], axis=1)
+        dt = np.where(active & (previous >= 0), sample_times[None, :] - sample_times[np.maximum(previous, 0)], 0.0)
+        dt = np.clip(dt, 0, MAX_DT)  # first sample after a reset has no previous time
+        x = geometry['x'] + np.cumsum(signed * strength * dt / interval, axis=1)
+        x = x[:, in_time]
+        step_times = sample_times[in_time]
+
+    answer = np.zeros(rows)
+    answer_time = np.full(rows, timeout)
+    hit = np.zeros(rows, dtype=bool)
+    first = np.full(rows, x.shape[1])
+    for name, (box_x, box_w) in geometry['boxes'].items():
+        touching = np.abs(x - box_x - box_w / 2) <= box_w / 2
+        box_first = np.where(touching.any(axis=1), touching.argmax(axis=1), x.shape[1])
+        earlier = box_first < first
+        first = np.where(earlier, box_first, first)
+        answer = np.where(earlier, 1 if name == 'yes' else -1, answer)
+        hit |= earlier
+    answer_time[hit] = step_times[first[hit]]
+
+    # timeout - sign of the sum of all signed powers before the timeout (average_t)
+    total = (signed * in_time).sum(axis=1)
+    answer = np.where(hit, answer, np.sign(total))
+    return answer, answer_time, hit
+
+
+def summary(truth, answer, answer_time, hit):
+    times = answer_time[hit]
+    percentiles = np.percentile(times, [10, 50, 90]) if len(times) > 0 else [np.nan] * 3
+    return {'questions': len(truth),
+            'time_p10': percentiles[0], 'time_p50': percentiles[1], 'time_p90': percentiles[2],
+            'timeout_rate': 1 - hit.mean(),
+            'nan_rate': (answer == 0).mean(),
+            'wrong_selection_rate': ((answer != truth) & hit).mean(),
+            'wrong_rate': ((answer != truth) & (answer != 0)).mean()}
+
+
+# Simulate every combination of the settings on the same patients
+def sweep(n_patients=1000, n_questions=10, strengths=(150,), req_intervals=(500,), timeout_intervals=(10000,),
+          model=DEFAULT_MODEL, geometry=DEFAULT_GEOMETRY, mode='page', seed=0):
+    truth, signed, active, sample_times = generate(n_patients, n_questions, max(timeout_intervals) / 1000, model, seed)
+    results = []
+    for strength, req_interval, timeout_interval in itertools.product(strengths, req_intervals, timeout_intervals):
+        answer, answer_time, hit = select(signed, active, sample_times, strength, req_interval, timeout_interval,
+                                          geometry, mode)
+        result = {'strength': strength, 'req_interval': req_interval, 'timeout_interval': timeout_interval}
+        result.update(summary(truth, answer, answer_time, hit))
+        results.append(result)
+    return results
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Run a few questions through the real backend and compare with select()
+# Returns the number of questions where the answer (or, in server mode, the answer time) differs
+def validate(n_questions=20, strength=150, req_interval=500, timeout_interval=10000, geometry=DEFAULT_GEOMETRY,
+             model=DEFAULT_MODEL, seed=1, mode='page'):
+    from live_advance import LiveAdvance  # only needed here (creates a Cortex client, no connection)
+    from window_log import windows_power
+
+    truth, signed, active, sample_times = generate(1, n_questions, timeout_interval / 1000, model, seed)
+    answer, answer_time, hit = select(signed, active, sample_times, strength, req_interval, timeout_interval,
+                                      geometry, mode)
+    live = LiveAdvance('simulator', 'simulator')
+    interval = req_interval / 1000
+    differences = 0
+    if mode == 'server':
+        live.selection.configure(geometry['x'], geometry['boxes'], strength, interval)
+        for row in range(n_questions):
+            live.clear_timeout()
+            live.set_question_number(row)  # resets the dot - average_t only sums while a question is active
+            real, real_time = 0, timeout_interval / 1000
+            for sample, value in enumerate(signed[row]):
+                t = sample_times[sample]
+                if t >= timeout_interval / 1000:
+                    break
+                action = 'neutral' if not active[row, sample] else ('right' if value > 0 else 'left')
+                live.on_new_com_data(data={'action': action, 'power': abs(value), 'time': t})
+                live.average_com()  # one window per sample - average_t decides a timeout
+                events = [event for event in live.selection.state()['events'] if event['question'] == row]
+                if events:
+                    real, real_time = (1 if events[0]['answer'] == 'yes' else -1), events[0]['time']
+                    break
+            if real == 0:
+                real = np.sign(live.average_t())
+            differences += int(real != answer[row] or abs(real_time - answer_time[row]) > 1e-9)
+        return differences
+
+    for row in range(n_questions):
+        live.clear_timeout()
+        live.set_question_number(row)  # average_t only sums while a question is active
+        x = geometry['x']
+        real = 0
+        next_poll = interval
+        windows = []
+        for sample, value in enumerate(signed[row]):
+            t = sample_times[sample]
+            while next_poll < t and next_poll < timeout_interval / 1000 and real == 0:
+                x += windows_power(windows) * strength  # poll - move the dot by the windows since the last poll
+                windows = []
+                for name, (box_x, box_w) in geometry['boxes'].items():
+                    if abs(x - box_x - box_w / 2) <= box_w / 2:
+                        real = 1 if name == 'yes' else -1
+                next_poll += interval
+            if real != 0 or t >= timeout_interval / 1000:
+                break
+            action = 'neutral' if not active[row, sample] else ('right' if value > 0 else 'left')
+            live.on_new_com_data(data={'action': action, 'power': abs(value), 'time': t})
+            # one window per sample (the window thread runs faster than the com stream)
+            windows.append({'com': live.average_com(), 'count': live.com_count})
+        if real == 0:
+            real = np.sign(live.average_t())
+        differences += int(real != answer[row])
+    return differences
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate the answer selection of the question pages.')
+    parser.add_argument('--patients', type=int, default=1000)
+    parser.add_argument('--questions', type=int, default=10, help='questions per patient')
+    parser.add_argument('--strength', type=float, nargs='+', default=[150])
+    parser.add_argument('--req-interval', type=float, nargs='+', default=[500], help='poll interval (ms)')
+    parser.add_argument('--timeout-interval', type=float, nargs='+', default=[10000], help='timeout (ms)')
+    parser.add_argument('--mode', choices=['page', 'server'], default='page')
+    parser.add_argument('--validate', action='store_true', help='compare with the real backend first')
+    args = parser.parse_args()
+
+    if args.validate:
+        print('validation: {0} different answers'.format(validate(mode=args.mode)))
+
+    start = time.perf_counter()
+    results = sweep(args.patients, args.questions, args.strength, args.req_interval, args.timeout_interval,
+                    mode=args.mode)
+    elapsed = time.perf_counter() - start
+
+    columns = list(results[0].keys())
+    print(' '.join('{0:>12}'.format(column[:12]) for column in columns))
+    for result in results:
+        print(' '.join('{0:>12.3f}'.format(result[column]) for column in columns))
+    print('{0} simulated questions in {1:.2f} s'.format(args.patients * args.questions * len(results), elapsed))
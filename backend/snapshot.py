@@ -0,0 +1,149 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Snapshots of the session state for a hot restart of the backend
+#   1. Every interval the state of the open session (plain dicts, lists and numbers - see LiveAdvance.snapshot_state)
+#      is written as one binary file: magic, format version, CRC32 of the payload and the payload (pickle)
+#   2. Written atomically (temporary file, fsync, rename) - a crash while writing leaves the previous snapshot
+#   3. On startup a snapshot that is recent enough is restored (see LiveAdvance.restore) - a damaged, old or foreign
+#      file is ignored
+# The snapshot is removed when the session stops, so only an interrupted session is ever restored.
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore, Thread, Event
+import logging
+import pickle
+import struct
+import zlib
+import time
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b'BCIS'
+VERSION = 2  # 2: selection state
+HEADER = struct.Struct('>4sHI')  # magic, version, crc32 of the payload
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Write a state atomically - returns the size in bytes
+def write_snapshot(path, state):
+    payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    folder = os.path.dirname(path)
+    if folder != '':
+        os.makedirs(folder, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, zlib.crc32(payload)))
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)  # never a half written snapshot
+    return HEADER.size + len(payload)
+
+
+# State of a snapshot file (None if there is none or it can not be used)
+def read_snapshot(path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < HEADER.size:
+        logger.warning('Snapshot %s is truncated - ignored', path)
+        return None
+    magic, version, crc = HEADER.unpack_from(data)
+    payload = data[HEADER.size:]
+    if magic != MAGIC or version != VERSION:
+        logger.warning('Snapshot %s has an unknown format (%s, version %s) - ignored', path, magic, version)
+        return None
+    if zlib.crc32(payload) != crc:
+        logger.warning('Snapshot %s is damaged - ignored', path)
+        return None
+    return pickle.loads(payload)
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class SnapshotWriter():
+    """
+    Writes the state returned by collect every interval on an own thread.
+
+    Attributes
+    ----------
+    path : str
+        snapshot file
+    collect : function
+        returns the state to write (None = nothing to write, i.e. no session open)
+    interval : float
+        time (s) between snapshots
+
+    Methods
+    -------
+    start():
+        Start the snapshot thread (once)
+    write():
+        Write a snapshot now
+    remove():
+        Delete the snapshot file (the session ended normally)
+    stats():
+        Number, size and write time of the snapshots
+    """
+    def __init__(self, path, collect, interval=1.0):
+        self.path = path
+        self.collect = collect
+        self.interval = interval
+        self.lock = Semaphore(1)
+        self.stopped = Event()
+        self.thread = None
+        self.count = 0
+        self.last_bytes = 0
+        self.last_ms = 0.0
+        self.last_time = None
+
+
+    def start(self):
+        if self.thread is None:
+            self.thread = Thread(target=self.run, name='SnapshotThread', daemon=True)
+            self.thread.start()
+
+
+    def stop(self):
+        self.stopped.set()
+
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write()
+            except Exception:
+                logger.exception('Snapshot failed')
+
+
+    def write(self):
+        self.lock.acquire()
+        try:
+            start = time.perf_counter()
+            state = self.collect()
+            if state is None:
+                return
+            self.last_bytes = write_snapshot(self.path, state)
+            self.last_ms = (time.perf_counter() - start) * 1000
+            self.last_time = time.time()
+            self.count += 1
+        finally:
+            self.lock.release()
+
+
+    def remove(self):
+        self.lock.acquire()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.lock.release()
+
+
+    def stats(self):
+        return {'path': self.path, 'count': self.count, 'last_bytes': self.last_bytes, 'last_ms': self.last_ms,
+                'last_time': self.last_time}
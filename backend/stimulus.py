@@ -0,0 +1,223 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Server clocked stimulus (question) timeline - replaces setTimeout / /next_question of the pages
+#   1. The page sends the questions of a test once, the scheduler switches the question number at exact monotonic
+#      instants (first question, answer + gap, timeout + gap) on its own thread
+#   2. Every switch and timeout is an event (sequence numbered) that is pushed to the page (server sent events)
+#   3. Jitter of every stimulus is recorded: switch (actual - scheduled instant on the server) and presentation
+#      (page acknowledges the question - time from the switch to the acknowledgement)
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Condition, Thread
+from collections import deque
+import time
+
+
+# States of the scheduler
+IDLE = 'idle'  # no test running
+WAITING = 'waiting'  # before the next question is switched
+ASKED = 'asked'  # question shown, waiting for an answer or the timeout
+DONE = 'done'  # all questions asked
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class StimulusScheduler():
+    """
+    Question timeline of a test with switch and presentation jitter per stimulus.
+
+    Attributes
+    ----------
+    on_switch : function
+        called with (question, scheduled, actual) at the instant a question is switched (monotonic times)
+    on_timeout : function
+        called with the question when it times out, returns the answer (i.e. from average_t)
+    max_events : int
+        number of events kept for the pages to collect
+
+    Methods
+    -------
+    start(questions, timeout, gap, delay):
+        Ask the questions - first one after delay, next one gap seconds after an answer or timeout (s).
+        Returns the cursor of the events of the test
+    answered(question):
+        The current question is answered - the next question is scheduled
+    shown(seq):
+        The page presented the question of event seq
+    stop():
+        Stop the timeline
+    events(cursor) / wait_events(cursor, timeout):
+        Events after cursor (wait_events blocks until there is one)
+    report():
+        Scheduled and actual instants and jitter of every stimulus
+    snapshot() / restore(state, delay):
+        Questions still to ask and the event sequence number (for a hot restart - the current question is
+        asked again, with a new event, so the pages present it again)
+    """
+    def __init__(self, on_switch=None, on_timeout=None, max_events=100):
+        self.on_switch = on_switch
+        self.on_timeout = on_timeout
+        self.condition = Condition()
+        self.event_log = deque(maxlen=max_events)
+        self.seq = 0
+        self.thread = None
+        self.stimuli = []
+        self.reset()
+
+
+    def reset(self):
+        self.status = IDLE
+        self.questions = []
+        self.index = -1
+        self.timeout = 0
+        self.gap = 0
+        self.deadline = None
+        self.current = None  # record of the current stimulus
+
+
+    def start(self, questions, timeout, gap=0.0, delay=0.0):
+        with self.condition:
+            self.reset()
+            self.questions = list(questions)
+            self.timeout = timeout
+            self.gap = gap
+            self.status = WAITING
+            self.deadline = time.monotonic() + delay
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name='StimulusThread', daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+            return self.seq  # cursor - events of this test come after it
+
+
+    def stop(self):
+        with self.condition:
+            self.reset()
+            self.condition.notify_all()
+
+
+    def answered(self, question):
+        with self.condition:
+            if self.status != ASKED or self.current['question'] != question:
+                return  # old question or already answered
+            self.end_stimulus('answer')
+            self.condition.notify_all()
+
+
+    def shown(self, seq):
+        now = time.monotonic()
+        with self.condition:
+            for stimulus in reversed(self.stimuli):
+                if stimulus['seq'] == seq:
+                    if stimulus['shown_latency'] is None:
+                        stimulus['shown_latency'] = now - stimulus['actual']
+                    return stimulus
+        return None
+
+
+    def events(self, cursor=0):
+        with self.condition:
+            return [event for event in self.event_log if event['seq'] > cursor], self.seq
+
+
+    def wait_events(self, cursor=0, timeout=15.0):
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > cursor, timeout)
+            return [event for event in self.event_log if event['seq'] > cursor], self.seq
+
+
+    def report(self):
+        with self.condition:
+            return [dict(stimulus) for stimulus in self.stimuli]
+
+
+    def clear_report(self):
+        with self.condition:
+            self.stimuli = []
+
+
+    def snapshot(self):
+        with self.condition:
+            questions = []
+            if self.status == ASKED:
+                questions = self.questions[self.index:]
+            elif self.status == WAITING:
+                questions = self.questions[self.index + 1:]
+            return {'seq': self.seq, 'questions': questions, 'timeout': self.timeout, 'gap': self.gap,
+                    'stimuli': [dict(stimulus) for stimulus in self.stimuli]}
+
+
+    def restore(self, state, delay=0.0):
+        with self.condition:
+            # The snapshot can be up to one interval older than the last event a page received - skip a full event log,
+            # so new events always come after the cursor of the page (a smaller seq would be filtered as already seen)
+            self.seq = state['seq'] + self.event_log.maxlen
+            self.stimuli = state['stimuli']
+        if len(state['questions']) > 0:
+            self.start(state['questions'], state['timeout'], state['gap'], delay)
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+    # Timeline (own thread) - sleeps until the next deadline, callbacks are called outside of the lock
+    def run(self):
+        while True:
+            with self.condition:
+                while self.deadline is None or time.monotonic() < self.deadline:
+                    wait = None if self.deadline is None else self.deadline - time.monotonic()
+                    self.condition.wait(wait)
+                scheduled = self.deadline
+                status = self.status
+                self.deadline = None
+                if status == WAITING:
+                    question = self.next_question(scheduled)
+                    stimulus = self.current
+                elif status == ASKED:
+                    question = self.current['question']
+
+            if status == WAITING and question is not None and self.on_switch is not None:
+                self.on_switch(question, stimulus['scheduled'], stimulus['actual'])
+            elif status == ASKED:
+                answer = 'NaN' if self.on_timeout is None else self.on_timeout(question)
+                with self.condition:
+                    if self.status == ASKED and self.current['question'] == question:  # not answered meanwhile
+                        self.end_stimulus('timeout')
+                        self.add_event({'type': 'timeout', 'question': question, 'answer': answer})
+                        self.condition.notify_all()
+
+
+    # Switch to the next question (lock held) - returns the question or None when all questions were asked
+    def next_question(self, scheduled):
+        actual = time.monotonic()
+        self.index += 1
+        if self.index >= len(self.questions):
+            self.status = DONE
+            self.add_event({'type': 'done'})
+            return None
+
+        question = self.questions[self.index]
+        self.status = ASKED
+        self.deadline = actual + self.timeout
+        event = self.add_event({'type': 'question', 'question': question, 'jitter': actual - scheduled})
+        self.current = {'seq': event['seq'], 'question': question, 'scheduled': scheduled, 'actual': actual,
+                        'jitter': actual - scheduled, 'shown_latency': None, 'end': None, 'reason': None}
+        self.stimuli.append(self.current)
+        return question
+
+
+    # End the current question (lock held) and schedule the next one
+    def end_stimulus(self, reason):
+        now = time.monotonic()
+        self.current['end'] = now
+        self.current['reason'] = reason
+        self.status = WAITING
+        self.deadline = now + self.gap
+
+
+    def add_event(self, event):
+        self.seq += 1
+        event['seq'] = self.seq
+        event['time'] = time.time()
+        self.event_log.append(event)
+        self.condition.notify_all()
+        return event
@@ -0,0 +1,196 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Rate and gap monitor for the Cortex data streams (com, fac, dev, ...)
+# Uses the Cortex 'time' of every sample, so dropped headset data is noticed before the dot freezes:
+#   1. Counters and the last sample time per stream
+#   2. A histogram of inter-sample gaps - in total and rolling over the last minute (ring of one second slots)
+#   3. A callback for every gap longer than the gap threshold (i.e. to mark it in the recording). A stream that stopped
+#      completely has no next sample to notice its gap - check_overdue(now) is called periodically and reports the start
+#      of the gap once it is gap threshold late, the gap itself (full length) is reported when the stream comes back
+# The cost per sample is constant (fixed number of buckets and slots).
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore
+from bisect import bisect_left
+
+
+# Upper edges (s) of the inter-sample gap histogram buckets - the last bucket holds everything longer
+GAP_BUCKETS = [0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, float('inf')]
+ROLLING_SLOTS = 60  # length of the rolling histogram in one second slots
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class StreamStats():
+    # Counters and histograms of one stream
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.gaps = 0  # gaps longer than the gap threshold
+        self.first_time = None
+        self.last_time = None
+        self.active_since = None  # first sample after the start or a pause (for the rolling rate)
+        self.paused = False  # unsubscribed - the time to the next sample is not a gap
+        self.overdue = False  # the current gap was already reported by check_overdue
+        self.max_gap = 0.0
+        self.histogram = [0] * len(GAP_BUCKETS)
+        # rolling histogram - one histogram per second, slot_seconds holds the second a slot belongs to
+        self.slots = [[0] * len(GAP_BUCKETS) for _ in range(ROLLING_SLOTS)]
+        self.slot_seconds = [-1] * ROLLING_SLOTS
+        self.slot_counts = [0] * ROLLING_SLOTS
+
+
+    def record(self, time):
+        gap = None
+        if self.paused or self.active_since is None:
+            self.paused = False
+            self.active_since = time
+        elif self.last_time is not None:
+            gap = time - self.last_time
+            bucket = bisect_left(GAP_BUCKETS, gap)
+            self.histogram[bucket] += 1
+
+            second = int(time)
+            slot = second % ROLLING_SLOTS
+            if self.slot_seconds[slot] != second:
+                # slot belongs to an old second - reuse it
+                self.slot_seconds[slot] = second
+                self.slots[slot] = [0] * len(GAP_BUCKETS)
+                self.slot_counts[slot] = 0
+            self.slots[slot][bucket] += 1
+            self.slot_counts[slot] += 1
+            self.max_gap = max(self.max_gap, gap)
+        if self.first_time is None:
+            self.first_time = time
+
+        self.count += 1
+        self.last_time = time
+        return gap
+
+
+    def health(self, now):
+        # only slots of the last ROLLING_SLOTS seconds are part of the rolling histogram
+        rolling = [0] * len(GAP_BUCKETS)
+        rolling_count = 0
+        # seconds covered by the rolling histogram - less than ROLLING_SLOTS in the first minute after a start or pause
+        # (slots from before a pause are left out of the rolling histogram)
+        elapsed = 0 if self.active_since is None else min(max(now - self.active_since, 1.0), ROLLING_SLOTS)
+        oldest = now - ROLLING_SLOTS if self.active_since is None else max(now - ROLLING_SLOTS, int(self.active_since) - 1)
+        for slot in range(ROLLING_SLOTS):
+            if oldest < self.slot_seconds[slot] <= now:
+                rolling_count += self.slot_counts[slot]
+                for bucket in range(len(GAP_BUCKETS)):
+                    rolling[bucket] += self.slots[slot][bucket]
+
+        if self.first_time is None or self.last_time == self.first_time:
+            mean_rate = 0.0
+        else:
+            mean_rate = (self.count - 1) / (self.last_time - self.first_time)
+
+        return {'count': self.count,
+                'gaps': self.gaps,
+                'max_gap': self.max_gap,
+                'mean_rate': mean_rate,
+                'rolling_rate': rolling_count / elapsed if elapsed > 0 else 0.0,
+                'since_last': None if self.last_time is None else now - self.last_time,
+                'histogram': self.histogram,
+                'rolling_histogram': rolling}
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class StreamMonitor():
+    """
+    Effective sample rate and inter-sample gaps of every stream.
+
+    Attributes
+    ----------
+    gap_threshold : float
+        a gap longer than this (s) counts as dropped data
+    on_gap : function
+        called with (stream, start time, end time) for every gap longer than gap_threshold
+    on_gap_start : function
+        called with (stream, start time) when a stream is gap_threshold late (the gap is still open)
+
+    Methods
+    -------
+    record(stream, time):
+        Add a sample of a stream
+    check_overdue(now):
+        Report the start of the gap of every stream without a sample for longer than gap_threshold (called
+        periodically)
+    pause(stream):
+        The stream is unsubscribed - no gap is recorded before its next sample
+    set_device(signal, battery):
+        Latest headset signal quality and battery (dev stream)
+    health(now):
+        Counters, rates and histograms of all streams
+    """
+    def __init__(self, gap_threshold=1.0, on_gap=None, on_gap_start=None):
+        self.gap_threshold = gap_threshold
+        self.on_gap = on_gap
+        self.on_gap_start = on_gap_start
+        self.lock = Semaphore(1)
+        self.streams = {}
+        self.device = {'signal': None, 'batteryPercent': None}
+
+
+    def record(self, stream, time):
+        self.lock.acquire()
+        stats = self.streams.get(stream)
+        if stats is None:
+            stats = StreamStats(stream)
+            self.streams[stream] = stats
+        stats.overdue = False  # an open gap ends here - reported below with its full length
+        gap = stats.record(time)
+        is_gap = gap is not None and gap > self.gap_threshold
+        if is_gap:
+            stats.gaps += 1
+        self.lock.release()
+
+        if is_gap and self.on_gap is not None:
+            self.on_gap(stream, time - gap, time)
+
+
+    # A stream that stopped completely has no next sample to notice its gap - the start of the gap (last sample) is
+    # reported once it is gap_threshold late. The gap is provisional: record reports it with its full length (and
+    # counts it) when the stream comes back
+    def check_overdue(self, now):
+        overdue = []
+        self.lock.acquire()
+        for stats in self.streams.values():
+            if stats.paused or stats.overdue or stats.last_time is None:
+                continue
+            if now - stats.last_time > self.gap_threshold:
+                stats.overdue = True
+                overdue.append((stats.name, stats.last_time))
+        self.lock.release()
+
+        if self.on_gap_start is not None:
+            for stream, last_time in overdue:
+                self.on_gap_start(stream, last_time)
+
+
+    def pause(self, stream):
+        self.lock.acquire()
+        stats = self.streams.get(stream)
+        if stats is not None:
+            stats.paused = True
+            stats.overdue = False
+        self.lock.release()
+
+
+    def set_device(self, signal, battery):
+        self.lock.acquire()
+        self.device = {'signal': signal, 'batteryPercent': battery}
+        self.lock.release()
+
+
+    def health(self, now):
+        self.lock.acquire()
+        health = {'gap_buckets': [str(edge) for edge in GAP_BUCKETS],
+                  'device': dict(self.device),
+                  'streams': {name: stats.health(now) for name, stats in self.streams.items()}}
+        self.lock.release()
+        return health
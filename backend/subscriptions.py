@@ -0,0 +1,199 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Phase aware subscription of the Cortex streams (replaces subscribing com, fac, eeg and dev for the process lifetime)
+#   1. The streams needed are the streams of the page phase (idle, intro, test, exit) and of the active consumers
+#      (i.e. the calibration needs com whatever page is open)
+#   2. Without page requests for idle_timeout the phase is idle - only dev is kept (signal / battery for the monitor)
+#   3. Changes are debounced - a new target is applied once it has been stable for subscribe_delay (streams added)
+#      or unsubscribe_delay (streams only removed), so page transitions do not unsubscribe and resubscribe
+#   4. No own thread - check(now) is called by the window thread of LiveAdvance
+#   5. Savings - seconds every stream was not subscribed times its measured cost per subscribed second (messages,
+#      bytes and CPU time of the Cortex processing thread, see Cortex.stream_usage)
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore
+
+
+ALL_STREAMS = ['com', 'fac', 'eeg', 'dev']
+PHASE_STREAMS = {'idle': ['dev'],
+                 'intro': ['com', 'dev'],  # intro selects with the coarse com power only
+                 'test': ['com', 'fac', 'eeg', 'dev'],  # question pages - dot, facial features, band power, monitor
+                 'exit': ['com', 'dev']}
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class SubscriptionManager():
+    """
+    Subscribed streams follow the page phase and the consumers (thread safe).
+
+    Attributes
+    ----------
+    subscribe / unsubscribe : function
+        called with a list of streams to (un)subscribe (i.e. queue a Cortex sub_request / unsub_request)
+    subscribe_delay / unsubscribe_delay : float
+        time (s) a new target must be stable before streams are added / removed
+    idle_timeout : float
+        time (s) without page requests before the phase is idle
+
+    Methods
+    -------
+    enable(now) / disable(now):
+        The Cortex session can (not) subscribe streams - disable forgets the subscribed streams
+    set_phase(phase, now):
+        Page phase (see PHASE_STREAMS)
+    touch(now):
+        A page made a request
+    acquire(consumer, streams, now) / release(consumer, now):
+        Streams needed by a consumer, whatever the phase
+    check(now):
+        Apply the target once it is stable (called periodically)
+    state(now, usage):
+        Phase, target and subscribed streams, changes and the savings estimated from usage
+    """
+    def __init__(self, subscribe, unsubscribe, subscribe_delay=0.2, unsubscribe_delay=5.0, idle_timeout=30.0):
+        self.subscribe = subscribe
+        self.unsubscribe = unsubscribe
+        self.subscribe_delay = subscribe_delay
+        self.unsubscribe_delay = unsubscribe_delay
+        self.idle_timeout = idle_timeout
+        self.lock = Semaphore(1)
+        self.enabled = False
+        self.enabled_time = None
+        self.phase = 'idle'
+        self.last_touch = None
+        self.consumers = {}
+        self.subscribed = set()
+        self.pending = None  # target waiting for its debounce delay
+        self.due = None
+        self.changes = 0  # (un)subscribe requests sent
+        self.subscribed_seconds = dict.fromkeys(ALL_STREAMS, 0.0)
+        self.subscribed_since = {}
+
+
+    def enable(self, now):
+        self.lock.acquire()
+        if not self.enabled:
+            self.enabled = True
+            self.enabled_time = now
+            self.pending = self.target(now)
+            self.due = now  # first subscription without delay
+        self.lock.release()
+        self.check(now)
+
+
+    def disable(self, now):
+        self.lock.acquire()
+        self.enabled = False
+        for stream in self.subscribed:
+            self.close_usage(stream, now)
+        self.subscribed = set()
+        self.pending = None
+        self.lock.release()
+
+
+    def set_phase(self, phase, now):
+        if phase not in PHASE_STREAMS:
+            raise ValueError('Unknown phase {0}. Use one of {1}.'.format(phase, ', '.join(PHASE_STREAMS)))
+        self.lock.acquire()
+        self.phase = phase
+        self.last_touch = now
+        self.lock.release()
+
+
+    def touch(self, now):
+        self.last_touch = now
+
+
+    def acquire(self, consumer, streams, now):
+        self.lock.acquire()
+        self.consumers[consumer] = list(streams)
+        self.lock.release()
+        self.check(now)
+
+
+    def release(self, consumer, now):
+        self.lock.acquire()
+        self.consumers.pop(consumer, None)
+        self.lock.release()
+        self.check(now)
+
+
+    # Streams needed now (lock held)
+    def target(self, now):
+        phase = self.phase
+        if self.last_touch is None or now - self.last_touch > self.idle_timeout:
+            phase = 'idle'
+        streams = set(PHASE_STREAMS[phase])
+        for consumer_streams in self.consumers.values():
+            streams.update(consumer_streams)
+        return streams
+
+
+    def check(self, now):
+        self.lock.acquire()
+        if not self.enabled:
+            self.lock.release()
+            return
+        target = self.target(now)
+        if target == self.subscribed:
+            self.pending = None
+        elif target != self.pending:
+            # new target - (re)start the debounce delay
+            self.pending = target
+            self.due = now + (self.subscribe_delay if target - self.subscribed else self.unsubscribe_delay)
+
+        add, remove = [], []
+        if self.pending is not None and now >= self.due:
+            add = sorted(self.pending - self.subscribed)
+            remove = sorted(self.subscribed - self.pending)
+            for stream in add:
+                self.subscribed_since[stream] = now
+            for stream in remove:
+                self.close_usage(stream, now)
+            self.subscribed = self.pending
+            self.pending = None
+            self.changes += (len(add) > 0) + (len(remove) > 0)
+        self.lock.release()
+
+        # requests outside of the lock (they may take the Cortex request queue lock)
+        if add:
+            self.subscribe(add)
+        if remove:
+            self.unsubscribe(remove)
+
+
+    # Add the subscribed time of a stream that is unsubscribed (lock held)
+    def close_usage(self, stream, now):
+        since = self.subscribed_since.pop(stream, None)
+        if since is not None:
+            self.subscribed_seconds[stream] = self.subscribed_seconds.get(stream, 0.0) + now - since
+
+
+    def state(self, now, usage=None):
+        self.lock.acquire()
+        seconds = dict(self.subscribed_seconds)
+        for stream, since in self.subscribed_since.items():
+            seconds[stream] = seconds.get(stream, 0.0) + now - since
+        enabled_seconds = 0.0 if self.enabled_time is None else now - self.enabled_time
+        state = {'enabled': self.enabled, 'phase': self.phase, 'target': sorted(self.target(now)),
+                 'subscribed': sorted(self.subscribed), 'pending': None if self.pending is None else sorted(self.pending),
+                 'consumers': dict(self.consumers), 'changes': self.changes, 'streams': {}}
+        self.lock.release()
+
+        # savings against subscribing every stream for the whole time
+        usage = usage or {}
+        for stream in ALL_STREAMS:
+            subscribed = seconds.get(stream, 0.0)
+            unsubscribed = max(enabled_seconds - subscribed, 0.0)
+            entry = {'subscribed_s': round(subscribed, 1), 'unsubscribed_s': round(unsubscribed, 1)}
+            cost = usage.get(stream)
+            if cost is not None and subscribed > 0:
+                entry['messages_per_s'] = cost['messages'] / subscribed
+                entry['bytes_per_s'] = cost['bytes'] / subscribed
+                entry['cpu_per_s'] = cost['cpu'] / subscribed
+                entry['saved_messages'] = round(unsubscribed * entry['messages_per_s'])
+                entry['saved_bytes'] = round(unsubscribed * entry['bytes_per_s'])
+                entry['saved_cpu_s'] = unsubscribed * entry['cpu_per_s']
+            state['streams'][stream] = entry
+        return state
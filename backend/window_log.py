@@ -0,0 +1,94 @@
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# In memory log of sequence numbered window aggregates
+# The com/fac buffers are aggregated once per window (not once per HTTP request) and every window is appended here.
+# Readers keep their own cursor (sequence number of the last window they received) and fetch everything since it,
+# so any number of pages can read the stream without taking samples from each other.
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+from threading import Semaphore
+from collections import deque
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+class WindowLog():
+    """
+    Bounded, thread safe log of windows with consecutive sequence numbers (starting at 1).
+
+    Attributes
+    ----------
+    max_windows : int
+        number of windows kept - older windows are dropped
+
+    Methods
+    -------
+    append(window):
+        Add a window (dict), the sequence number is added as 'seq'. Returns the sequence number
+    since(cursor):
+        All windows with a sequence number greater than cursor and the newest sequence number
+    latest():
+        Newest window (None if empty)
+    snapshot() / restore(state):
+        Sequence number and windows (for a hot restart - the cursors of the pages stay valid)
+    """
+    def __init__(self, max_windows=3000):
+        self.lock = Semaphore(1)
+        self.windows = deque(maxlen=max_windows)
+        self.seq = 0
+
+
+    def append(self, window):
+        self.lock.acquire()
+        self.seq += 1
+        window['seq'] = self.seq
+        self.windows.append(window)
+        seq = self.seq
+        self.lock.release()
+        return seq
+
+
+    def since(self, cursor):
+        self.lock.acquire()
+        # Sequence numbers are consecutive - the position of cursor + 1 follows from the oldest window
+        if len(self.windows) == 0 or cursor >= self.seq:
+            windows = []
+        else:
+            start = max(cursor + 1 - self.windows[0]['seq'], 0)
+            windows = [self.windows[i] for i in range(start, len(self.windows))]
+        seq = self.seq
+        self.lock.release()
+        return windows, seq
+
+
+    def latest(self):
+        self.lock.acquire()
+        window = self.windows[-1] if len(self.windows) > 0 else None
+        self.lock.release()
+        return window
+
+
+    def snapshot(self):
+        self.lock.acquire()
+        state = {'seq': self.seq, 'windows': list(self.windows)}
+        self.lock.release()
+        return state
+
+
+    def restore(self, state):
+        self.lock.acquire()
+        self.seq = state['seq']
+        self.windows.clear()
+        self.windows.extend(state['windows'])
+        self.lock.release()
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------------
+# Average com power of several windows - every window is weighted by the number of (non neutral) samples it holds
+def windows_power(windows):
+    count = sum(window['count'] for window in windows)
+    if count == 0:
+        return 0
+    return sum(window['com'] * window['count'] for window in windows) / count
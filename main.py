@@ -7,16 +7,27 @@
 import sys
 sys.path.insert(1, 'backend')
 import json
-from flask import Flask, render_template, request, make_response, jsonify
+from flask import Flask, Response, render_template, request, make_response, jsonify
 from backend.live_advance import LiveAdvance
+from backend.window_log import windows_power
+from backend.profiling import SamplingProfiler
+from backend.ari_speech import AriSpeech, parse_speech_file
+from backend.assets import AssetCache
 import threading
 import time
+import os
+import logging
+from backend.bci_logging import setup_logging, set_levels, get_levels
 
 
 
 
 # ------------------------------------------------------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------------------------------------------------------
+# Logging - queued (non blocking) with a ring of recent events served on /logs
+ring_handler = setup_logging()
+logger = logging.getLogger('main')
+
 # Set up BCI stream
 id = 'XXXX'
 password = 'XXXX'
@@ -26,6 +37,14 @@ stream = LiveAdvance(id, password)
 
 stream.set_start_time(time.time())
 stream.set_question_number(-1)
+stream.restore()  # resume the session of a crashed or upgraded backend (if its snapshot is recent)
+
+# Profiler for the websocket and request threads - off until switched on through /admin/profiling
+profiler = SamplingProfiler()
+
+# Speech of ARI - the utterances of the speech file are loaded when a session starts (see ari_speech.py)
+speech = AriSpeech()
+speech_utterances = parse_speech_file()
 
 # Function to begin streaming BCI data.
 def start_BCI_stream():
@@ -34,35 +53,64 @@ def start_BCI_stream():
 
 # ------------------------------------------------------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------------------------------------------------------
-# Flask App 
-app = Flask(__name__, template_folder='frontend')
+# Flask App - static files are served from memory by the asset cache (see assets.py)
+app = Flask(__name__, template_folder='frontend', static_folder=None)
+assets = AssetCache(os.path.join(app.root_path, 'static'))
+
+
+# url_for('static', filename=...) in the pages gives the content hashed name (cached by the browser for good)
+@app.url_defaults
+def hashed_static_url(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = assets.hashed_name(values['filename'])
+
+
+@app.route('/static/<path:filename>', endpoint='static')
+def static_file(filename):
+    response = assets.response(filename, request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding'))
+    if response is None:
+        return ('', 404)
+    return response
 
 
 
 # ------------------------------------------------------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------------------------------------------------------
 # Application HTML pages (interfaces)
+# The intro page starts a new session (start time, question number, empty buffers and new output files)
+# i.e. /intro?patient=P07 - the patient is part of the session id
 @app.route('/')
 @app.route('/intro')
 def open_intro():
-    stream.set_start_time(time.time())  # record start time
-    stream.set_question_number(-1)  # set question number
+    try:
+        stream.start_session(request.args.get('patient', default=''))
+    except ValueError as e:
+        return make_response(jsonify({'error': str(e)}), 400)
+    stream.set_phase('intro')
+    stream.selection.clear()  # intro page selects in the browser
+    speech.preload(speech_utterances)
     return render_template('intro_exit_pages/intro.html')
 
 @app.route('/exit_intro')
 def exit_intro():
+    stream.stop_session()
+    stream.set_phase('exit')
     return render_template('intro_exit_pages/exit_intro.html')
 
 @app.route('/exit_test')
 def exit_test():
+    stream.stop_session()
+    stream.set_phase('exit')
     return render_template('intro_exit_pages/exit_test.html')
 
 @app.route('/a_test')
 def a_test():
+    stream.set_phase('test')
     return render_template('question_pages/a_test.html')
 
 @app.route('/logic_questions')
 def logic_questions():
+    stream.set_phase('test')
     return render_template('question_pages/logic_questions.html')
 
 
@@ -70,15 +118,49 @@ def logic_questions():
 # ------------------------------------------------------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------------------------------------------------------
 # Other pages 
-# Send BCI data (accumulated average) to frontend
+# Send BCI data to frontend - reading does not remove data, so several pages can read at the same time
+# /BCI_data?cursor=N sends all windows after window N, their (sample weighted) average power and the new cursor
+# (cursor=-1 only sends the current cursor). Without a cursor the power of the latest window is sent.
 @app.route('/BCI_data', methods=['POST', 'GET'])
 def BCI_data():
-    repsonse = str(stream.average_com())
-    stream.average_fac()
-    current_time = time.time()
-    stream.save_current_avg(current_time)
-    print(repsonse)
-    return str(repsonse)
+    stream.touch()  # a page is open - its streams stay subscribed
+    cursor = request.args.get('cursor', type=int)
+    if cursor is None:
+        window = stream.window_log.latest()
+        repsonse = str(0 if window is None else window['com'])
+        logger.debug('BCI_data: %s', repsonse)
+        return repsonse
+
+    if cursor < 0:
+        windows, cursor = stream.window_log.since(float('inf'))
+    else:
+        windows, cursor = stream.window_log.since(cursor)
+    return jsonify({'cursor': cursor, 'power': windows_power(windows), 'windows': windows})
+
+
+# Send band power (theta/alpha/beta per channel) from the eeg stream - updated at a fixed rate
+@app.route('/band_power', methods=['POST', 'GET'])
+def band_power():
+    return jsonify(stream.average_pow())
+
+
+# Send history of the averaged data for dashboards
+# i.e. /history?stream=fac&start=1690000000&end=1690003600 (epoch seconds, both optional)
+@app.route('/history', methods=['GET'])
+def history():
+    history = stream.avg_fac_buffer if request.args.get('stream') == 'fac' else stream.avg_com_buffer
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    return jsonify(history.query(start, end))
+
+
+# Send health of the data streams (sample rates, gaps, gap histograms, headset signal and battery)
+# and of the handoff queue between the websocket and the processing thread (depth, drops, batch times)
+@app.route('/stream_health', methods=['GET'])
+def stream_health():
+    health = stream.monitor.health(time.time())
+    health['handoff'] = stream.c.handoff.stats()
+    return jsonify(health)
 
 
 # Send timout data to frontend - used for if user not selected answer within timeframe
@@ -86,33 +168,202 @@ def BCI_data():
 @app.route('/timeout_data', methods=['POST', 'GET'])
 def timeout_data():
     t_data = stream.average_t()
-    print(t_data)
+    logger.info('timeout_data: %s', t_data)
     return str(t_data)
 
 
+# Send the early decision state of the current question (decision is None until confident)
+@app.route('/decision', methods=['POST', 'GET'])
+def decision():
+    return jsonify(stream.decision.state())
+
+
+# Send decision, time to decision and expected time to decision for every question
+@app.route('/decision_report', methods=['GET'])
+def decision_report():
+    return jsonify(stream.decision.report())
+
+
+# Set up server side answer selection with the geometry of the question page
+# {'x': dot start x, 'boxes': {'yes': [x, w], 'no': [x, w]}, 'strength': strength, 'interval': poll interval in ms}
+@app.route('/selection_setup', methods=['POST'])
+def selection_setup():
+    output = request.get_json()
+    stream.selection.configure(output['x'], output['boxes'], output['strength'], output['interval'] / 1000)
+    return ('', 204)  # Empty content return 
+
+
+# Send dot position and the answer events after cursor (sequence number of the last event the page received)
+@app.route('/selection', methods=['GET'])
+def selection():
+    stream.touch()
+    cursor = request.args.get('cursor', default=0, type=int)
+    return jsonify(stream.selection.state(cursor))
+
+
 # Update server (backend) with question number front end is currently on 
+# Sends the facial expression features of the previous question
 @app.route('/next_question', methods=['POST'])
 def next_question():
     output = request.get_json()
-    stream.set_question_number(output)
+    facial = stream.set_question_number(output)
     stream.clear_timeout()  # clear timout buffer
+    if facial is None:
+        return ('', 204)  # Empty content return 
+    return jsonify(facial)
+
+
+# Facial expression features of every question of the session (feature names, closed questions and current one)
+@app.route('/facial_features', methods=['GET'])
+def facial_features():
+    return jsonify(stream.facial_features())
+
+
+# Server clocked question timeline (see stimulus.py)
+# Start a test: POST {'questions': [0, 1, ...], 'timeout': 10000, 'gap': 0, 'delay': 0} (ms)
+@app.route('/stimulus_start', methods=['POST'])
+def stimulus_start():
+    output = request.get_json()
+    cursor = stream.stimulus.start(output['questions'], output['timeout'] / 1000, output.get('gap', 0) / 1000,
+                                   output.get('delay', 0) / 1000)
+    return jsonify({'cursor': cursor})  # events of this test come after the cursor
+
+
+# The page selected an answer: POST {'question': 3}
+@app.route('/stimulus_answer', methods=['POST'])
+def stimulus_answer():
+    stream.stimulus.answered(request.get_json()['question'])
     return ('', 204)  # Empty content return 
 
 
+# The page presented a question: POST {'seq': 12} (sequence number of the question event)
+@app.route('/stimulus_shown', methods=['POST'])
+def stimulus_shown():
+    stream.stimulus_shown(request.get_json()['seq'])
+    return ('', 204)  # Empty content return 
+
+
+# Question, timeout and done events pushed to the page (server sent events) - ?cursor= or Last-Event-ID to resume
+@app.route('/stimulus_events', methods=['GET'])
+def stimulus_events():
+    cursor = request.headers.get('Last-Event-ID', default=request.args.get('cursor', default=0, type=int), type=int)
+
+    def events(cursor):
+        while True:
+            new_events, cursor = stream.stimulus.wait_events(cursor)
+            if len(new_events) == 0:
+                yield ': keep-alive\n\n'
+            for event in new_events:
+                yield 'id: {0}\ndata: {1}\n\n'.format(event['seq'], json.dumps(event))
+                if event['type'] == 'done':
+                    return
+
+    return Response(events(cursor), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+# Switch and presentation jitter of every stimulus of the current test
+@app.route('/stimulus_report', methods=['GET'])
+def stimulus_report():
+    return jsonify(stream.stimulus.report())
+
+
 # save data sent from front send (user answers to question)
 @app.route('/save_data', methods=['POST'])
 def save_data():
     output = request.get_json()
-    f = open("user_answers/user_responses.txt", "a")
-    f.write(str(output) + '\n')
-    f.close()
+    if not stream.save_response(output):  # answer store, rows of the current session - committed before the 204
+        return make_response(jsonify({'error': 'answers could not be stored'}), 503)
     return ('', 204)  # Empty content return 
 
 
 
+# ------------------------------------------------------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------------------------------------------------------
+# Admin pages
+# Switch profiling on/off: POST {'enabled': true, 'interval_ms': 5, 'memory_interval_s': 300}
+# (memory_interval_s = 0 for no tracemalloc snapshots). Results are written to profiles/<session>/ when switched off
+@app.route('/admin/profiling', methods=['POST', 'GET'])
+def admin_profiling():
+    if request.method == 'POST':
+        output = request.get_json()
+        if output.get('enabled', False):
+            profiler.start(output.get('interval_ms', 5) / 1000, output.get('memory_interval_s', 0))
+        else:
+            profiler.stop()
+    return jsonify(profiler.status())
+
+
+# Say a text with ARI: POST {'text': 'Will a stone float on water?'}
+@app.route('/say', methods=['POST'])
+def say():
+    speech.say(request.get_json()['text'])
+    return ('', 204)  # Empty content return 
+
+
+# Speech latency and cache statistics
+@app.route('/admin/speech', methods=['GET'])
+def admin_speech():
+    return jsonify(speech.stats())
+
+
+# Sensitivity calibration: POST {} starts the guided trials - GET sends the current trial (cue) and results
+@app.route('/admin/calibration', methods=['POST', 'GET'])
+def admin_calibration():
+    if request.method == 'POST' and not stream.start_calibration():
+        return make_response(jsonify({'error': 'no profile loaded or streams not subscribed'}), 409)
+    return jsonify(stream.calibration.state())
+
+
+# Filter chain of the com power: POST {'stages': [{'type': 'ema', 'alpha': 0.3}, ...]} - GET sends the current chain
+@app.route('/admin/com_filters', methods=['POST', 'GET'])
+def admin_com_filters():
+    if request.method == 'POST':
+        try:
+            stream.set_com_filters(request.get_json().get('stages', []))
+        except (ValueError, TypeError) as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+    return jsonify(stream.com_filter.state())
+
+
+# Page phase, subscribed streams and the messages, bytes and CPU time saved by unsubscribing idle streams
+@app.route('/admin/subscriptions', methods=['GET'])
+def admin_subscriptions():
+    return jsonify(stream.subscription_state())
+
+
+# Cached static assets - hashed names, bytes per encoding and requests served
+@app.route('/admin/assets', methods=['GET'])
+def admin_assets():
+    return jsonify(assets.stats())
+
+
+# Recent log events: /logs?level=WARNING&limit=100
+@app.route('/logs', methods=['GET'])
+def logs():
+    level = request.args.get('level', default='NOTSET')
+    limit = request.args.get('limit', default=100, type=int)
+    try:
+        return jsonify(ring_handler.records(limit, level))
+    except ValueError as e:
+        return make_response(jsonify({'error': str(e)}), 400)
+
+
+# Log level per module: POST {'cortex': 'DEBUG', 'backend.live_advance': 'WARNING'} - GET sends the current levels
+@app.route('/admin/log_levels', methods=['POST', 'GET'])
+def admin_log_levels():
+    if request.method == 'POST':
+        try:
+            set_levels(request.get_json())
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+    return jsonify(get_levels())
+
+
+
 # ------------------------------------------------------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------------------------------------------------------
 if __name__ == '__main__':
+    stream.start_windows()  # aggregate the streamed data once per window
     threading.Thread(target=start_BCI_stream).start()
     threading.Thread(target=app.run(host='0.0.0.0')).start()
   
\ No newline at end of file
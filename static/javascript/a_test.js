@@ -9,6 +9,12 @@ var strength = 150  // strength is multiplied by power to determine how much the
 var req_interval = 500;  // How often to request data from sever ms
 var timeout_interval = 10000;  // How long to wait before timing out for each question/letter
 var timeout_interval_ID;  // timeout if no response within time frame
+var early_decision = true;  // Answer as soon as the backend is confident of the answer (before the timeout)
+var server_selection = true;  // Dot movement and answer selection run on the server at headset rate - page only renders
+var selection_cursor = 0;  // Sequence number of the last answer event received from the server
+var server_schedule = true;  // Letter switches and timeouts are clocked by the server - page follows its events
+var stimulus_source;  // Events of the letter timeline (server sent events)
+var answered = false;  // Current letter is answered, waiting for the server to switch to the next one
 
 var selected_word = 'SAVEAHAART';  // selected word (only use one for all participants as no learning is occurring)
 var current_letter = 0;  // current letter of word
@@ -30,38 +36,24 @@ var yes_box = document.getElementById('yes_box');
 // -----------------------------------------------------------------------------------------------------------------------------
 // ROS Bridge for ARI
 // Class and function to have front end sync to ARI (robot) - bridge front end and ARI
-const ROSLIB = window.ROSLIB;  // use roslib
+// Speech is sent through the backend (one rosbridge connection with a cache of the utterances, see ari_speech.py)
 class ROSApp {
     constructor() {
-        this.ros = new ROSLIB.Ros({
-            url : 'ws://ari-17c:9090'   // port for ari screen
-
-            // 'ws://ari-17c:9090' 
-            // 'ws://192.168.1.105:9090' 
-            //'ws://' + window.location.hostname + ':9090'
-
-        });
-
-        // client for voice 
-        this.ttsClient = new ROSLIB.ActionClient({
-            ros : this.ros,
-            serverName : '/tts',
-            actionName : 'pal_interaction_msgs/TtsAction'
-        });
+        this.last_say = $.when();  // requests are chained so ARI says the texts in order
     }
 
     // Function to send text to ari for text to speech 
     sayFrase(text) {
-        var goal = new ROSLIB.Goal({
-            actionClient : this.ttsClient,
-            goalMessage : {
-                rawtext: {
-                    text: text,
-                    lang_id: "en_GB"
-                }
-            }
+        this.last_say = this.last_say.then(function() {
+            return $.ajax({
+                type: 'POST',
+                url: '/say',
+                contentType: 'application/json',
+                data: JSON.stringify({text: text})
+            }).catch(function(error) {
+                console.log(error);
+            });
         });
-        goal.send();
     }
 };
     
@@ -85,6 +77,7 @@ window.addEventListener('load', () => {
 
     setup_dot();  // set up dot - place in middle of screen and initialise values
     setup_box_pos();  // Set x, y, width and height to yes and no boxes for collision detection
+    setup_selection();  // Send dot and box positions to the server for server side selection
     setup_letter()  // Add selected first letter of word on screen
 
 })
@@ -106,24 +99,49 @@ var req_interval_ID = setInterval(data_req, req_interval); // Run data request e
 var BCI_xhr = new XMLHttpRequest();
 var BCI_method = 'GET';
 var BCI_url = '/BCI_data'
+var BCI_cursor = -1;  // Sequence number of the last data window received (-1 to start from the newest window)
 var power = 0;  // BCI variable for how much to move dot
 
 // On data request successsfull update power using BCI stream
 BCI_xhr.onreadystatechange = function() {
   if (this.readyState == 4 && this.status == 200) {
-    power = parseFloat(this.response)
+    let rep = JSON.parse(this.response)
+    BCI_cursor = rep.cursor;  // only windows after this one are sent next time
+    power = rep.power
   }
 };
 
 // Function to request for BCI data and move dot
 function data_req() {
-    BCI_xhr.open(BCI_method, BCI_url, false);
+    BCI_xhr.open(BCI_method, BCI_url + '?cursor=' + BCI_cursor, false);
     BCI_xhr.send();
-    move_dot();  // move dot based on BCI data
+    if (server_selection) { render_selection(); }  // dot position and answers from the server
+    else { move_dot(); }  // move dot based on BCI data
+    check_decision();  // answer early if backend is confident
 }
 
 
  
+// Request the early decision of the current letter - answer if the backend is confident (sequential test)
+function check_decision() {
+    if (!early_decision) { return; }
+    $.ajax({
+        type: 'GET',
+        url: '/decision',
+        success: function(state) {
+            // Ignore decisions for an old letter (the answer may already be selected)
+            if (state != null && state.question == current_letter && (state.decision == 'yes' || state.decision == 'no')) {
+                answer_selection(state.decision);
+            }
+        },
+        error: function(error) {
+            console.log(error);
+        }
+    });
+}
+
+
+
 // -----------------------------------------------------------------------------------------------------------------------------
 // -----------------------------------------------------------------------------------------------------------------------------
 // Timeout function
@@ -162,6 +180,14 @@ function move_dot() {
 
 
 function answer_selection(ans) {
+    if (server_schedule) {
+        if (answered) { return; }  // one answer per letter
+        answered = true;
+        update_answer(ans);  // Record user answer
+        send_answered();  // server switches to the next letter
+        setup_dot();  // Reset the dot
+        return;
+    }
     clearTimeout(timeout_interval_ID) // rest timer for timout function
     update_answer(ans);  // Record user answer
     update_letter();  // Display new letter
@@ -170,6 +196,31 @@ function answer_selection(ans) {
 
 
 
+// Render the dot position computed by the server and select the answers it detected
+function render_selection() {
+    $.ajax({
+        type: 'GET',
+        url: '/selection',
+        data: {cursor: selection_cursor},
+        success: function(state) {
+            dot.style.left = state.x + 'px';  // dot x is the same as its left position
+            update_dot_pos();  // update dot position
+            // send update to server when this feature test is complete 
+            if (current_letter == selected_word.length) { next_test(); return; }
+            for (const event of state.events) {
+                selection_cursor = event.seq;
+                // Ignore answers for an old letter (the answer may already be selected)
+                if (event.question == current_letter) { answer_selection(event.answer); }
+            }
+        },
+        error: function(error) {
+            console.log(error);
+        }
+    });
+}
+
+
+
 // -----------------------------------------------------------------------------------------------------------------------------
 // -----------------------------------------------------------------------------------------------------------------------------
 // Choice detection - using circle-rectangle collision detection
@@ -188,9 +239,10 @@ function colision_detection(dot, box) {
 // Set up functions
 // Set up word on display
 function setup_letter(){  
+    if (server_schedule) { start_schedule(); return; }  // letters come from the server
     send_q_update()  // send current question to backend
     timeout_interval_ID = setTimeout(timeout, timeout_interval);
-    let x = JSON.stringify(selected_word.charAt(current_letter))  // current letter of word
+    let x = selected_word.charAt(current_letter)  // current letter of word
     ros_bridge.sayFrase(x)
 
 }
@@ -212,6 +264,26 @@ function setup_dot() {
 }
 
 
+// Send dot and box positions to the server (server side selection) - positions are in px like on the page
+function setup_selection() {
+    if (!server_selection) { return; }
+    $.ajax({
+        type: 'POST',
+        url: '/selection_setup',
+        contentType: 'application/json',
+        data: JSON.stringify({
+            x: dot.x,
+            boxes: {no: [no_box.x, no_box.w], yes: [yes_box.x, yes_box.w]},
+            strength: strength,
+            interval: req_interval
+        }),
+        error: function(error) {
+            console.log(error);
+        }
+    });
+}
+
+
 // Assign box (choices) values (x, y w, h)
 function setup_box_pos() {
     // set up yes box
@@ -242,7 +314,7 @@ function update_letter() {
     current_letter += 1;  // Update to next letter
     send_q_update()  // send current question to backend
     timeout_interval_ID = setTimeout(timeout, timeout_interval);
-    let x = JSON.stringify(selected_word.charAt(current_letter)) 
+    let x = selected_word.charAt(current_letter) 
     ros_bridge.sayFrase(x);   
 }
 
@@ -278,6 +350,7 @@ function update_answer(response) {
 // Server (backend) related functions
 // Send all updates to server when test is complete
 function next_test() {    
+    if (stimulus_source) { stimulus_source.close(); }  // no more letter events
     clearInterval(req_interval_ID)  // stop calling to server for BCI data
     clearTimeout(timeout_interval_ID)  // stop calling timeout
     save_answers()  // save user answers and scores to server
@@ -312,6 +385,69 @@ function save_answers() {
 }
 
 
+// Start the server clocked letter timeline and follow its events
+function start_schedule() {
+    $.ajax({
+        type: 'POST',
+        url: '/stimulus_start',
+        contentType: 'application/json',
+        data: JSON.stringify({questions: [...Array(selected_word.length).keys()], timeout: timeout_interval}),
+        success: function(rep) {
+            stimulus_source = new EventSource('/stimulus_events?cursor=' + rep.cursor);
+            stimulus_source.onmessage = function(message) { on_stimulus(JSON.parse(message.data)); };
+        },
+        error: function(error) {
+            console.log(error);
+        }
+    });
+}
+
+
+// Event of the letter timeline: next letter, timeout of the current letter or end of the test
+function on_stimulus(event) {
+    if (event.type == 'question') {
+        current_letter = event.question;
+        answered = false;
+        ros_bridge.sayFrase(selected_word.charAt(current_letter));
+        send_shown(event.seq);  // presentation latency
+    }
+    else if (event.type == 'timeout' && event.question == current_letter && !answered) {
+        answered = true;
+        update_answer(event.answer);  // answer from the timeout data of the server
+        setup_dot();
+    }
+    else if (event.type == 'done') {
+        next_test();
+    }
+}
+
+
+// Tell the server the current letter is answered / presented
+function send_answered() {
+    $.ajax({
+        type: 'POST',
+        url: '/stimulus_answer',
+        contentType: 'application/json',
+        data: JSON.stringify({question: current_letter}),
+        error: function(error) {
+            console.log(error);
+        }
+    });
+}
+
+function send_shown(seq) {
+    $.ajax({
+        type: 'POST',
+        url: '/stimulus_shown',
+        contentType: 'application/json',
+        data: JSON.stringify({seq: seq}),
+        error: function(error) {
+            console.log(error);
+        }
+    });
+}
+
+
 // Update server with current question (letter) number 
 function send_q_update() {
     $.ajax({
@@ -22,38 +22,24 @@ var enter_box = document.getElementById('enter_box');
 // -----------------------------------------------------------------------------------------------------------------------------
 // ROS Bridge for ARI
 // Class and function to have front end sync to ARI (robot) - bridge front end and ARI
-const ROSLIB = window.ROSLIB;  // use roslib
+// Speech is sent through the backend (one rosbridge connection with a cache of the utterances, see ari_speech.py)
 class ROSApp {
     constructor() {
-        this.ros = new ROSLIB.Ros({
-            url : 'ws://ari-17c:9090'   // port for ari screen
-
-            // 'ws://ari-17c:9090' 
-            // 'ws://192.168.1.105:9090' 
-            //'ws://' + window.location.hostname + ':9090'
-
-        });
-
-        // client for voice 
-        this.ttsClient = new ROSLIB.ActionClient({
-            ros : this.ros,
-            serverName : '/tts',
-            actionName : 'pal_interaction_msgs/TtsAction'
-        });
+        this.last_say = $.when();  // requests are chained so ARI says the texts in order
     }
 
     // Function to send text to ari for text to speech 
     sayFrase(text) {
-        var goal = new ROSLIB.Goal({
-            actionClient : this.ttsClient,
-            goalMessage : {
-                rawtext: {
-                    text: text,
-                    lang_id: "en_GB"
-                }
-            }
+        this.last_say = this.last_say.then(function() {
+            return $.ajax({
+                type: 'POST',
+                url: '/say',
+                contentType: 'application/json',
+                data: JSON.stringify({text: text})
+            }).catch(function(error) {
+                console.log(error);
+            });
         });
-        goal.send();
     }
 };
     
@@ -91,12 +77,15 @@ window.addEventListener('load', () => {
 var xhr = new XMLHttpRequest();
 var method = 'GET';
 var url = '/BCI_data'
+var cursor = -1  // Sequence number of the last data window received (-1 to start from the newest window)
 var power = 0;  // BCI variable for how much to move dot
 
 // On data request successful update power and action to BCI stream
 xhr.onreadystatechange = function() {
   if (this.readyState == 4 && this.status == 200) {
-    power = parseFloat(this.response)
+    let rep = JSON.parse(this.response)
+    cursor = rep.cursor  // only windows after this one are sent next time
+    power = rep.power
   }
 };
 
@@ -119,7 +108,7 @@ function move_dot() {
 
 // Function to request for BCI data and move dot
 function data_req() {
-    xhr.open(method, url, true);
+    xhr.open(method, url + '?cursor=' + cursor, true);
     xhr.send();
     move_dot();
 }
@@ -4,15 +4,21 @@
 // -----------------------------------------------------------------------------------------------------------------------------
 // -----------------------------------------------------------------------------------------------------------------------------
 // Page variables 
-var strength = 150  // strength is multiplied by power to determine how much the dot moves
+var strength = 100  // strength is multiplied by power to determine how much the dot moves (browser and server dot)
 var req_interval = 500  // request data interval time in ms
 var timeout_interval = 10000  // how long to wait before timing out in ms
 var timeout_interval_ID; 
+var early_decision = true  // Answer as soon as the backend is confident of the answer (before the timeout)
+var server_selection = true  // Dot movement and answer selection run on the server at headset rate - page only renders
+var selection_cursor = 0  // Sequence number of the last answer event received from the server
+var server_schedule = true  // Question switches and timeouts are clocked by the server - page follows its events
+var stimulus_source  // Events of the question timeline (server sent events)
+var answered = false  // Current question is answered, waiting for the server to switch to the next one
 
 // Questions
 var q1 = {question: 'Will a stone float on water?',          answer: 'no' };
 var q2 = {question: 'Are there fish in the sea?',            answer: 'yes'};
-var q3 = {question: 'Does one pound weight more than two?',  answer: 'no' };
+var q3 = {question: 'Does one pound weigh more than two pounds?', answer: 'no' };
 var q4 = {question: 'Can you use a hammer to pound a nail?', answer: 'yes'};
 var q_list = [q1.question, q2.question, q3.question, q4.question];  // List of all questions
 var q_answers = [q1.answer, q2.answer, q3.answer, q4.answer]    // List of answers
@@ -35,33 +41,24 @@ var yes_box = document.getElementById('yes_box');
 // -----------------------------------------------------------------------------------------------------------------------------
 // ROS Bridge for ARI
 // Class and function to have front end sync to ARI (robot) - bridge front end and ARI
-const ROSLIB = window.ROSLIB;  // use roslib
+// Speech is sent through the backend (one rosbridge connection with a cache of the utterances, see ari_speech.py)
 class ROSApp {
     constructor() {
-        this.ros = new ROSLIB.Ros({
-            url : 'ws://ari-17c:9090'  // port for ari screen
-        });
-
-        // client for voice 
-        this.ttsClient = new ROSLIB.ActionClient({
-            ros : this.ros,
-            serverName : '/tts',
-            actionName : 'pal_interaction_msgs/TtsAction'
-        });
+        this.last_say = $.when();  // requests are chained so ARI says the texts in order
     }
 
     // Function to send text to ari for text to speech 
     sayFrase(text) {
-        var goal = new ROSLIB.Goal({
-            actionClient : this.ttsClient,
-            goalMessage : {
-                rawtext: {
-                    text: text,
-                    lang_id: "en_GB"
-                }
-            }
+        this.last_say = this.last_say.then(function() {
+            return $.ajax({
+                type: 'POST',
+                url: '/say',
+                contentType: 'application/json',
+                data: JSON.stringify({text: text})
+            }).catch(function(error) {
+                console.log(error);
+            });
         });
-        goal.send();
     }
 };
     
@@ -84,6 +81,7 @@ window.addEventListener('load', () => {
     
     setup_dot();  // Set up dot - place in middle of screen and initialise values
     setup_box_pos();  // Set x, y, width and height to yes and no boxes for collision detection
+    setup_selection();  // Send dot and box positions to the server for server side selection
     setup_question()  // Add first question to screen
 })
 
@@ -103,22 +101,47 @@ var req_interval_ID = setInterval(data_req, req_interval); // Run data request e
 var xhr = new XMLHttpRequest();
 var method = 'GET';
 var url = '/BCI_data'
+var cursor = -1  // Sequence number of the last data window received (-1 to start from the newest window)
 var power = 0;  // BCI variable for how much to move dot
 
 
 // On data request successful update power and action to BCI stream
 xhr.onreadystatechange = function() {
   if (this.readyState == 4 && this.status == 200) {
-    power = parseFloat(this.response)
+    let rep = JSON.parse(this.response)
+    cursor = rep.cursor  // only windows after this one are sent next time
+    power = rep.power
   }
 };
 
 
 // Function to request for BCI data and move dot
 function data_req() {
-    xhr.open(method, url, true);
+    xhr.open(method, url + '?cursor=' + cursor, true);
     xhr.send();
-    move_dot();
+    if (server_selection) { render_selection(); }  // dot position and answers from the server
+    else { move_dot(); }
+    check_decision();  // answer early if backend is confident
+}
+
+
+
+// Request the early decision of the current question - answer if the backend is confident (sequential test)
+function check_decision() {
+    if (!early_decision) { return; }
+    $.ajax({
+        type: 'GET',
+        url: '/decision',
+        success: function(state) {
+            // Ignore decisions for an old question (the answer may already be selected)
+            if (state != null && state.question == 10 + parseInt(current_question) && (state.decision == 'yes' || state.decision == 'no')) {
+                answer_selection(state.decision);
+            }
+        },
+        error: function(error) {
+            console.log(error);
+        }
+    });
 }
 
 
@@ -145,7 +168,7 @@ function timeout() {
 // For dot movement and answer selection
 // Function to move dot by power in direction. Also updates postions and answer list accordingly 
 function move_dot() {
-    power = power * 100;  // increase power by factor of 100
+    power = power * strength;  // increase power by factor of strength
     dot.style.left = parseInt(dot.style.left) + power + 'px';  // Move dot by amount of power
     update_dot_pos();  // update dot position
     // send update to server when this feature test is complete 
@@ -157,6 +180,14 @@ function move_dot() {
 
 
 function answer_selection(ans) {
+    if (server_schedule) {
+        if (answered) { return; }  // one answer per question
+        answered = true;
+        update_answer(ans);  // Record user answer
+        send_answered();  // server switches to the next question
+        setup_dot();  // Reset the dot
+        return;
+    }
     clearTimeout(timeout_interval_ID) // rest timer for timout function
     update_answer(ans);  // Record user answer
     update_question();  // Display new question
@@ -165,6 +196,31 @@ function answer_selection(ans) {
 
 
 
+// Render the dot position computed by the server and select the answers it detected
+function render_selection() {
+    $.ajax({
+        type: 'GET',
+        url: '/selection',
+        data: {cursor: selection_cursor},
+        success: function(state) {
+            dot.style.left = state.x + 'px';  // dot x is the same as its left position
+            update_dot_pos();  // update dot position
+            // send update to server when this feature test is complete 
+            if (current_question == q_list.length) { next_test(); return; }
+            for (const event of state.events) {
+                selection_cursor = event.seq;
+                // Ignore answers for an old question (the answer may already be selected)
+                if (event.question == 10 + parseInt(current_question)) { answer_selection(event.answer); }
+            }
+        },
+        error: function(error) {
+            console.log(error);
+        }
+    });
+}
+
+
+
 // -----------------------------------------------------------------------------------------------------------------------------
 // -----------------------------------------------------------------------------------------------------------------------------
 // Choice detection - using circle-rectangle collision detection
@@ -183,6 +239,7 @@ function colision_detection(dot, box) {
 // Set up functions
 // Display the first question on the screen
 function setup_question(){    
+    if (server_schedule) { start_schedule(); return; }  // questions come from the server
     send_q_update()  // send current question to backend    
     timeout_interval_ID = setTimeout(timeout, timeout_interval);
     let x = q_list[current_question]
@@ -209,6 +266,26 @@ function setup_dot() {
     dot.r = document.getElementById("main_dot").offsetWidth / 2;
 }
 
+// Send dot and box positions to the server (server side selection) - positions are in px like on the page
+function setup_selection() {
+    if (!server_selection) { return; }
+    $.ajax({
+        type: 'POST',
+        url: '/selection_setup',
+        contentType: 'application/json',
+        data: JSON.stringify({
+            x: dot.x,
+            boxes: {no: [no_box.x, no_box.w], yes: [yes_box.x, yes_box.w]},
+            strength: strength,
+            interval: req_interval
+        }),
+        error: function(error) {
+            console.log(error);
+        }
+    });
+}
+
+
 // Assign box (choices) values (x, y w, h)
 function setup_box_pos() {
     // set up yes box
@@ -271,6 +348,7 @@ function update_answer(response) {
 // Server based functions
 // Send update to server when test is complete and move on to next page
 function next_test() {    
+    if (stimulus_source) { stimulus_source.close(); }  // no more question events
     clearInterval(req_interval_ID)  // stop calling to server for BCI data 
     clearInterval(timeout_interval_ID)  // stop calling timeout
     save_answers()  // save user answers and scores to server
@@ -302,6 +380,69 @@ function save_answers() {
 }
 
 
+// Start the server clocked question timeline and follow its events (+ 10 as there are 10 letters in 'A' test)
+function start_schedule() {
+    $.ajax({
+        type: 'POST',
+        url: '/stimulus_start',
+        contentType: 'application/json',
+        data: JSON.stringify({questions: q_list.map((q, i) => 10 + i), timeout: timeout_interval}),
+        success: function(rep) {
+            stimulus_source = new EventSource('/stimulus_events?cursor=' + rep.cursor);
+            stimulus_source.onmessage = function(message) { on_stimulus(JSON.parse(message.data)); };
+        },
+        error: function(error) {
+            console.log(error);
+        }
+    });
+}
+
+
+// Event of the question timeline: next question, timeout of the current question or end of the test
+function on_stimulus(event) {
+    if (event.type == 'question') {
+        current_question = event.question - 10;
+        answered = false;
+        ros_bridge.sayFrase(q_list[current_question]);
+        send_shown(event.seq);  // presentation latency
+    }
+    else if (event.type == 'timeout' && event.question == 10 + current_question && !answered) {
+        answered = true;
+        update_answer(event.answer);  // answer from the timeout data of the server
+        setup_dot();
+    }
+    else if (event.type == 'done') {
+        next_test();
+    }
+}
+
+
+// Tell the server the current question is answered / presented
+function send_answered() {
+    $.ajax({
+        type: 'POST',
+        url: '/stimulus_answer',
+        contentType: 'application/json',
+        data: JSON.stringify({question: 10 + current_question}),
+        error: function(error) {
+            console.log(error);
+        }
+    });
+}
+
+function send_shown(seq) {
+    $.ajax({
+        type: 'POST',
+        url: '/stimulus_shown',
+        contentType: 'application/json',
+        data: JSON.stringify({seq: seq}),
+        error: function(error) {
+            console.log(error);
+        }
+    });
+}
+
+
 // Update server with current question
 function send_q_update() {
     q = 10 + parseInt(current_question); 